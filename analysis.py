@@ -0,0 +1,202 @@
+import threading
+import collections
+import multiprocessing
+
+from renju import BOARD_SIZE
+from engine import Engine
+from threats import ThreatAnalyzer
+
+# 局面分析服务
+#
+# 客户端发送 analyze 请求后，服务器把局面交给这里的进程池计算最佳落子、评分和双方的威胁点，
+# 结果到达时由进程池的结果线程直接发给请求的连接，handle_client 只做一次字典查找和入队，不会被分析阻塞。
+# - 同时在排队或计算中的相同局面只计算一次，结果发给所有请求者（合并请求）；
+# - 结果按局面（规则 + 每个点的颜色）缓存，最近最少使用的先淘汰；
+# - 每次最多向进程池提交 workers 个任务，其余在本地排队，局面变化后排队中的任务直接取消，
+#   计算中的任务结果只进缓存、不再发送；排队的不同局面超过 max_pending 时拒绝新请求。
+
+MAX_PENDING = 64  # 排队和计算中的不同局面数上限
+CACHE_SIZE = 4096  # 缓存的分析结果数
+
+
+def position_key(moves, rule='standard'):
+    """局面的键：落子顺序不同、棋子相同的局面共用一个键"""
+    cells = bytearray(BOARD_SIZE * BOARD_SIZE)
+    for ply, (row, col) in enumerate(moves):
+        cells[row * BOARD_SIZE + col] = 1 + ply % 2
+    return rule, bytes(cells)
+
+
+def analyze(task):
+    """工作进程：分析 (规则, 落子列表) 之后的局面"""
+    rule, moves = task
+    engine = Engine(rule)
+    board = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    color = 'black'
+    for row, col in moves:
+        engine.place(row, col, color)
+        board[row][col] = color
+        color = 'white' if color == 'black' else 'black'
+    best = score = None
+    if len(moves) < BOARD_SIZE * BOARD_SIZE:
+        best = engine.choose(color)
+        if best is not None:
+            score = engine.score(best[0] * BOARD_SIZE + best[1], color)
+    threats = ThreatAnalyzer(rule)
+    threats.reset(board)
+    return {'to_move': color, 'best': best, 'score': score, 'threats': threats.analysis(color)}
+
+
+class AnalysisService:
+    """有界进程池上的局面分析，带请求合并、结果缓存和取消"""
+
+    def __init__(self, workers=1, max_pending=MAX_PENDING, cache_size=CACHE_SIZE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.pool = multiprocessing.Pool(workers)
+        self.lock = threading.Lock()
+        self.cache = collections.OrderedDict()  # 键 -> 结果，最近使用的在末尾
+        self.waiting = {}  # 排队或计算中的键 -> [(owner, callback), ...]
+        self.queue = collections.deque()  # 排队中的 (键, 任务)
+        self.active = set()  # 已提交给进程池的键
+        self.stats = collections.Counter()  # 请求、缓存命中、合并、计算、取消、拒绝的次数
+
+    def submit(self, moves, rule, callback, owner=None):
+        """请求分析 moves 之后的局面，结果（失败时为None）通过 callback 返回
+
+        返回 'cached'（已在当前线程调用 callback）、'coalesced'、'queued' 或 'busy'（被拒绝，不会调用 callback）。
+        owner 用于 cancel，通常是请求所在的房间。
+        """
+        key = position_key(moves, rule)
+        with self.lock:
+            self.stats['requests'] += 1
+            result = self.cache.get(key)
+            if result is None:
+                if key in self.waiting:
+                    self.waiting[key].append((owner, callback))
+                    self.stats['coalesced'] += 1
+                    return 'coalesced'
+                if len(self.waiting) >= self.max_pending:
+                    self.stats['rejected'] += 1
+                    return 'busy'
+                self.waiting[key] = [(owner, callback)]
+                self.queue.append((key, (rule, [tuple(move) for move in moves])))
+                self._dispatch()
+                return 'queued'
+            self.cache.move_to_end(key)
+            self.stats['cached'] += 1
+        callback(result)
+        return 'cached'
+
+    def cancel(self, owner):
+        """取消 owner 的所有请求（如房间里又下了一手），返回取消的请求数"""
+        cancelled = 0
+        with self.lock:
+            for key, waiters in list(self.waiting.items()):
+                kept = [waiter for waiter in waiters if waiter[0] != owner]
+                cancelled += len(waiters) - len(kept)
+                if kept or key in self.active:
+                    self.waiting[key] = kept
+                else:
+                    # 排队中的任务由 _dispatch 跳过
+                    del self.waiting[key]
+            self.stats['cancelled'] += cancelled
+        return cancelled
+
+    def _dispatch(self):
+        """持有锁时调用：在进程池有空位时提交排队中仍有人等待的任务"""
+        while self.queue and len(self.active) < self.workers:
+            key, task = self.queue.popleft()
+            if key in self.active or not self.waiting.get(key):
+                continue
+            self.active.add(key)
+            self.pool.apply_async(analyze, (task,), callback=lambda result, key=key: self._finish(key, result),
+                                  error_callback=lambda error, key=key: self._finish(key, None, error))
+
+    def _finish(self, key, result, error=None):
+        """进程池结果线程：缓存结果、通知所有等待者并提交下一个任务"""
+        with self.lock:
+            self.active.discard(key)
+            waiters = self.waiting.pop(key, [])
+            if result is not None:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                self.stats['computed'] += 1
+            self._dispatch()
+        if error is not None:
+            print(f"局面分析出错: {error}")
+        for _, callback in waiters:
+            try:
+                callback(result)
+            except Exception as e:
+                print(f"发送分析结果出错: {e}")
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def benchmark(positions=200, repeats=5, workers=1, seed=0):
+    """对比在接收线程中直接分析与提交给分析服务的耗时，并统计合并和缓存的效果"""
+    import random
+    import time
+
+    rng = random.Random(seed)
+    games = []
+    for _ in range(positions):
+        cells = rng.sample(range(BOARD_SIZE * BOARD_SIZE), rng.randint(10, 40))
+        games.append([divmod(cell, BOARD_SIZE) for cell in cells])
+
+    start = time.perf_counter()
+    for moves in games[:50]:
+        analyze(('standard', moves))
+    inline = (time.perf_counter() - start) / 50
+
+    service = AnalysisService(workers, max_pending=positions)
+    done = threading.Semaphore(0)
+    submit_time = 0.0
+    requests = 0
+    start = time.perf_counter()
+    # 每个局面连续请求 repeats 次：第一次入队，之后合并到同一个任务或命中缓存
+    for moves in games:
+        for _ in range(repeats):
+            begin = time.perf_counter()
+            service.submit(moves, 'standard', lambda result: done.release(), owner='benchmark')
+            submit_time += time.perf_counter() - begin
+            requests += 1
+    for _ in range(requests):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+
+    # 已经分析过的局面再次请求时直接命中缓存
+    start = time.perf_counter()
+    for moves in games:
+        service.submit(moves, 'standard', lambda result: None)
+    cached = (time.perf_counter() - start) / positions
+    stats = dict(service.stats)
+
+    # 局面变化后取消：提交后立即取消，排队中的任务不再计算
+    for moves in games:
+        service.submit(moves[:-1], 'standard', lambda result: None, owner='cancel')
+    service.cancel('cancel')
+    time.sleep(0.5)
+    computed = service.stats['computed'] - stats['computed']
+    service.close()
+
+    print(f"直接分析: {inline * 1000:.2f} ms/局面（在接收线程中执行时这段时间内无法处理落子）")
+    print(f"提交给分析服务: {submit_time / requests * 1e6:.1f} µs/请求，{requests} 个请求 {elapsed:.2f} 秒全部返回")
+    print(f"计算 {stats.get('computed', 0)} 次，合并 {stats.get('coalesced', 0)} 次，"
+          f"再次请求全部命中缓存 {cached * 1e6:.1f} µs/请求")
+    print(f"提交后立即取消 {positions} 个新局面：实际计算了 {computed} 个")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='局面分析服务的基准测试')
+    parser.add_argument('--positions', type=int, default=200)
+    parser.add_argument('--repeats', type=int, default=5, help='每个局面的请求次数')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+    benchmark(args.positions, args.repeats, args.workers)
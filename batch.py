@@ -0,0 +1,233 @@
+import itertools
+
+import numpy as np
+
+# 批量局面评估（需要 numpy）
+#
+# 输入 (N, 15, 15) 的 int8 数组，0=空、1=黑、2=白（与 renju 模块一致）。
+# 对四个方向分别取出所有长度为 L 的滑动窗口：窗口中第 i 个格子对应把棋盘切片平移 i 格，
+# 与 renju 的线编码一样把窗口内的格子按三进制组成编码（L=6 时不超过 3^6），
+# 再查预先算好的表得到棋型。表项把各棋型是否匹配放在 int32 的不同字节里，
+# 对一个方向的所有窗口求和就同时得到了各棋型的窗口个数（每个方向最多150个窗口，不会溢出一个字节）。
+# 棋盘外不参与任何窗口，相当于墙。统计的是匹配的窗口个数：
+#   五连   XXXXX  （长连会被计为多个五连窗口，胜负判断与 server.check_win 相同：五个及以上即赢）
+#   活四   _XXXX_
+#   活三   _ + 中间4格恰有3子1空 + _ （_XXX__、__XXX_、_XX_X_、_X_XX_；两侧都有空位的 _XXX_ 计为两个窗口）
+
+BOARD_SIZE = 15
+EMPTY, BLACK, WHITE = 0, 1, 2
+CHUNK_SIZE = 65536  # 每批处理的棋盘数，限制中间数组的内存
+
+
+def _build_tables():
+    """五格窗口表：字节0/1 为黑/白五连；六格窗口表：字节0/1 为黑活四/活三，字节2/3 为白活四/活三"""
+    five_table = np.zeros(3 ** 5, dtype=np.int32)
+    for digits in itertools.product((EMPTY, BLACK, WHITE), repeat=5):
+        code = sum(d * 3 ** i for i, d in enumerate(digits))
+        for byte, color in enumerate((BLACK, WHITE)):
+            if all(d == color for d in digits):
+                five_table[code] |= 1 << (8 * byte)
+    six_table = np.zeros(3 ** 6, dtype=np.int32)
+    for digits in itertools.product((EMPTY, BLACK, WHITE), repeat=6):
+        if digits[0] != EMPTY or digits[5] != EMPTY:
+            continue
+        code = sum(d * 3 ** i for i, d in enumerate(digits))
+        inner = digits[1:5]
+        for byte, color in enumerate((BLACK, WHITE)):
+            if inner.count(color) == 4:
+                six_table[code] |= 1 << (16 * byte)
+            elif inner.count(color) == 3 and inner.count(EMPTY) == 1:
+                six_table[code] |= 1 << (16 * byte + 8)
+    return five_table, six_table
+
+
+FIVE_TABLE, SIX_TABLE = _build_tables()
+
+
+def _shifts(mask, length):
+    """对四个方向返回长度为 length 的窗口中每个位置对应的平移切片列表"""
+    size = mask.shape[1]
+    span = size - length + 1
+    return [
+        [mask[:, :, i:span + i] for i in range(length)],  # 横
+        [mask[:, i:span + i, :] for i in range(length)],  # 竖
+        [mask[:, i:span + i, i:span + i] for i in range(length)],  # 主对角线
+        [mask[:, i:span + i, length - 1 - i:size - i] for i in range(length)],  # 副对角线
+    ]
+
+
+def _packed_counts(boards, length, table):
+    """对四个方向查表，返回每个棋盘各字节的窗口个数 (N, 4)"""
+    n = len(boards)
+    counts = np.zeros((n, 4), dtype=np.int32)
+    for shifted in _shifts(boards, length):
+        code = shifted[0].copy()
+        weight = 1
+        for s in shifted[1:]:
+            weight *= 3
+            code += s * weight
+        packed = table[code].reshape(n, -1).sum(axis=1)
+        for byte in range(4):
+            counts[:, byte] += (packed >> (8 * byte)) & 0xFF
+    return counts
+
+
+def _evaluate_chunk(boards):
+    boards = boards.astype(np.int16)
+    fives = _packed_counts(boards, 5, FIVE_TABLE)
+    sixes = _packed_counts(boards, 6, SIX_TABLE)
+    return {
+        'fives': fives[:, 0:2],
+        'open_fours': sixes[:, 0::2],
+        'threes': sixes[:, 1::2]
+    }
+
+
+def evaluate(boards, chunk_size=CHUNK_SIZE):
+    """批量评估局面
+
+    返回字典，每项第二维 0 为黑、1 为白：
+      'fives'、'open_fours'、'threes': (N, 2) int32 的窗口个数
+      'win': (N,) int8，0=无人获胜，1=黑，2=白，3=双方都有五连（非正常对局中的局面）
+    """
+    boards = np.asarray(boards, dtype=np.int8)
+    if boards.ndim == 2:
+        boards = boards[np.newaxis]
+    parts = [_evaluate_chunk(boards[start:start + chunk_size])
+             for start in range(0, len(boards), chunk_size)]
+    if parts:
+        result = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+    else:
+        result = {key: np.zeros((0, 2), dtype=np.int32) for key in ('fives', 'open_fours', 'threes')}
+    has_five = result['fives'] > 0
+    result['win'] = (has_five[:, 0] * BLACK + has_five[:, 1] * WHITE).astype(np.int8)
+    return result
+
+
+def win_flags(boards, chunk_size=CHUNK_SIZE):
+    """只判断胜负，返回 (N,) int8，含义同 evaluate 的 'win'"""
+    boards = np.asarray(boards, dtype=np.int8)
+    flags = np.zeros(len(boards), dtype=np.int8)
+    for start in range(0, len(boards), chunk_size):
+        chunk = boards[start:start + chunk_size]
+        for color in (BLACK, WHITE):
+            own = chunk == color
+            found = np.zeros(len(chunk), dtype=bool)
+            for shifted in _shifts(own, 5):
+                window = shifted[0].copy()
+                for s in shifted[1:]:
+                    window &= s
+                found |= window.any(axis=(1, 2))
+            flags[start:start + chunk_size] |= found.astype(np.int8) * color
+    return flags
+
+
+def to_array(board):
+    """服务器的二维棋盘（'black'/'white'/None）-> (15, 15) int8 数组"""
+    codes = {None: EMPTY, 'black': BLACK, 'white': WHITE}
+    return np.array([[codes[cell] for cell in row] for row in board], dtype=np.int8)
+
+
+def from_array(array):
+    """(15, 15) int8 数组 -> 服务器的二维棋盘"""
+    names = [None, 'black', 'white']
+    return [[names[cell] for cell in row] for row in array.tolist()]
+
+
+def random_boards(count, seed=0):
+    """生成不同疏密程度的随机局面，用于校验和基准测试"""
+    rng = np.random.default_rng(seed)
+    density = rng.uniform(0.05, 0.6, size=(count, 1, 1))
+    stones = rng.random((count, BOARD_SIZE, BOARD_SIZE)) < density
+    colors = rng.integers(BLACK, WHITE + 1, size=(count, BOARD_SIZE, BOARD_SIZE), dtype=np.int8)
+    return np.where(stones, colors, EMPTY).astype(np.int8)
+
+
+def _scalar_counts(board):
+    """逐格扫描的参考实现，返回 {棋型: [黑, 白]}"""
+    size = len(board)
+    counts = {'fives': [0, 0], 'open_fours': [0, 0], 'threes': [0, 0]}
+
+    def cell(r, c):
+        return board[r][c] if 0 <= r < size and 0 <= c < size else None
+
+    for dx, dy in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        for r in range(size):
+            for c in range(size):
+                for color in (BLACK, WHITE):
+                    index = color - 1
+                    line = [cell(r + i * dx, c + i * dy) for i in range(6)]
+                    if None not in line[:5] and all(v == color for v in line[:5]):
+                        counts['fives'][index] += 1
+                    if None in line:
+                        continue
+                    if line[0] == EMPTY and line[5] == EMPTY:
+                        inner = line[1:5]
+                        if inner.count(color) == 4:
+                            counts['open_fours'][index] += 1
+                        elif inner.count(color) == 3 and inner.count(EMPTY) == 1:
+                            counts['threes'][index] += 1
+    return counts
+
+
+def validate(count=2000, seed=1):
+    """与 server.check_win 和逐格扫描的参考实现对比，返回不一致的局面数"""
+    from server import check_win
+
+    boards = random_boards(count, seed)
+    result = evaluate(boards)
+    flags = win_flags(boards)
+    mismatches = 0
+    for n in range(count):
+        board = from_array(boards[n])
+        expected = 0
+        for row in range(BOARD_SIZE):
+            for col in range(BOARD_SIZE):
+                if board[row][col] and check_win(board, row, col):
+                    expected |= BLACK if board[row][col] == 'black' else WHITE
+        counts = _scalar_counts(boards[n].tolist()) if n < count // 10 else None
+        if result['win'][n] != expected or flags[n] != expected or (
+                counts and any(list(result[key][n]) != counts[key] for key in counts)):
+            mismatches += 1
+    return mismatches
+
+
+def benchmark(count=200000, seed=0):
+    """比较批量评估与逐格调用 check_win 的速度"""
+    import time
+    from server import check_win
+
+    boards = random_boards(count, seed)
+
+    start = time.perf_counter()
+    win_flags(boards)
+    flags_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    evaluate(boards)
+    evaluate_time = time.perf_counter() - start
+
+    sample = [from_array(board) for board in boards[:2000]]
+    start = time.perf_counter()
+    for board in sample:
+        for row in range(BOARD_SIZE):
+            for col in range(BOARD_SIZE):
+                if board[row][col]:
+                    check_win(board, row, col)
+    scalar_time = (time.perf_counter() - start) / len(sample)
+
+    print(f"{count} 个随机局面")
+    print(f"批量胜负判断: {flags_time:.2f} 秒，{count / flags_time:.0f} 局面/秒")
+    print(f"批量胜负 + 棋型统计: {evaluate_time:.2f} 秒，{count / evaluate_time:.0f} 局面/秒")
+    print(f"逐格调用 check_win: {1 / scalar_time:.0f} 局面/秒（批量胜负判断快 {scalar_time * count / flags_time:.0f} 倍）")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='批量局面评估')
+    parser.add_argument('--count', type=int, default=200000)
+    parser.add_argument('--validate', type=int, default=2000, help='校验的局面数')
+    args = parser.parse_args()
+    mismatches = validate(args.validate)
+    print(f"校验 {args.validate} 个局面，不一致 {mismatches} 个")
+    benchmark(args.count)
@@ -0,0 +1,282 @@
+import os
+import json
+import mmap
+import struct
+import zlib
+import threading
+import time
+
+# 检查点文件由若干条记录顺序追加而成，每条记录保存某一时刻所有进行中的对局：
+#   记录头: 魔数(4字节) + 负载长度(u32) + CRC32(u32)
+#   负载:   时间戳(u64 毫秒) + 对局数(u32) + 对局...
+#   对局:   房间编号、对局编号、黑方、白方（u16长度 + UTF-8）
+#           + 日志偏移(u64) + 手数(u16) + 每手一个字节(row * 15 + col)
+# 进程崩溃时最后一条记录可能不完整，恢复时通过CRC跳过它，使用上一条完整记录。
+MAGIC = b'GKCP'
+HEADER = struct.Struct('<4sII')
+PAYLOAD_HEADER = struct.Struct('<QI')
+GAME_TAIL = struct.Struct('<QH')
+STR_LEN = struct.Struct('<H')
+
+CHECKPOINT_INTERVAL = 5  # 写检查点的间隔（秒）
+MAX_FILE_SIZE = 64 * 1024 * 1024  # 超过该大小时压缩为只含最新记录的文件
+
+
+def _pack_str(value):
+    data = value.encode('utf-8')
+    return STR_LEN.pack(len(data)) + data
+
+
+def _unpack_str(buf, pos):
+    (length,) = STR_LEN.unpack_from(buf, pos)
+    pos += STR_LEN.size
+    return bytes(buf[pos:pos + length]).decode('utf-8'), pos + length
+
+
+def encode_games(games, timestamp=None):
+    """把对局快照列表编码为一条检查点记录"""
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    parts = [PAYLOAD_HEADER.pack(timestamp, len(games))]
+    for game in games:
+        parts.append(_pack_str(game['room_id']))
+        parts.append(_pack_str(game['game_id']))
+        parts.append(_pack_str(game['black']))
+        parts.append(_pack_str(game['white']))
+        parts.append(GAME_TAIL.pack(game['log_offset'], len(game['moves'])))
+        parts.append(game['moves'])
+    payload = b''.join(parts)
+    return HEADER.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_games(payload):
+    """解码一条检查点记录的负载，返回 (时间戳, 对局快照列表)"""
+    timestamp, count = PAYLOAD_HEADER.unpack_from(payload, 0)
+    pos = PAYLOAD_HEADER.size
+    games = []
+    for _ in range(count):
+        room_id, pos = _unpack_str(payload, pos)
+        game_id, pos = _unpack_str(payload, pos)
+        black, pos = _unpack_str(payload, pos)
+        white, pos = _unpack_str(payload, pos)
+        log_offset, move_count = GAME_TAIL.unpack_from(payload, pos)
+        pos += GAME_TAIL.size
+        games.append({
+            'room_id': room_id,
+            'game_id': game_id,
+            'black': black,
+            'white': white,
+            'log_offset': log_offset,
+            'moves': bytes(payload[pos:pos + move_count])
+        })
+        pos += move_count
+    return timestamp, games
+
+
+class CheckpointStore:
+    """只追加的检查点文件"""
+
+    def __init__(self, path, max_size=MAX_FILE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def append(self, games):
+        """追加一条检查点记录并刷到磁盘"""
+        record = encode_games(games)
+        with self.lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size + len(record) > self.max_size:
+                # 文件过大时重写为只含最新记录的文件，rename保证原子替换
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(record)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            else:
+                with open(self.path, 'ab') as f:
+                    f.write(record)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def load_latest(self):
+        """读取最后一条完整的检查点记录，返回对局快照列表"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return []
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                # 只遍历记录头找到所有记录的位置，再从后往前校验
+                offsets = []
+                pos = 0
+                while pos + HEADER.size <= len(buf):
+                    magic, length, _ = HEADER.unpack_from(buf, pos)
+                    if magic != MAGIC or pos + HEADER.size + length > len(buf):
+                        break
+                    offsets.append(pos)
+                    pos += HEADER.size + length
+
+                for pos in reversed(offsets):
+                    _, length, crc = HEADER.unpack_from(buf, pos)
+                    payload = buf[pos + HEADER.size:pos + HEADER.size + length]
+                    if zlib.crc32(payload) == crc:
+                        return decode_games(payload)[1]
+                    print(f"检查点记录损坏（偏移 {pos}），尝试上一条记录")
+        return []
+
+
+def replay_log_tail(game, log_dir):
+    """把检查点之后写入日志的事件补到快照上，对局已结束时返回None"""
+    log_file = os.path.join(log_dir, f"game_{game['game_id']}.json")
+    try:
+        if os.path.getsize(log_file) <= game['log_offset']:
+            return game
+        with open(log_file, 'rb') as f:
+            f.seek(game['log_offset'])
+            tail = f.read()
+    except FileNotFoundError:
+        return game
+
+    moves = bytearray(game['moves'])
+    occupied = set(moves)
+    offset = game['log_offset']
+    for line in tail.splitlines(keepends=True):
+        if not line.endswith(b'\n'):
+            break  # 崩溃时写了一半的行
+        offset += len(line)
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if event.get('game_id') != game['game_id']:
+            continue  # 旧版本按秒生成的编号可能让其他房间的对局写进同一个文件
+        event_type = event.get('event_type')
+        if event_type == 'move':
+            row, col = event['position']
+            cell = row * 15 + col
+            # 快照与日志之间可能有重叠，已存在的落子直接跳过
+            if cell not in occupied:
+                occupied.add(cell)
+                moves.append(cell)
+        elif event_type in ('game_end', 'player_disconnect', 'game_restart'):
+            return None
+    return dict(game, moves=bytes(moves), log_offset=offset)
+
+
+def recover(store, log_dir):
+    """从最新检查点和日志尾部恢复所有进行中的对局"""
+    games = []
+    for game in store.load_latest():
+        game = replay_log_tail(game, log_dir)
+        if game is not None:
+            games.append(game)
+    return games
+
+
+class CheckpointWriter:
+    """后台线程，定期为进行中的对局写检查点"""
+
+    def __init__(self, store, get_servers, interval=CHECKPOINT_INTERVAL):
+        self.store = store
+        self.get_servers = get_servers  # 返回当前所有 GomokuServer 的函数
+        self.interval = interval
+
+    def checkpoint(self):
+        games = []
+        for server in self.get_servers():
+            snapshot = server.snapshot()
+            if snapshot and snapshot['game_id']:
+                games.append(snapshot)
+        self.store.append(games)
+        return len(games)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"写检查点失败: {e}")
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def benchmark(game_count=10000, moves_per_game=40, tail_moves=4):
+    """测量有大量进行中对局时从检查点重启到可以服务的时间"""
+    import contextlib
+    import io
+    import random
+    import socket
+    import tempfile
+    from server import GomokuServer
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = os.path.join(tmp, 'game_logs')
+        os.makedirs(log_dir)
+        games = []
+        for i in range(game_count):
+            game_id = f"bench{i:06d}"
+            cells = rng.sample(range(225), moves_per_game)
+            lines = []
+            offset = 0
+            for ply, cell in enumerate(cells):
+                color = 'black' if ply % 2 == 0 else 'white'
+                lines.append(json.dumps({
+                    "timestamp": "2025-04-13 15:15:05", "event_type": "move", "game_id": game_id,
+                    "player": f"p{i}_{color}", "color": color, "position": list(divmod(cell, 15))
+                }, ensure_ascii=False).encode('utf-8') + b'\n')
+                if ply == moves_per_game - tail_moves - 1:
+                    offset = sum(len(line) for line in lines)
+            with open(os.path.join(log_dir, f"game_{game_id}.json"), 'wb') as f:
+                f.write(b''.join(lines))
+            # 检查点比日志落后 tail_moves 手，恢复时需要回放日志尾部
+            games.append({
+                'room_id': f"room{i}", 'game_id': game_id,
+                'black': f"p{i}_black", 'white': f"p{i}_white",
+                'moves': bytes(cells[:moves_per_game - tail_moves]), 'log_offset': offset
+            })
+
+        store = CheckpointStore(os.path.join(tmp, 'checkpoint.bin'))
+        start = time.perf_counter()
+        store.append(games)
+        write_time = time.perf_counter() - start
+        size = os.path.getsize(store.path)
+
+        start = time.perf_counter()
+        loaded = store.load_latest()
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recovered = recover(store, log_dir)
+        rooms = {}
+        # 房间恢复时逐条打印的提示会淹没结果，这里屏蔽
+        with contextlib.redirect_stdout(io.StringIO()):
+            for snapshot in recovered:
+                room = GomokuServer(room_id=snapshot['room_id'], listen=False, log_dir=log_dir)
+                room.restore(snapshot)
+                rooms[snapshot['room_id']] = room
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(128)
+        restart_time = time.perf_counter() - start
+        listener.close()
+
+        assert len(loaded) == game_count and len(rooms) == game_count
+        assert all(len(room.moves) == moves_per_game for room in rooms.values())
+        print(f"对局数: {game_count}，每局 {moves_per_game} 手，日志尾部 {tail_moves} 手")
+        print(f"检查点大小: {size / 1024:.1f} KB（{size / game_count:.1f} 字节/局），写入耗时 {write_time * 1000:.1f} ms")
+        print(f"读取检查点: {load_time * 1000:.1f} ms")
+        print(f"重启到可服务（恢复 + 回放日志尾部 + 重建房间 + 监听）: {restart_time * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='检查点恢复基准测试')
+    parser.add_argument('--games', type=int, default=10000)
+    args = parser.parse_args()
+    benchmark(args.games)
@@ -0,0 +1,268 @@
+import socket
+import threading
+import hashlib
+import os
+import signal
+import time
+
+from server import GomokuServer
+from checkpoint import CheckpointStore, CheckpointWriter, recover
+from protocol import first_message
+
+ROUTE_TIMEOUT = 10  # 等待客户端第一条消息的超时时间（秒）
+SWEEP_INTERVAL = 5  # 清理空房间的间隔（秒）
+CLAIM_ATTEMPTS = 100  # 认领房间时注册表文件刚好被删除，最多重试的次数
+
+
+class RoomRegistry:
+    """基于本地目录的房间注册表，记录每个房间由哪个工作进程负责"""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def _room_file(self, room_id):
+        digest = hashlib.sha1(room_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, f"room_{digest}")
+
+    def worker_address(self, worker_id):
+        """工作进程用于接收转交连接的Unix套接字路径"""
+        return os.path.join(self.path, f"worker_{worker_id}.sock")
+
+    def owner(self, room_id):
+        """查询房间所属的工作进程，不存在时返回None"""
+        try:
+            with open(self._room_file(room_id), encoding='utf-8') as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def claim(self, room_id, worker_id):
+        """认领房间，返回实际负责该房间的工作进程编号"""
+        path = self._room_file(room_id)
+        tmp_path = f"{path}.{worker_id}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(worker_id))
+        try:
+            for _ in range(CLAIM_ATTEMPTS):
+                try:
+                    # link 是原子操作，目标已存在时失败，保证只有一个进程认领成功
+                    os.link(tmp_path, path)
+                    return worker_id
+                except FileExistsError:
+                    owner = self.owner(room_id)
+                    # 读到None说明房间刚被所有者释放，重新尝试认领，不能直接当作自己的
+                    if owner is not None:
+                        return owner
+            raise OSError(f"无法认领房间 {room_id}：注册表文件 {path} 无法读取")
+        finally:
+            os.remove(tmp_path)
+
+    def release(self, room_id, worker_id):
+        """释放房间（只有房间所有者可以释放）"""
+        if self.owner(room_id) == worker_id:
+            try:
+                os.remove(self._room_file(room_id))
+            except FileNotFoundError:
+                pass
+
+    def release_worker(self, worker_id):
+        """释放某个工作进程拥有的全部房间，用于进程退出后的清理"""
+        for name in os.listdir(self.path):
+            if not name.startswith('room_') or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    if int(f.read()) == worker_id:
+                        os.remove(path)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    def clear(self):
+        """清空注册表"""
+        for name in os.listdir(self.path):
+            if name.startswith('room_') or name.startswith('worker_'):
+                os.remove(os.path.join(self.path, name))
+
+
+class Worker:
+    """工作进程：通过SO_REUSEPORT共享监听端口，并负责注册表中属于自己的房间"""
+
+    def __init__(self, worker_id, host, port, password, registry, checkpoint_dir=None, rule='standard',
+                 move_time=0, log_dir='game_logs'):
+        self.worker_id = worker_id
+        self.log_dir = log_dir  # 房间写日志、恢复时回放日志的目录
+        self.rule = rule
+        self.move_time = move_time
+        self.password = password
+        self.registry = registry
+        self.rooms = {}  # 房间编号 -> GomokuServer
+        self.rooms_lock = threading.Lock()
+
+        # 所有工作进程绑定同一个端口，由内核分配新连接
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.server.bind((host, port))
+        self.server.listen(128)
+
+        # 接收其他工作进程转交过来的连接
+        address = self.registry.worker_address(worker_id)
+        if os.path.exists(address):
+            os.remove(address)
+        self.handoff = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.handoff.bind(address)
+        print(f"工作进程 {worker_id}（pid {os.getpid()}）启动在 {host}:{port}")
+        
+        # 每个工作进程使用自己的检查点文件，重启后恢复原来负责的对局
+        self.checkpoint_store = None
+        if checkpoint_dir:
+            if not os.path.exists(checkpoint_dir):
+                os.makedirs(checkpoint_dir)
+            self.checkpoint_store = CheckpointStore(
+                os.path.join(checkpoint_dir, f"worker_{worker_id}.bin"))
+            self.recover_rooms()
+
+    def recover_rooms(self):
+        """从检查点恢复进行中的对局，并在注册表中重新认领对应房间"""
+        for snapshot in recover(self.checkpoint_store, self.log_dir):
+            if self.registry.claim(snapshot['room_id'], self.worker_id) != self.worker_id:
+                continue
+            self.get_room(snapshot['room_id']).restore(snapshot)
+
+    def get_room(self, room_id):
+        """获取（必要时创建）本进程负责的房间"""
+        with self.rooms_lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                room = GomokuServer(password=self.password, room_id=room_id, listen=False, rule=self.rule,
+                                    move_time=self.move_time, log_dir=self.log_dir)
+                self.rooms[room_id] = room
+            return room
+
+    def route(self, client_socket, addr):
+        """读取客户端的第一条消息，把连接交给房间所在的工作进程"""
+        try:
+            client_socket.settimeout(ROUTE_TIMEOUT)
+            data = client_socket.recv(1024)
+            client_socket.settimeout(None)
+            if not data:
+                client_socket.close()
+                return
+            room_id = str(first_message(data).get('room') or 'default')
+
+            owner = self.registry.claim(room_id, self.worker_id)
+            if owner == self.worker_id:
+                self.get_room(room_id).add_client(client_socket, addr, data)
+            else:
+                self.forward(client_socket, addr, data, owner, room_id)
+        except Exception as e:
+            print(f"路由客户端 {addr} 出错: {e}")
+            client_socket.close()
+
+    def forward(self, client_socket, addr, data, owner, room_id):
+        """通过Unix套接字把文件描述符和已读取的数据转交给房间所有者"""
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sender.connect(self.registry.worker_address(owner))
+            socket.send_fds(sender, [data], [client_socket.fileno()])
+        finally:
+            sender.close()
+            client_socket.close()
+        print(f"连接 {addr} 转交给工作进程 {owner}（房间 {room_id}）")
+
+    def receive_handoffs(self):
+        """接收其他工作进程转交的连接"""
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.handoff, 4096, 1)
+                if not fds:
+                    continue
+                client_socket = socket.socket(fileno=fds[0])
+            except Exception as e:
+                print(f"接收转交连接出错: {e}")
+                continue
+            try:
+                addr = client_socket.getpeername()
+                room_id = str(first_message(data).get('room') or 'default')
+                # 房间可能在转交途中被清理并由其他工作进程重新认领，此时继续转交给新的所有者，
+                # 不能在本进程再建一个同名房间
+                owner = self.registry.claim(room_id, self.worker_id)
+                if owner == self.worker_id:
+                    self.get_room(room_id).add_client(client_socket, addr, data)
+                else:
+                    self.forward(client_socket, addr, data, owner, room_id)
+            except Exception as e:
+                print(f"接收转交连接出错: {e}")
+                client_socket.close()
+
+    def sweep_rooms(self):
+        """定期释放没有玩家的房间"""
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            with self.rooms_lock:
+                for room_id, room in list(self.rooms.items()):
+                    if not room.clients and not room.resume_players:
+                        del self.rooms[room_id]
+                        self.registry.release(room_id, self.worker_id)
+                        room.close()
+
+    def start(self):
+        for target in (self.receive_handoffs, self.sweep_rooms):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        if self.checkpoint_store:
+            CheckpointWriter(self.checkpoint_store, lambda: list(self.rooms.values())).start()
+
+        while True:
+            try:
+                client_socket, addr = self.server.accept()
+                thread = threading.Thread(target=self.route, args=(client_socket, addr))
+                thread.daemon = True
+                thread.start()
+            except Exception as e:
+                print(f"接受客户端连接出错: {e}")
+
+
+def run_supervisor(host, port, password, workers, registry_path, checkpoint_dir=None, rule='standard',
+                   move_time=0, log_dir='game_logs'):
+    """启动多个工作进程并在其退出时重新拉起"""
+    registry = RoomRegistry(registry_path)
+    registry.clear()
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                Worker(worker_id, host, port, password, registry, checkpoint_dir, rule, move_time, log_dir).start()
+            finally:
+                os._exit(0)
+        return pid
+
+    children = {}
+    for worker_id in range(workers):
+        children[spawn(worker_id)] = worker_id
+    print(f"主进程 {os.getpid()} 已启动 {workers} 个工作进程")
+
+    try:
+        while True:
+            pid, _ = os.wait()
+            worker_id = children.pop(pid, None)
+            if worker_id is None:
+                continue
+            print(f"工作进程 {worker_id} 退出，重新启动")
+            registry.release_worker(worker_id)
+            children[spawn(worker_id)] = worker_id
+    except KeyboardInterrupt:
+        print("正在关闭工作进程...")
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        registry.clear()
@@ -0,0 +1,175 @@
+import random
+import itertools
+
+from renju import (PatternBoard, BOARD_SIZE, EMPTY, COLORS, FIVE, OVERLINE, FOUR_SHIFT, FREE_FOUR_SHIFT,
+                   THREE_EXACT, THREE_FREE, OFFSETS, HALF, OWN, OTHER, TABLE_SIZE)
+from solver import Solver, PRECHECK_NODES
+
+# 对弈引擎
+#
+# 一步搜索：对落子点附近的每个空点，查 renju 的线型表得到双方在这里落子后形成的棋型，
+# 按权重打分（进攻分 + 防守系数 * 对方在该点的进攻分），取最高分的点。
+# 冲四、活三之外，再用同一套线编码查“潜力表”：经过该点、不含对方棋子的五格窗口越多、
+# 窗口里己方棋子越多，分数越高，这样在形成活三之前也知道往哪里发展。
+# 能直接成五时一定成五，对方能成五时一定防守。棋盘和候选点都随落子增量更新。
+# 打分之前先用 solver 做一次有节点上限的 VCF 检查，有连续冲四取胜时直接走第一手。
+
+CANDIDATE_RANGE = 2  # 候选点为已有棋子周围这个距离内的空点
+WEIGHTS = {
+    'four': 1000,  # 每个冲四
+    'three': 100,  # 每个活三
+    'double': 5000,  # 双四或四三
+    'neighbor': 1,  # 每个相邻的棋子
+}
+WIN_SCORE = 10 ** 9
+WINDOW_SCORES = [0, 1, 4, 12, 30, 0]  # 五格窗口中（含落子点）己方棋子数 -> 潜力分，五连单独处理
+
+
+def _build_potential():
+    """线编码 -> 落子后经过中心的各个五格窗口的潜力分之和"""
+    table = [0] * TABLE_SIZE
+    for index, digits in enumerate(itertools.product((0, OWN, OTHER), repeat=len(OFFSETS))):
+        # itertools.product 最后一位变化最快，与线编码的低位对应关系相反
+        digits = digits[::-1]
+        line = list(digits[:HALF]) + [OWN] + list(digits[HALF:])
+        score = 0
+        for start in range(HALF - 4, HALF + 1):
+            window = line[start:start + 5]
+            if OTHER not in window:
+                score += WINDOW_SCORES[window.count(OWN)]
+        table[index] = score
+    return table
+
+
+_potential = None
+
+
+def get_potential():
+    """潜力表，第一次使用时生成"""
+    global _potential
+    if _potential is None:
+        _potential = _build_potential()
+    return _potential
+
+
+class Engine:
+    """基于棋型表的一步搜索引擎"""
+    name = 'engine'
+
+    def __init__(self, rule='standard', noise=0.0, defense=0.9, seed=None, vcf=PRECHECK_NODES, **weights):
+        self.rule = rule
+        self.noise = noise  # 随机扰动的幅度，用于产生不同的对局
+        self.defense = defense  # 防守分的系数
+        self.vcf = int(vcf)  # VCF 检查的节点上限，0 为不检查
+        self.solver = Solver(rule) if self.vcf else None
+        self.weights = dict(WEIGHTS)
+        self.weights.update(weights)
+        self.potential = get_potential()
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """开始新的一局"""
+        self.random = random.Random(seed)
+        self.board = PatternBoard()
+        self.candidates = set()
+        self.stones = 0
+        if self.solver:
+            self.solver.clear()
+            self.solver.setup()
+
+    def place(self, row, col, color):
+        """记录一手棋（包括对方的），color 为 'black' 或 'white'"""
+        cell = row * BOARD_SIZE + col
+        self.board.place(row, col, COLORS[color])
+        if self.solver:
+            self.solver.place(cell, COLORS[color])
+        self.stones += 1
+        self.candidates.discard(cell)
+        cells = self.board.cells
+        for r in range(max(row - CANDIDATE_RANGE, 0), min(row + CANDIDATE_RANGE + 1, BOARD_SIZE)):
+            for c in range(max(col - CANDIDATE_RANGE, 0), min(col + CANDIDATE_RANGE + 1, BOARD_SIZE)):
+                if cells[r * BOARD_SIZE + c] == EMPTY:
+                    self.candidates.add(r * BOARD_SIZE + c)
+
+    def patterns(self, cell, color):
+        """color 在 cell 落子后的 (是否成五, 冲四数, 活三数)"""
+        board = self.board
+        table = board.table
+        codes = board.codes[color]
+        flags = [table[codes[d][cell]] for d in range(4)]
+        if self.rule == 'renju' and color == COLORS['black']:
+            return (any(f & FIVE for f in flags),
+                    sum((f >> FOUR_SHIFT) & 3 for f in flags),
+                    sum(1 for f in flags if f & THREE_EXACT))
+        return (any(f & (FIVE | OVERLINE) for f in flags),
+                sum((f >> FREE_FOUR_SHIFT) & 3 for f in flags),
+                sum(1 for f in flags if f & THREE_FREE))
+
+    def attack_score(self, fours, threes):
+        weights = self.weights
+        score = fours * weights['four'] + threes * weights['three']
+        if fours >= 2 or (fours and threes):
+            score += weights['double']
+        return score
+
+    def legal(self, cell, color):
+        if self.board.cells[cell] != EMPTY:
+            return False
+        if self.rule == 'renju' and color == 'black':
+            return not self.board.forbidden(*divmod(cell, BOARD_SIZE))
+        return True
+
+    def neighbors(self, cell):
+        row, col = divmod(cell, BOARD_SIZE)
+        cells = self.board.cells
+        count = 0
+        for r in range(max(row - 1, 0), min(row + 2, BOARD_SIZE)):
+            for c in range(max(col - 1, 0), min(col + 2, BOARD_SIZE)):
+                if cells[r * BOARD_SIZE + c] != EMPTY:
+                    count += 1
+        return count
+
+    def score(self, cell, color):
+        """color 在 cell 落子的得分"""
+        own = COLORS[color]
+        other = 3 - own
+        five, fours, threes = self.patterns(cell, own)
+        if five:
+            return WIN_SCORE
+        block_five, block_fours, block_threes = self.patterns(cell, other)
+        if block_five:
+            return WIN_SCORE // 2
+        potential = self.potential
+        own_codes = self.board.codes[own]
+        other_codes = self.board.codes[other]
+        own_potential = sum(potential[own_codes[d][cell]] for d in range(4))
+        other_potential = sum(potential[other_codes[d][cell]] for d in range(4))
+        score = (self.attack_score(fours, threes) + own_potential +
+                 self.defense * (self.attack_score(block_fours, block_threes) + other_potential))
+        return score + self.weights['neighbor'] * self.neighbors(cell)
+
+    def choose(self, color):
+        """为 color 选择下一手，返回 (row, col)，没有可下的点（连珠规则下剩下的空点都是黑棋禁手）时返回None"""
+        if not self.stones:
+            center = BOARD_SIZE // 2
+            return center, center
+        if self.solver:
+            result = self.solver.search(color, 'vcf', self.vcf)
+            if result['result'] == 'win':
+                return result['line'][0][:2]
+        best = None
+        best_score = None
+        for cell in sorted(self.candidates):
+            if not self.legal(cell, color):
+                continue
+            score = self.score(cell, color)
+            if self.noise and score < WIN_SCORE // 2:
+                score *= 1 + self.noise * self.random.random()
+            if best_score is None or score > best_score:
+                best, best_score = cell, score
+        if best is None:
+            # 附近没有可下的点时随便找一个空点
+            best = next((cell for cell in range(BOARD_SIZE * BOARD_SIZE) if self.legal(cell, color)), None)
+            if best is None:
+                return None
+        return divmod(best, BOARD_SIZE)
@@ -0,0 +1,486 @@
+import os
+import json
+import math
+import operator
+import array
+import struct
+import time
+
+from renju import PatternBoard, BOARD_SIZE, EMPTY, BLACK, WHITE, COLORS, AFFECTED, OWN, OTHER, TABLE_SIZE
+from engine import Engine, WIN_SCORE
+from solver import PRECHECK_NODES
+
+# 查表的局面评估，权重从历史对局的胜负中学习
+#
+# 每个棋子在四个方向上各有一条线，取两侧各4个点（0=空、1=己方、2=对方或棋盘外）组成棋型，
+# 线反过来看是同一个棋型，共 PATTERN_COUNT 种。局面的评估值为
+#   黑棋每个棋子每个方向的棋型分之和 - 白棋的 + 轮到谁走的先手分（黑走为正），
+# 按 logistic 模型 P(黑胜) = 1 / (1 + e^-评估值) 与对局结果拟合。
+# renju.PatternBoard 已经为每个点维护了两侧各5个点的线编码，这里再预先算好“线编码 -> 棋型分”的表，
+# 评估时只查表，不判断棋型；落一子只影响经过它的4条线上的棋子，评估值按差量更新，撤销时减回去。
+# 训练（train，需要 numpy）读取 game_logs 日志、.gkr 棋谱和新的自我对弈对局，
+# 按对局划分训练集和验证集，全批量梯度下降后把权重量化为 int16 写入二进制文件。
+
+RADIUS = 4  # 棋型取两侧各几个点
+PATTERN_DIGITS = 2 * RADIUS
+WEIGHTS_FILE = 'pattern_weights.bin'
+WEIGHTS_MAGIC = b'GKPW'
+WEIGHTS_VERSION = 1
+WEIGHTS_HEADER = struct.Struct('<4sHHff')  # 标识、版本、棋型数、量化比例、先手分
+SCORE_SCALE = 10 ** 6  # 引擎把胜率乘以这个数作为落子得分
+L2 = 1e-2  # 棋型分的 L2 正则系数，很少出现的棋型分数接近0
+
+
+def _build_patterns():
+    """(两侧各4个点的编码 -> 棋型编号, 棋型数)，正反两个方向的编码对应同一个棋型"""
+    patterns = [0] * 3 ** PATTERN_DIGITS
+    classes = {}
+    for code in range(3 ** PATTERN_DIGITS):
+        digits = [code // 3 ** i % 3 for i in range(PATTERN_DIGITS)]
+        reverse = sum(d * 3 ** i for i, d in enumerate(reversed(digits)))
+        key = min(code, reverse)
+        if key not in classes:
+            classes[key] = len(classes)
+        patterns[code] = classes[key]
+    return patterns, len(classes)
+
+
+PATTERNS, PATTERN_COUNT = _build_patterns()
+_line_patterns = None
+
+
+def get_line_patterns():
+    """renju 线编码（两侧各5个点）-> 棋型编号的取值函数，第一次使用时生成"""
+    global _line_patterns
+    if _line_patterns is None:
+        # renju 的线编码从偏移 -5 到 +5 依次为三进制的低位到高位，去掉两端各一位即为这里的编码
+        _line_patterns = operator.itemgetter(*[PATTERNS[code // 3 % 3 ** PATTERN_DIGITS] for code in range(TABLE_SIZE)])
+    return _line_patterns
+
+
+class Weights:
+    """棋型分和先手分；scores 为按 renju 线编码（两侧各5个点）直接查的棋型分表"""
+
+    def __init__(self, pattern_scores, tempo=0.0):
+        self.pattern_scores = list(pattern_scores)
+        self.tempo = tempo
+        self.scores = list(get_line_patterns()(self.pattern_scores))
+
+    def save(self, path):
+        """量化为 int16 写入文件，返回文件字节数"""
+        largest = max((abs(score) for score in self.pattern_scores), default=0.0)
+        scale = largest / 32767 or 1.0
+        values = array.array('h', (round(score / scale) for score in self.pattern_scores))
+        if values.itemsize != 2:
+            raise RuntimeError("array('h') 不是16位")
+        if struct.pack('=h', 1) != struct.pack('<h', 1):
+            values.byteswap()
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(WEIGHTS_HEADER.pack(WEIGHTS_MAGIC, WEIGHTS_VERSION, len(values), scale, self.tempo))
+            f.write(values.tobytes())
+        os.replace(tmp, path)
+        return WEIGHTS_HEADER.size + len(values) * 2
+
+    @classmethod
+    def load(cls, path=WEIGHTS_FILE):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, count, scale, tempo = WEIGHTS_HEADER.unpack_from(data)
+        if magic != WEIGHTS_MAGIC or version != WEIGHTS_VERSION:
+            raise ValueError(f"{path} 不是棋型权重文件")
+        if count != PATTERN_COUNT or len(data) != WEIGHTS_HEADER.size + count * 2:
+            raise ValueError(f"{path} 的棋型数与当前版本不一致")
+        values = array.array('h')
+        values.frombytes(data[WEIGHTS_HEADER.size:])
+        if struct.pack('=h', 1) != struct.pack('<h', 1):
+            values.byteswap()
+        return cls([value * scale for value in values], tempo)
+
+
+class Evaluator:
+    """增量维护评估值的棋盘，place/remove 对应落子和撤销"""
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.scores = weights.scores
+        self.board = PatternBoard()
+        self.value = 0.0  # 不含先手分的评估值（黑方视角）
+
+    def delta(self, cell, color):
+        """color 在空点 cell 落子后评估值的变化（黑方视角），不改变棋盘"""
+        scores = self.scores
+        cells = self.board.cells
+        codes = self.board.codes
+        change = 0.0
+        for d in range(4):
+            black_d = codes[BLACK][d]
+            white_d = codes[WHITE][d]
+            for n, weight in AFFECTED[d][cell]:
+                stone = cells[n]
+                if stone == BLACK:
+                    code = black_d[n]
+                    change += scores[code + weight * (OWN if color == BLACK else OTHER)] - scores[code]
+                elif stone == WHITE:
+                    code = white_d[n]
+                    change -= scores[code + weight * (OWN if color == WHITE else OTHER)] - scores[code]
+        own = codes[color]
+        placed = scores[own[0][cell]] + scores[own[1][cell]] + scores[own[2][cell]] + scores[own[3][cell]]
+        return change + placed if color == BLACK else change - placed
+
+    def place(self, cell, color):
+        self.value += self.delta(cell, color)
+        self.board.place(*divmod(cell, BOARD_SIZE), color)
+
+    def remove(self, cell):
+        color = self.board.cells[cell]
+        self.board.remove(*divmod(cell, BOARD_SIZE))
+        self.value -= self.delta(cell, color)
+
+    def evaluate(self, to_move):
+        """轮到 to_move（BLACK/WHITE）走时黑方的评估值"""
+        return self.value + (self.weights.tempo if to_move == BLACK else -self.weights.tempo)
+
+
+def scan_evaluate(cells, weights):
+    """不用线编码、逐个棋子逐个方向数邻居的评估，用于校验和对比速度"""
+    directions = [(0, 1), (1, 0), (1, 1), (1, -1)]
+    value = 0.0
+    for cell, color in enumerate(cells):
+        if color == EMPTY:
+            continue
+        row, col = divmod(cell, BOARD_SIZE)
+        for dx, dy in directions:
+            code = 0
+            for i, k in enumerate([k for k in range(-RADIUS, RADIUS + 1) if k]):
+                r, c = row + k * dx, col + k * dy
+                if not (0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE):
+                    digit = OTHER
+                else:
+                    neighbor = cells[r * BOARD_SIZE + c]
+                    digit = EMPTY if neighbor == EMPTY else OWN if neighbor == color else OTHER
+                code += digit * 3 ** i
+            score = weights.pattern_scores[PATTERNS[code]]
+            value += score if color == BLACK else -score
+    return value
+
+
+class LearnedEngine(Engine):
+    """用学习到的棋型分给落子打分的引擎：能成五、必须挡五和 VCF 检查与 Engine 相同"""
+    name = 'learned'
+
+    def __init__(self, rule='standard', noise=0.0, seed=None, vcf=PRECHECK_NODES, weights=None):
+        if weights is None and not os.path.exists(WEIGHTS_FILE):
+            raise FileNotFoundError(f"没有 {WEIGHTS_FILE}，先运行 python evaluation.py train")
+        self.pattern_weights = weights or Weights.load()
+        super().__init__(rule, noise, seed=seed, vcf=vcf)
+
+    def reset(self, seed=None):
+        super().reset(seed)
+        self.evaluator = Evaluator(self.pattern_weights)
+
+    def place(self, row, col, color):
+        super().place(row, col, color)
+        self.evaluator.place(row * BOARD_SIZE + col, COLORS[color])
+
+    def score(self, cell, color):
+        own = COLORS[color]
+        other = 3 - own
+        five, _, _ = self.patterns(cell, own)
+        if five:
+            return WIN_SCORE
+        if self.patterns(cell, other)[0]:
+            return WIN_SCORE // 2
+        # 落子后轮到对方走时己方的胜率
+        value = self.evaluator.value + self.evaluator.delta(cell, own)
+        tempo = self.pattern_weights.tempo
+        value = value - tempo if own == BLACK else -value - tempo
+        return SCORE_SCALE / (1 + math.exp(-max(min(value, 50.0), -50.0)))
+
+
+def read_games(sources):
+    """从日志目录和 .gkr 棋谱中逐局读出 (落子格子列表, 胜方颜色)，没有结果的对局跳过"""
+    from record import read_records
+    for source in sources:
+        if source.endswith('.gkr'):
+            for record in read_records(source):
+                for _, event_type, extra in record['events']:
+                    if event_type == 'game_end' and extra[1] in COLORS:
+                        yield list(record['moves']), extra[1]
+            continue
+        if not os.path.isdir(source):
+            continue
+        for name in sorted(entry.name for entry in os.scandir(source) if entry.name.endswith('.json')):
+            cells = []
+            with open(os.path.join(source, name), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    event_type = event.get('event_type')
+                    if event_type in ('game_start', 'game_restart'):
+                        cells = []
+                    elif event_type == 'move':
+                        row, col = event['position']
+                        cells.append(row * BOARD_SIZE + col)
+                    elif event_type == 'game_end' and event.get('winner_color') in COLORS:
+                        yield cells, event['winner_color']
+                        cells = []
+
+
+def selfplay_games(count, rule='standard', seed=0, workers=None, spec='engine:noise=0.3'):
+    """并行下 count 局自我对弈，逐局返回 (落子格子列表, 胜方颜色)"""
+    import multiprocessing
+    from selfplay import play_batch, BATCH_SIZE
+    tasks = [(spec, spec, rule, seed, first, min(BATCH_SIZE, count - first)) for first in range(0, count, BATCH_SIZE)]
+    with multiprocessing.Pool(workers or os.cpu_count() or 1) as pool:
+        for games in pool.imap_unordered(play_batch, tasks):
+            for winner, game in games:
+                if winner:
+                    yield list(game['moves']), winner
+
+
+def extract_features(games):
+    """把对局展开成局面并提取棋型（需要 numpy）
+
+    games 为 [(落子格子列表, 胜方颜色), ...]，每局取第1手到倒数第2手之后的每个局面。
+    返回 (局面编号, 棋型编号, 符号) 三个数组、每个局面的先手（黑走为1、白走为-1）、结果（黑胜为1）和所属对局。
+    """
+    import numpy as np
+    digits = [k for k in range(-RADIUS, RADIUS + 1) if k]
+    patterns = np.array(PATTERNS, dtype=np.int32)
+    size = BOARD_SIZE + 2 * RADIUS
+    rows, cols, signs, tempo, labels, game_ids = [], [], [], [], [], []
+    count = 0
+    # 一次处理一批对局的所有局面
+    batch = []
+
+    def flush():
+        nonlocal count
+        if not batch:
+            return
+        boards = np.concatenate([boards for boards, _, _ in batch])
+        padded = np.full((len(boards), size, size), 3, dtype=np.int8)  # 3 表示棋盘外
+        padded[:, RADIUS:RADIUS + BOARD_SIZE, RADIUS:RADIUS + BOARD_SIZE] = boards.reshape(-1, BOARD_SIZE, BOARD_SIZE)
+        centre = padded[:, RADIUS:RADIUS + BOARD_SIZE, RADIUS:RADIUS + BOARD_SIZE]
+        for color, sign in ((BLACK, 1), (WHITE, -1)):
+            stones = centre == color
+            index = np.nonzero(stones)
+            for dx, dy in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                code = np.zeros(len(index[0]), dtype=np.int32)
+                for i, k in enumerate(digits):
+                    neighbor = padded[index[0], index[1] + RADIUS + k * dx, index[2] + RADIUS + k * dy]
+                    digit = np.where(neighbor == EMPTY, 0, np.where(neighbor == color, OWN, OTHER))
+                    code += digit.astype(np.int32) * 3 ** i
+                rows.append(index[0] + count)
+                cols.append(patterns[code])
+                signs.append(np.full(len(code), sign, dtype=np.int8))
+        for _, to_move, result in batch:
+            tempo.append(to_move)
+            labels.append(result)
+        count += len(boards)
+        batch.clear()
+
+    positions = 0
+    for game_index, (cells, winner) in enumerate(games):
+        cells = np.array(cells, dtype=np.int32)
+        n = len(cells)
+        if n < 2:
+            continue
+        order = np.full(BOARD_SIZE * BOARD_SIZE, n, dtype=np.int32)
+        order[cells] = np.arange(n)
+        colors = np.zeros(BOARD_SIZE * BOARD_SIZE, dtype=np.int8)
+        colors[cells] = np.where(np.arange(n) % 2 == 0, BLACK, WHITE)
+        plies = np.arange(1, n)
+        boards = np.where(order[None, :] < plies[:, None], colors[None, :], 0).astype(np.int8)
+        to_move = np.where(plies % 2 == 0, 1, -1).astype(np.int8)
+        batch.append((boards, to_move, np.full(len(plies), winner == 'black', dtype=np.float32)))
+        game_ids.append(np.full(len(plies), game_index, dtype=np.int32))
+        positions += len(plies)
+        if positions >= 20000:
+            flush()
+            positions = 0
+    flush()
+    if not count:
+        empty = np.zeros(0, dtype=np.int32)
+        return empty, empty, empty.astype(np.int8), empty.astype(np.int8), empty.astype(np.float32), empty
+    return (np.concatenate(rows), np.concatenate(cols), np.concatenate(signs), np.concatenate(tempo),
+            np.concatenate(labels), np.concatenate(game_ids))
+
+
+def fit(rows, cols, signs, tempo, labels, iterations=300, learning_rate=0.05, l2=L2, log=None):
+    """全批量 Adam 拟合 logistic 模型，返回 (棋型分数组, 先手分)（需要 numpy）"""
+    import numpy as np
+    positions = len(labels)
+    weights = np.zeros(PATTERN_COUNT + 1)  # 最后一个为先手分
+    moment = np.zeros_like(weights)
+    velocity = np.zeros_like(weights)
+    signs = signs.astype(np.float64)
+    tempo = tempo.astype(np.float64)
+    for step in range(1, iterations + 1):
+        value = np.bincount(rows, weights=weights[cols] * signs, minlength=positions) + weights[-1] * tempo
+        prob = 1 / (1 + np.exp(-np.clip(value, -50, 50)))
+        error = (prob - labels) / positions
+        gradient = np.empty_like(weights)
+        gradient[:-1] = np.bincount(cols, weights=error[rows] * signs, minlength=PATTERN_COUNT)
+        gradient[-1] = error @ tempo
+        gradient[:-1] += l2 * weights[:-1]
+        moment = 0.9 * moment + 0.1 * gradient
+        velocity = 0.999 * velocity + 0.001 * gradient ** 2
+        weights -= learning_rate * (moment / (1 - 0.9 ** step)) / (np.sqrt(velocity / (1 - 0.999 ** step)) + 1e-8)
+        if log and (step % log == 0 or step == iterations):
+            print(f"第 {step} 轮: 训练集对数损失 {log_loss(prob, labels):.4f}")
+    return weights[:-1], float(weights[-1])
+
+
+def log_loss(prob, labels):
+    import numpy as np
+    prob = np.clip(prob, 1e-7, 1 - 1e-7)
+    return float(-np.mean(labels * np.log(prob) + (1 - labels) * np.log(1 - prob)))
+
+
+def predict(rows, cols, signs, tempo, count, pattern_scores, tempo_score):
+    import numpy as np
+    value = np.bincount(rows, weights=pattern_scores[cols] * signs, minlength=count) + tempo_score * tempo
+    return 1 / (1 + np.exp(-np.clip(value, -50, 50)))
+
+
+def train(sources=('game_logs',), selfplay=0, output=WEIGHTS_FILE, rule='standard', iterations=300,
+          validation=0.1, seed=0, workers=None, l2=L2):
+    """从历史对局和自我对弈中学习棋型分，写入 output，返回统计字典（需要 numpy）"""
+    import numpy as np
+    start = time.perf_counter()
+    games = list(read_games(sources))
+    logged = len(games)
+    if selfplay:
+        games.extend(selfplay_games(selfplay, rule, seed, workers))
+    played = time.perf_counter()
+    rows, cols, signs, tempo, labels, game_ids = extract_features(games)
+    if not len(labels):
+        raise ValueError("没有可用的对局")
+    extracted = time.perf_counter()
+
+    # 按对局划分验证集，同一局的局面不会同时出现在两边
+    rng = np.random.default_rng(seed)
+    held_out = rng.random(len(games)) < validation
+    position_held = held_out[game_ids]
+    entry_held = position_held[rows]
+    train_index = np.nonzero(~position_held)[0]
+    remap = np.full(len(labels), -1, dtype=np.int64)
+    remap[train_index] = np.arange(len(train_index))
+    pattern_scores, tempo_score = fit(remap[rows[~entry_held]], cols[~entry_held], signs[~entry_held],
+                                      tempo[train_index], labels[train_index], iterations, l2=l2,
+                                      log=max(iterations // 5, 1))
+    fitted = time.perf_counter()
+
+    stats = {'games': len(games), 'logged': logged, 'positions': len(labels), 'train': len(train_index),
+             'read': played - start, 'extract': extracted - played, 'fit': fitted - extracted}
+    valid_index = np.nonzero(position_held)[0]
+    if len(valid_index):
+        remap[:] = -1
+        remap[valid_index] = np.arange(len(valid_index))
+        prob = predict(remap[rows[entry_held]], cols[entry_held], signs[entry_held], tempo[valid_index],
+                       len(valid_index), pattern_scores, tempo_score)
+        valid_labels = labels[valid_index]
+        base = float(np.mean(labels[train_index])) if len(train_index) else 0.5
+        stats.update(validation=len(valid_index), loss=log_loss(prob, valid_labels),
+                     baseline=log_loss(np.full(len(valid_index), base), valid_labels),
+                     accuracy=float(np.mean((prob > 0.5) == (valid_labels > 0.5))))
+    stats['bytes'] = Weights(pattern_scores.tolist(), tempo_score).save(output)
+    return stats
+
+
+def benchmark(path=WEIGHTS_FILE, games=20, seed=0):
+    """权重文件的载入耗时，以及增量评估与逐格数邻居的评估的速度对比"""
+    import random
+    from selfplay import make_policy, play_game
+
+    start = time.perf_counter()
+    get_line_patterns()
+    table_time = time.perf_counter() - start
+    start = time.perf_counter()
+    weights = Weights.load(path) if os.path.exists(path) else None
+    load_time = time.perf_counter() - start
+    if weights is None:
+        rng = random.Random(seed)
+        weights = Weights([rng.uniform(-1, 1) for _ in range(PATTERN_COUNT)], 0.1)
+        print(f"没有 {path}，使用随机权重")
+    else:
+        print(f"载入 {path}（{os.path.getsize(path)} 字节）: {load_time * 1000:.2f} ms"
+              f"（另有进程内第一次使用时的建表 {table_time * 1000:.1f} ms）")
+
+    black = make_policy('engine:noise=0.3,vcf=0')
+    white = make_policy('engine:noise=0.3,vcf=0')
+    records = [play_game(black, white, seed=seed * 1000 + index)[0] for index in range(games)]
+
+    # 每手落子后评估一次局面：增量更新 + 查表 vs 每次从头数一遍
+    incremental = scan = 0.0
+    positions = 0
+    worst = 0.0
+    for moves in records:
+        evaluator = Evaluator(weights)
+        cells = [EMPTY] * (BOARD_SIZE * BOARD_SIZE)
+        for ply, (row, col) in enumerate(moves):
+            cell = row * BOARD_SIZE + col
+            color = BLACK if ply % 2 == 0 else WHITE
+            begin = time.perf_counter()
+            evaluator.place(cell, color)
+            value = evaluator.value
+            incremental += time.perf_counter() - begin
+            cells[cell] = color
+            begin = time.perf_counter()
+            expected = scan_evaluate(cells, weights)
+            scan += time.perf_counter() - begin
+            worst = max(worst, abs(value - expected))
+            positions += 1
+        # 撤销到空棋盘后评估值回到0
+        for row, col in reversed(moves):
+            evaluator.remove(row * BOARD_SIZE + col)
+        worst = max(worst, abs(evaluator.value))
+    print(f"{positions} 个局面：增量评估 {incremental / positions * 1e6:.1f} µs/手，"
+          f"逐格数邻居 {scan / positions * 1e6:.1f} µs/局面，最大误差 {worst:.2e}")
+
+    # 给候选点打分：不落子，直接查表算出落子后的变化
+    evaluator = Evaluator(weights)
+    moves = records[0]
+    for ply, (row, col) in enumerate(moves[:len(moves) // 2]):
+        evaluator.place(row * BOARD_SIZE + col, BLACK if ply % 2 == 0 else WHITE)
+    empty = [cell for cell in range(BOARD_SIZE * BOARD_SIZE) if evaluator.board.cells[cell] == EMPTY]
+    start = time.perf_counter()
+    for cell in empty:
+        evaluator.delta(cell, BLACK)
+    print(f"候选点打分: {(time.perf_counter() - start) / len(empty) * 1e6:.1f} µs/点")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='查表的局面评估：训练棋型分和基准测试')
+    subparsers = parser.add_subparsers(dest='command')
+    train_parser = subparsers.add_parser('train', help='从历史对局和自我对弈学习棋型分（需要 numpy）')
+    train_parser.add_argument('sources', nargs='*', default=['game_logs'], help='日志目录或 .gkr 棋谱')
+    train_parser.add_argument('--selfplay', type=int, default=2000, help='另外进行的自我对弈局数')
+    train_parser.add_argument('--output', default=WEIGHTS_FILE)
+    train_parser.add_argument('--rule', choices=['standard', 'renju'], default='standard')
+    train_parser.add_argument('--iterations', type=int, default=300)
+    train_parser.add_argument('--validation', type=float, default=0.1, help='留作验证集的对局比例')
+    train_parser.add_argument('--l2', type=float, default=L2, help='L2 正则系数')
+    train_parser.add_argument('--seed', type=int, default=0)
+    train_parser.add_argument('--workers', type=int, default=None, help='自我对弈的进程数，默认为CPU核数')
+    benchmark_parser = subparsers.add_parser('benchmark', help='载入耗时和评估速度')
+    benchmark_parser.add_argument('--weights', default=WEIGHTS_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        stats = train(args.sources, args.selfplay, args.output, args.rule, args.iterations, args.validation,
+                      args.seed, args.workers, args.l2)
+        print(f"{stats['games']} 局（日志和棋谱 {stats['logged']} 局），{stats['positions']} 个局面；"
+              f"读取和自我对弈 {stats['read']:.1f} 秒，提取棋型 {stats['extract']:.1f} 秒，拟合 {stats['fit']:.1f} 秒")
+        if 'validation' in stats:
+            print(f"验证集 {stats['validation']} 个局面：对数损失 {stats['loss']:.4f}"
+                  f"（只用先验胜率 {stats['baseline']:.4f}），胜负预测准确率 {stats['accuracy']:.1%}")
+        print(f"权重写入 {args.output}（{stats['bytes']} 字节）")
+    elif args.command == 'benchmark':
+        benchmark(args.weights)
+    else:
+        parser.print_help()
@@ -6,6 +6,11 @@ import threading
 import os
 import time  # 添加时间模块用于光标闪烁
 
+from protocol import MessageReader, encode_message
+from threats import ThreatWorker
+from replay import GameList
+from positions import PositionIndex, INDEX_PATH
+
 # 初始化Pygame
 pygame.init()
 
@@ -14,6 +19,8 @@ BOARD_SIZE = 15  # 15x15的棋盘
 GRID_SIZE = 40   # 每个格子的大小
 MARGIN = 50      # 边距
 PIECE_RADIUS = 18  # 棋子半径
+HEARTBEAT_TIMEOUT = 45  # 超过该时间没有收到服务器的任何消息视为断线
+REPLAY_PAGE_SIZE = 10  # 棋谱列表每页显示的对局数
 
 # 计算窗口大小
 WINDOW_SIZE = BOARD_SIZE * GRID_SIZE + 2 * MARGIN
@@ -26,6 +33,7 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
 GRAY = (200, 200, 200)
+ORANGE = (255, 140, 0)
 
 # 创建窗口
 screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
@@ -74,7 +82,7 @@ except Exception as e:
     small_font = pygame.font.Font(None, 24)
 
 class GomokuClient:
-    def __init__(self, host=None, port=5000):
+    def __init__(self, host=None, port=5000, room=None):
         self.socket = None
         self.connected = False
         
@@ -95,6 +103,26 @@ class GomokuClient:
         self.password_input = ""  # 密码输入
         self.server_address = host or "localhost"  # 服务器地址
         self.server_port = port  # 服务器端口
+        self.room = room  # 房间编号（多进程服务器按房间分配连接）
+        self.rating = None  # 匹配大厅中的积分
+        self.queue_size = 0  # 匹配大厅中排队的人数
+        self.rule = 'standard'  # 对局规则
+        self.forbidden = []  # 连珠规则下黑棋的禁手点
+        self.move_time = 0  # 每手限时（秒），0 表示不限时
+        self.turn_started = 0  # 当前一手开始的时间，用于显示读秒
+        self.use_binary = True  # 认证时是否请求二进制协议
+        self.binary = False  # 服务器是否已确认使用二进制协议
+        self.pending_move = None  # 已经发出、等待服务器确认的一手 (row, col)，先画在棋盘上
+        self.show_threats = False  # 是否显示威胁提示
+        self.threat_worker = None  # 后台威胁分析线程，第一次打开提示时创建
+        self.server_analysis = None  # 服务器返回的局面分析结果
+        self.replay_games = None  # 棋谱回放的对局列表，进入回放时才开始扫描
+        self.replay_page = 0  # 对局列表当前页
+        self.replay = None  # 正在回放的对局
+        self.replay_ply = 0  # 回放到第几手
+        self.replay_board = None  # 回放中当前手数的棋盘
+        self.position_index = None  # 局面索引（存在 positions.idx 时载入）
+        self.replay_matches = None  # 棋库中走到过回放当前局面的对局统计
         self.has_voted_restart = False  # 是否已投票重新开始
         self.client_id = -1  # 客户端ID
         self.restart_votes = 0  # 重新开始的投票数
@@ -108,6 +136,8 @@ class GomokuClient:
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.server_address, self.server_port))
+            # 服务器每隔一段时间发送心跳，超过该时间没有收到任何数据说明连接已失效
+            self.socket.settimeout(HEARTBEAT_TIMEOUT)
             self.connected = True
             print(f"已连接到服务器: {self.server_address}:{self.server_port}")
             
@@ -128,12 +158,16 @@ class GomokuClient:
             return False
             
         try:
-            message = json.dumps({
+            message = {
                 'type': 'authentication',
                 'username': self.username,
                 'password': self.password_input
-            })
-            self.socket.send(message.encode('utf-8'))
+            }
+            if self.room:
+                message['room'] = self.room
+            if self.use_binary:
+                message['protocol'] = 'binary'
+            self.socket.send(json.dumps(message).encode('utf-8'))
             print(f"发送身份验证: 用户名={self.username}")
             return True
         except Exception as e:
@@ -142,67 +176,20 @@ class GomokuClient:
             return False
 
     def receive_data(self):
+        reader = MessageReader()
         while self.connected:
             try:
-                data = self.socket.recv(4096).decode('utf-8')
+                data = self.socket.recv(4096)
                 if not data:
                     break
                 
-                game_state = json.loads(data)
-                
-                # 处理错误消息
-                if 'error' in game_state:
-                    self.error_message = game_state['error']
-                    print(f"服务器错误: {self.error_message}")
-                    continue
-                
-                # 处理身份验证响应
-                if 'auth_success' in game_state:
-                    if game_state['auth_success']:
-                        print("身份验证成功")
-                        self.stage = game_state.get('stage', 'waiting_join')
-                    else:
-                        self.error_message = game_state.get('message', '身份验证失败')
-                        print(f"身份验证失败: {self.error_message}")
-                        self.stage = 'authentication'
-                        continue
-                
-                # 处理游戏阶段变更
-                if 'stage' in game_state:
-                    old_stage = self.stage
-                    self.stage = game_state['stage']
-                    
-                    # 如果阶段变为颜色选择，重置相关状态
-                    if self.stage == 'color_selection':
-                        self.selected_color = None  # 重置颜色选择
-                        self.is_ready = False  # 重置准备状态
-                        print("进入颜色选择阶段，重置颜色选择状态")
-                    
-                    print(f"游戏阶段从 {old_stage} 变更为 {self.stage}")
-                    
-                # 更新游戏状态
-                self.board = game_state.get('board', self.board)
-                self.current_player = game_state.get('current_player', self.current_player)
-                self.game_over = game_state.get('game_over', self.game_over)
-                self.winner = game_state.get('winner', self.winner)
-                self.game_started = game_state.get('game_started', self.game_started)
-                self.ready_players = game_state.get('ready_players', self.ready_players)
-                self.players = game_state.get('players', self.players)
-                self.restart_votes = game_state.get('restart_votes', 0)
-                
-                # 获取客户端ID
-                if 'client_id' in game_state and self.client_id == -1:
-                    self.client_id = game_state['client_id']
-                
-                # 如果服务器分配了颜色
-                if 'your_color' in game_state:
-                    self.my_color = game_state['your_color']
-                    print(f"服务器分配颜色: {self.my_color}")
-                    
-                # 重置重新开始投票状态
-                if old_stage == 'game_over' and self.stage == 'color_selection':
-                    self.has_voted_restart = False
+                for game_state in reader.feed(data):
+                    self.handle_message(game_state)
                 
+            except socket.timeout:
+                self.error_message = "服务器长时间无响应，连接已断开"
+                print(self.error_message)
+                break
             except Exception as e:
                 print(f"接收数据错误: {e}")
                 break
@@ -213,8 +200,171 @@ class GomokuClient:
         self.stage = 'server_connection'
         print("与服务器的连接已断开")
 
+    def handle_message(self, game_state):
+        """处理服务器发来的一条消息"""
+        # 回复服务器的心跳
+        if game_state.get('type') == 'ping':
+            self.socket.send(encode_message({'type': 'pong'}, self.binary))
+            return
+        if game_state.get('type') == 'pong':
+            return
+        
+        # 服务器拒绝了这一手，撤销预先显示的棋子
+        if game_state.get('type') == 'move_rejected':
+            if self.pending_move == (game_state.get('row'), game_state.get('col')):
+                self.pending_move = None
+            self.error_message = game_state.get('message', '落子被拒绝')
+            print(f"落子被拒绝: {self.error_message}")
+            return
+        
+        # 服务器的局面分析结果
+        if game_state.get('type') == 'analysis':
+            if 'error' in game_state:
+                self.error_message = game_state['error']
+            else:
+                self.server_analysis = game_state
+            return
+        
+        # 二进制协议下普通的一手棋只发送落子位置，轮到另一方下棋
+        if game_state.get('type') == 'placed':
+            self.board[game_state['row']][game_state['col']] = game_state['color']
+            self.current_player = 'white' if game_state['color'] == 'black' else 'black'
+            self.turn_started = time.time()
+            self.reconcile_move()
+            self.submit_analysis()
+            return
+        
+        # 处理错误消息
+        if 'error' in game_state:
+            self.error_message = game_state['error']
+            print(f"服务器错误: {self.error_message}")
+            return
+        
+        # 处理身份验证响应
+        if 'auth_success' in game_state:
+            if game_state['auth_success']:
+                print("身份验证成功")
+                self.binary = game_state.get('protocol') == 'binary'
+                self.stage = game_state.get('stage', 'waiting_join')
+            else:
+                self.error_message = game_state.get('message', '身份验证失败')
+                print(f"身份验证失败: {self.error_message}")
+                self.stage = 'authentication'
+                return
+        
+        # 处理游戏阶段变更
+        if 'stage' in game_state:
+            old_stage = self.stage
+            self.stage = game_state['stage']
+            
+            # 如果阶段变为颜色选择，重置相关状态
+            if self.stage == 'color_selection':
+                self.selected_color = None  # 重置颜色选择
+                self.is_ready = False  # 重置准备状态
+                print("进入颜色选择阶段，重置颜色选择状态")
+            
+            print(f"游戏阶段从 {old_stage} 变更为 {self.stage}")
+            
+        # 更新游戏状态
+        board = game_state.get('board', self.board)
+        current_player = game_state.get('current_player', self.current_player)
+        if board != self.board or current_player != self.current_player:
+            self.turn_started = time.time()
+        self.board = board
+        self.current_player = current_player
+        self.game_over = game_state.get('game_over', self.game_over)
+        self.winner = game_state.get('winner', self.winner)
+        self.game_started = game_state.get('game_started', self.game_started)
+        self.ready_players = game_state.get('ready_players', self.ready_players)
+        self.players = game_state.get('players', self.players)
+        self.restart_votes = game_state.get('restart_votes', 0)
+        self.rating = game_state.get('rating', self.rating)
+        self.queue_size = game_state.get('queue_size', 0)
+        self.rule = game_state.get('rule', self.rule)
+        self.forbidden = game_state.get('forbidden', self.forbidden)
+        self.move_time = game_state.get('move_time', self.move_time)
+        self.reconcile_move()
+        self.submit_analysis()
+        
+        # 获取客户端ID
+        if 'client_id' in game_state and self.client_id == -1:
+            self.client_id = game_state['client_id']
+        
+        # 如果服务器分配了颜色
+        if 'your_color' in game_state:
+            self.my_color = game_state['your_color']
+            print(f"服务器分配颜色: {self.my_color}")
+            
+        # 重置重新开始投票状态
+        if old_stage == 'game_over' and self.stage == 'color_selection':
+            self.has_voted_restart = False
+
+    def submit_analysis(self):
+        """把当前局面交给后台线程分析，结果由绘制循环读取"""
+        if self.show_threats and self.stage == 'playing':
+            self.threat_worker.submit(self.board, self.current_player, self.rule)
+
+    def toggle_threats(self):
+        """打开或关闭威胁提示"""
+        self.show_threats = not self.show_threats
+        if self.show_threats and self.threat_worker is None:
+            self.threat_worker = ThreatWorker(self.rule)
+        self.submit_analysis()
+
+    def request_server_analysis(self):
+        """请求服务器分析当前局面，结果稍后以 analysis 消息返回"""
+        if not self.connected or self.stage not in ('playing', 'game_over'):
+            return False
+        try:
+            self.socket.send(json.dumps({'type': 'analyze'}).encode('utf-8'))
+            return True
+        except Exception as e:
+            self.error_message = f"请求局面分析失败: {e}"
+            print(self.error_message)
+            return False
+
+    def open_replays(self):
+        """进入棋谱回放的对局列表"""
+        if self.replay_games is None:
+            self.replay_games = GameList()
+            if os.path.exists(INDEX_PATH + '.games'):
+                try:
+                    self.position_index = PositionIndex(INDEX_PATH)
+                except (OSError, ValueError) as e:
+                    print(f"无法载入局面索引: {e}")
+        self.error_message = ""
+        self.stage = 'replay_list'
+
+    def open_replay(self, entry):
+        """载入一局并从第一手之前开始回放"""
+        try:
+            self.replay = entry.load()
+        except (OSError, ValueError, KeyError) as e:
+            self.error_message = f"无法载入对局: {e}"
+            return
+        self.error_message = ""
+        self.stage = 'replay'
+        self.seek_replay(0)
+
+    def seek_replay(self, ply):
+        """跳到第 ply 手之后的局面"""
+        self.replay_ply = max(0, min(ply, len(self.replay)))
+        self.replay_board = self.replay.board_at(self.replay_ply)
+        if self.position_index:
+            self.replay_matches = self.position_index.summary(self.replay.moves[:self.replay_ply])
+
+    def reconcile_move(self):
+        """收到服务器的状态后，确认或丢弃预先显示的棋子"""
+        if self.pending_move is None:
+            return
+        row, col = self.pending_move
+        # 该位置已经有了服务器确认的棋子，或者已经不再轮到自己
+        if (self.board[row][col] is not None or self.stage != 'playing' or
+                self.current_player != self.my_color or self.game_over):
+            self.pending_move = None
+
     def send_move(self, row, col):
-        """发送移动信号"""
+        """发送移动信号，在服务器确认前先把棋子画出来"""
         # 只有在轮到自己的时候才能下棋
         if not self.connected:
             return
@@ -222,16 +372,20 @@ class GomokuClient:
         if (self.stage == 'playing' and 
             self.current_player == self.my_color and 
             not self.game_over and 
+            self.pending_move is None and
             self.board[row][col] is None):
             try:
-                message = json.dumps({
+                message = encode_message({
                     'type': 'move',
                     'row': row,
                     'col': col
-                })
-                self.socket.send(message.encode('utf-8'))
+                }, self.binary)
+                self.pending_move = (row, col)
+                self.error_message = ""
+                self.socket.send(message)
                 print(f"发送移动: 行={row}, 列={col}")
             except Exception as e:
+                self.pending_move = None
                 print(f"发送移动失败: {e}")
 
     def select_color(self, color):
@@ -335,6 +489,92 @@ def draw_pieces(game):
                 color = BLACK if game.board[row][col] == 'black' else WHITE
                 center = (MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE)
                 pygame.draw.circle(screen, color, center, PIECE_RADIUS)
+    
+    # 等待服务器确认的棋子加一圈灰色边框
+    pending = game.pending_move
+    if pending and game.board[pending[0]][pending[1]] is None:
+        row, col = pending
+        color = BLACK if game.my_color == 'black' else WHITE
+        center = (MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE)
+        pygame.draw.circle(screen, color, center, PIECE_RADIUS)
+        pygame.draw.circle(screen, GRAY, center, PIECE_RADIUS, 3)
+    
+    # 连珠规则下轮到黑棋时，用红叉标出禁手点
+    if game.rule == 'renju' and game.current_player == 'black' and not game.game_over:
+        size = PIECE_RADIUS // 2
+        for row, col in game.forbidden:
+            x, y = MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE
+            pygame.draw.line(screen, RED, (x - size, y - size), (x + size, y + size), 3)
+            pygame.draw.line(screen, RED, (x - size, y + size), (x + size, y - size), 3)
+
+def draw_threats(game):
+    """绘制后台线程最新的威胁分析结果"""
+    result = game.threat_worker.result if game.threat_worker else None
+    if not result:
+        return
+    # 必须防守的点画红圈
+    for row, col in result['forced']:
+        if game.board[row][col] is None:
+            center = (MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE)
+            pygame.draw.circle(screen, RED, center, PIECE_RADIUS, 2)
+    # 成五、冲四、活三点用红、橙、蓝色小圆点标出，边框颜色表示是哪一方的威胁，黑方偏左、白方偏右
+    level_colors = {'win': RED, 'four': ORANGE, 'three': BLUE}
+    for color, offset, border in (('black', -7, BLACK), ('white', 7, WHITE)):
+        for level, level_color in level_colors.items():
+            for row, col in result[color][level]:
+                if game.board[row][col] is None:
+                    center = (MARGIN + col * GRID_SIZE + offset, MARGIN + row * GRID_SIZE)
+                    pygame.draw.circle(screen, level_color, center, 5)
+                    pygame.draw.circle(screen, border, center, 5, 1)
+
+def draw_server_analysis(game):
+    """绘制服务器对当前局面的分析：最佳落子点画绿圈，底部显示评分"""
+    result = game.server_analysis
+    stones = sum(1 for row in game.board for cell in row if cell)
+    if not result or result.get('ply') != stones:
+        return  # 还没有结果，或者结果对应的局面已经过时
+    if result.get('best'):
+        row, col = result['best']
+        center = (MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE)
+        pygame.draw.circle(screen, GREEN, center, PIECE_RADIUS, 3)
+    side = "黑方" if result.get('to_move') == 'black' else "白方"
+    text_surface = small_font.render(f"{side}最佳: {result.get('best')} 评分 {result.get('score') or 0:.0f}", True, BLUE)
+    screen.blit(text_surface, text_surface.get_rect(midright=(WINDOW_SIZE - 20, WINDOW_SIZE - 20)))
+
+def replay_slider():
+    """回放进度条的位置"""
+    return pygame.Rect(MARGIN, WINDOW_SIZE - 22, WINDOW_SIZE - 2 * MARGIN, 12)
+
+def draw_replay(game):
+    """绘制回放中的棋盘、最后一手标记和进度条"""
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            if game.replay_board[row][col]:
+                color = BLACK if game.replay_board[row][col] == 'black' else WHITE
+                center = (MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE)
+                pygame.draw.circle(screen, color, center, PIECE_RADIUS)
+
+    # 最后一手画红点
+    last = game.replay.last_move(game.replay_ply)
+    if last:
+        pygame.draw.circle(screen, RED, (MARGIN + last[1] * GRID_SIZE, MARGIN + last[0] * GRID_SIZE), 5)
+
+    # 棋库中走到过这个局面的对局：最常见的几个下一手画绿点，上方显示胜负统计
+    matches = game.replay_matches
+    if matches and matches['games']:
+        for row, col in list(matches['next'])[:3]:
+            pygame.draw.circle(screen, GREEN, (MARGIN + col * GRID_SIZE, MARGIN + row * GRID_SIZE), 6)
+        text = f"棋库中 {matches['games']} 局走到过此局面：黑胜 {matches['black']}，白胜 {matches['white']}"
+        text_surface = small_font.render(text, True, BLUE)
+        screen.blit(text_surface, text_surface.get_rect(center=(WINDOW_SIZE // 2, WINDOW_SIZE - 38)))
+
+    # 进度条
+    slider = replay_slider()
+    pygame.draw.rect(screen, GRAY, slider)
+    if len(game.replay):
+        filled = slider.width * game.replay_ply // len(game.replay)
+        pygame.draw.rect(screen, BLUE, (slider.x, slider.y, filled, slider.height))
+    pygame.draw.rect(screen, BLACK, slider, 1)
 
 def draw_button(text, x, y, width, height, color, text_color=BLACK, disabled=False):
     """绘制按钮"""
@@ -377,8 +617,8 @@ def draw_input_box(text, x, y, width, height, active, cursor_visible=False):
     
     return pygame.Rect(x, y, width, height)
 
-def main():
-    game = GomokuClient()
+def main(host=None, port=5000, room=None):
+    game = GomokuClient(host, port, room)
     clock = pygame.time.Clock()
     
     # 初始化UI元素
@@ -395,6 +635,13 @@ def main():
     ready_button = pygame.Rect(WINDOW_SIZE//2 - 50, WINDOW_SIZE//2 + 40, 100, 40)
     restart_button = pygame.Rect(WINDOW_SIZE//2 - 70, WINDOW_SIZE//2 + 60, 140, 40)
     
+    # 棋谱回放的按钮和对局列表
+    replay_button = pygame.Rect(WINDOW_SIZE//2 - 80, WINDOW_SIZE//2 + 200, 160, 40)
+    prev_page_button = pygame.Rect(WINDOW_SIZE//2 - 230, WINDOW_SIZE - 80, 140, 40)
+    back_button = pygame.Rect(WINDOW_SIZE//2 - 70, WINDOW_SIZE - 80, 140, 40)
+    next_page_button = pygame.Rect(WINDOW_SIZE//2 + 90, WINDOW_SIZE - 80, 140, 40)
+    replay_rows = [pygame.Rect(MARGIN, 90 + i * 45, WINDOW_SIZE - 2 * MARGIN, 40) for i in range(REPLAY_PAGE_SIZE)]
+    
     # 光标闪烁计时器
     cursor_timer = 0
 
@@ -427,6 +674,30 @@ def main():
                             if game.connect_to_server():
                                 game.stage = 'authentication'
                                 game.send_authentication()
+                    elif replay_button.collidepoint(x, y):
+                        game.open_replays()
+                
+                # 棋谱列表：点击一局开始回放
+                elif game.stage == 'replay_list':
+                    start = game.replay_page * REPLAY_PAGE_SIZE
+                    entries = game.replay_games.page(start, REPLAY_PAGE_SIZE)
+                    for rect, entry in zip(replay_rows, entries):
+                        if rect.collidepoint(x, y):
+                            game.open_replay(entry)
+                            break
+                    else:
+                        if prev_page_button.collidepoint(x, y) and game.replay_page > 0:
+                            game.replay_page -= 1
+                        elif next_page_button.collidepoint(x, y) and game.replay_games.has_more(start + REPLAY_PAGE_SIZE):
+                            game.replay_page += 1
+                        elif back_button.collidepoint(x, y):
+                            game.stage = 'server_connection'
+                
+                # 回放中点击进度条跳转
+                elif game.stage == 'replay':
+                    slider = replay_slider()
+                    if slider.inflate(0, 16).collidepoint(x, y):
+                        game.seek_replay(round((x - slider.x) * len(game.replay) / slider.width))
                 
                 # 身份验证阶段 - 已在连接时处理
                 
@@ -466,6 +737,13 @@ def main():
                     if restart_button.collidepoint(x, y):
                         game.vote_restart()
             
+            # 按住鼠标拖动进度条
+            elif event.type == pygame.MOUSEMOTION:
+                if game.stage == 'replay' and event.buttons[0]:
+                    slider = replay_slider()
+                    if slider.inflate(0, 16).collidepoint(event.pos):
+                        game.seek_replay(round((event.pos[0] - slider.x) * len(game.replay) / slider.width))
+            
             elif event.type == pygame.KEYDOWN:
                 # 服务器连接阶段的输入处理
                 if game.stage == 'server_connection':
@@ -486,6 +764,29 @@ def main():
                         elif game.input_focus == "password":
                             game.password_input = game.password_input[:-1]
                     # 注意：这里不再处理回车键，完全依赖按钮点击提交
+                
+                # 对局中按H键打开或关闭威胁提示
+                elif game.stage == 'playing' and event.key == pygame.K_h:
+                    game.toggle_threats()
+                
+                # 对局中和对局结束后按A键请求服务器分析当前局面
+                elif game.stage in ('playing', 'game_over') and event.key == pygame.K_a:
+                    game.request_server_analysis()
+                
+                # 回放中用方向键单步、翻页键每次10手、Home/End跳到开头结尾，Esc返回列表
+                elif game.stage == 'replay':
+                    steps = {pygame.K_LEFT: -1, pygame.K_RIGHT: 1, pygame.K_PAGEUP: -10, pygame.K_PAGEDOWN: 10}
+                    if event.key in steps:
+                        game.seek_replay(game.replay_ply + steps[event.key])
+                    elif event.key == pygame.K_HOME:
+                        game.seek_replay(0)
+                    elif event.key == pygame.K_END:
+                        game.seek_replay(len(game.replay))
+                    elif event.key == pygame.K_ESCAPE:
+                        game.stage = 'replay_list'
+                
+                elif game.stage == 'replay_list' and event.key == pygame.K_ESCAPE:
+                    game.stage = 'server_connection'
             
             # 处理文本输入事件，对中文输入更友好
             elif event.type == pygame.TEXTINPUT:
@@ -551,12 +852,55 @@ def main():
                        connect_button.width, connect_button.height, 
                        GREEN, BLACK, connect_disabled)
             
+            # 不连接服务器也可以回放本地棋谱
+            draw_button("棋谱回放", replay_button.x, replay_button.y,
+                       replay_button.width, replay_button.height, GRAY)
+            
             # 显示错误消息
             if game.error_message:
                 error_surface = small_font.render(game.error_message, True, RED)
                 error_rect = error_surface.get_rect(center=(WINDOW_SIZE//2, WINDOW_SIZE//2 + 180))
                 screen.blit(error_surface, error_rect)
         
+        elif game.stage == 'replay_list':
+            # 棋谱列表，只读取当前页需要的对局
+            title_surface = font.render("棋谱回放", True, RED)
+            screen.blit(title_surface, title_surface.get_rect(center=(WINDOW_SIZE//2, 50)))
+            
+            start = game.replay_page * REPLAY_PAGE_SIZE
+            entries = game.replay_games.page(start, REPLAY_PAGE_SIZE)
+            if not entries:
+                empty_surface = small_font.render("game_logs 中没有对局", True, BLUE)
+                screen.blit(empty_surface, empty_surface.get_rect(center=(WINDOW_SIZE//2, WINDOW_SIZE//2)))
+            for index, (rect, entry) in enumerate(zip(replay_rows, entries)):
+                pygame.draw.rect(screen, WHITE, rect)
+                pygame.draw.rect(screen, BLACK, rect, 1)
+                entry_surface = small_font.render(f"{start + index + 1}. {entry.title()}", True, BLACK)
+                screen.blit(entry_surface, entry_surface.get_rect(midleft=(rect.x + 10, rect.centery)))
+            
+            draw_button("上一页", prev_page_button.x, prev_page_button.y, prev_page_button.width,
+                       prev_page_button.height, GREEN, BLACK, game.replay_page == 0)
+            draw_button("返回", back_button.x, back_button.y, back_button.width, back_button.height, GRAY)
+            draw_button("下一页", next_page_button.x, next_page_button.y, next_page_button.width,
+                       next_page_button.height, GREEN, BLACK,
+                       not game.replay_games.has_more(start + REPLAY_PAGE_SIZE))
+            
+            if game.error_message:
+                error_surface = small_font.render(game.error_message, True, RED)
+                screen.blit(error_surface, error_surface.get_rect(center=(WINDOW_SIZE//2, WINDOW_SIZE - 20)))
+        
+        elif game.stage == 'replay':
+            # 回放：棋盘、当前手数和结果
+            draw_board()
+            draw_replay(game)
+            
+            text = f"第 {game.replay_ply}/{len(game.replay)} 手"
+            if game.replay_ply == len(game.replay):
+                text += f" - {game.replay.result}"
+            text += "  (←→ Home End Esc)"
+            text_surface = small_font.render(text, True, RED)
+            screen.blit(text_surface, text_surface.get_rect(center=(WINDOW_SIZE//2, 18)))
+        
         elif game.stage == 'authentication':
             # 身份验证中
             text = "正在验证身份..."
@@ -575,6 +919,8 @@ def main():
             draw_board()
             
             text = "等待其他玩家加入..."
+            if game.queue_size:
+                text = f"正在匹配对手... (积分 {game.rating}，排队 {game.queue_size} 人)"
             text_surface = font.render(text, True, RED)
             text_rect = text_surface.get_rect(center=(WINDOW_SIZE//2, WINDOW_SIZE//2))
             screen.blit(text_surface, text_rect)
@@ -674,6 +1020,9 @@ def main():
             # 游戏中，绘制棋盘和棋子
             draw_board()
             draw_pieces(game)
+            if game.show_threats:
+                draw_threats(game)
+            draw_server_analysis(game)
             
             # 显示当前回合
             if game.current_player == 'black':
@@ -691,6 +1040,11 @@ def main():
             if game.my_color == game.current_player:
                 text += " - 轮到你下棋"
             
+            # 显示读秒
+            if game.move_time:
+                remaining = max(0, int(game.move_time - (time.time() - game.turn_started)))
+                text += f" ({remaining}秒)"
+            
             text_surface = font.render(text, True, RED)
             text_rect = text_surface.get_rect(center=(WINDOW_SIZE//2, 30))
             screen.blit(text_surface, text_rect)
@@ -705,11 +1059,23 @@ def main():
                 else:  # 右侧显示另一个玩家
                     player_rect = player_surface.get_rect(midright=(WINDOW_SIZE - 20, 20))
                 screen.blit(player_surface, player_rect)
+            
+            # 威胁提示的开关说明
+            hint_surface = small_font.render("H: 威胁提示" + ("（开）" if game.show_threats else "") + "  A: 局面分析",
+                                             True, BLUE)
+            screen.blit(hint_surface, hint_surface.get_rect(midleft=(20, WINDOW_SIZE - 20)))
+            
+            # 显示被拒绝的落子原因
+            if game.error_message:
+                error_surface = small_font.render(game.error_message, True, RED)
+                error_rect = error_surface.get_rect(center=(WINDOW_SIZE//2, WINDOW_SIZE - 20))
+                screen.blit(error_surface, error_rect)
         
         elif game.stage == 'game_over':
             # 游戏结束，绘制棋盘和棋子
             draw_board()
             draw_pieces(game)
+            draw_server_analysis(game)
             
             # 显示获胜者
             if game.winner == 'black':
@@ -740,4 +1106,10 @@ def main():
         clock.tick(30)  # 限制帧率为30
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='五子棋客户端')
+    parser.add_argument('--host', default=None, help='服务器地址，默认 localhost，也可以在连接界面中修改')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--room', default=None, help='房间编号，多进程服务器和匹配大厅按房间分配连接')
+    args = parser.parse_args()
+    main(args.host, args.port, args.room)
\ No newline at end of file
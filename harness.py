@@ -0,0 +1,261 @@
+import io
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import contextlib
+
+from server import GomokuServer
+from protocol import MessageReader, encode_message
+
+# 日志回放测试
+#
+# 在进程内启动一个真实的 GomokuServer（listen=False），每个玩家用一对本地套接字（socketpair）连接，
+# 按日志中的顺序发送身份验证、选择颜色、准备和每一手落子，每发一条消息都等服务器的对应回复后再发下一条，
+# 所以每次回放的消息顺序完全相同。回放结束后比较服务器产生的 game_end 与日志中记录的是否一致，
+# 并统计每类消息从发出到收到回复的耗时，用真实对局检查服务器的改动是否正确、是否变快。
+
+PASSWORD = 'replay'
+REPLY_TIMEOUT = 5  # 等待一条回复的最长时间（秒）
+TIMEOUT_MOVE_TIME = 1  # 回放超时判负的对局时使用的每手限时（秒）
+
+
+class ReplayError(Exception):
+    """回放过程中服务器的回复与日志不符"""
+
+
+class ScriptedClient:
+    """按脚本发送消息的客户端，连接的另一端直接交给服务器"""
+
+    def __init__(self, server, username, binary=False, timeout=REPLY_TIMEOUT):
+        self.username = username
+        self.binary = binary
+        self.socket, server_socket = socket.socketpair()
+        self.socket.settimeout(timeout)
+        self.reader = MessageReader()
+        self.pending = []  # 已经收到、还没有检查的消息
+        server.add_client(server_socket, ('replay', username))
+
+    def send(self, message):
+        self.socket.sendall(encode_message(message, self.binary))
+
+    def wait(self, predicate, what):
+        """读取消息直到 predicate 成立，返回该消息；中间的其他消息直接丢弃"""
+        while True:
+            while self.pending:
+                message = self.pending.pop(0)
+                if message.get('type') == 'move_rejected':
+                    raise ReplayError(f"{self.username} 的落子被拒绝: {message.get('message')}")
+                if predicate(message):
+                    return message
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                raise ReplayError(f"{self.username} 等待{what}超时")
+            if not data:
+                raise ReplayError(f"服务器关闭了 {self.username} 的连接")
+            self.pending.extend(self.reader.feed(data))
+
+    def close(self):
+        self.socket.close()
+
+
+def read_log(path):
+    """读取一个日志文件，返回事件列表（跳过无法解析的行）"""
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+def _stage(stage):
+    return lambda message: message.get('stage') == stage
+
+
+def _placed(row, col, color):
+    """落子被服务器接受的回复：二进制的落子帧，或棋盘上已有这颗棋子的完整状态"""
+    def match(message):
+        if message.get('type') == 'placed':
+            return (message['row'], message['col']) == (row, col)
+        board = message.get('board')
+        return board is not None and board[row][col] == color
+    return match
+
+
+def replay_game(events, binary=False, rule='standard'):
+    """回放一局，返回结果字典
+
+    {'game_id', 'ok', 'expected': (胜者, 颜色, 原因) 或 None, 'actual': 同左, 'moves', 'error',
+     'latencies': {消息类型: [秒, ...]}, 'output': 服务器的输出（只在失败时保留）}
+    """
+    if not events or events[0].get('event_type') != 'game_start':
+        raise ValueError("日志不是以 game_start 开头")
+    start = events[0]
+    players = list(start.get('players', {}).items())
+    if len(players) != 2:
+        raise ValueError("对局不是两名玩家")
+    moves = [event for event in events if event.get('event_type') == 'move']
+    end = next((event for event in events if event.get('event_type') == 'game_end'), None)
+    expected = (end.get('winner'), end.get('winner_color'), end.get('reason')) if end else None
+
+    result = {'game_id': start.get('game_id'), 'ok': False, 'expected': expected, 'actual': None,
+              'moves': len(moves), 'error': None, 'latencies': {}, 'output': ''}
+    latencies = result['latencies']
+
+    def timed(client, message, predicate, what):
+        begin = time.perf_counter()
+        client.send(message)
+        reply = client.wait(predicate, what)
+        latencies.setdefault(message['type'], []).append(time.perf_counter() - begin)
+        return reply
+
+    log_dir = tempfile.mkdtemp(prefix='replay_')
+    output = io.StringIO()
+    server_events = []
+    clients = {}
+    server = None
+    try:
+        with contextlib.redirect_stdout(output):
+            move_time = TIMEOUT_MOVE_TIME if expected and expected[2] == 'timeout' else 0
+            server = GomokuServer(password=PASSWORD, room_id='replay', listen=False, log_dir=log_dir,
+                                  rule=rule, move_time=move_time, rate_limit=False)
+            server.on_event = server_events.append
+            try:
+                # 身份验证，两人都通过后进入选择颜色阶段
+                for name, _ in players:
+                    client = clients[name] = ScriptedClient(server, name, binary)
+                    client.wait(_stage('authentication'), '连接')
+                    auth = {'type': 'authentication', 'username': name, 'password': PASSWORD}
+                    if binary:
+                        auth['protocol'] = 'binary'
+                    timed(client, auth, lambda m: m.get('auth_success'), '身份验证')
+                for client in clients.values():
+                    client.wait(_stage('color_selection'), '选择颜色阶段')
+
+                # 黑方选择颜色后服务器自动给另一方分配白色
+                black = next(name for name, info in players if info.get('color') == 'black')
+                timed(clients[black], {'type': 'select_color', 'color': 'black'},
+                      _stage('waiting_ready'), '准备阶段')
+                for name, client in clients.items():
+                    if name != black:
+                        client.wait(_stage('waiting_ready'), '准备阶段')
+
+                # 双方准备，第二个人准备后对局开始
+                first, second = (name for name, _ in players)
+                timed(clients[first], {'type': 'ready'}, lambda m: m.get('ready_players'), '准备')
+                timed(clients[second], {'type': 'ready'}, _stage('playing'), '开始对局')
+                clients[first].wait(_stage('playing'), '开始对局')
+
+                # 按日志逐手落子，落子方和对方都收到这一手后再下一手
+                for event in moves:
+                    row, col = event['position']
+                    mover = clients[event['player']]
+                    placed = _placed(row, col, event['color'])
+                    timed(mover, {'type': 'move', 'row': row, 'col': col}, placed, f"第 {row},{col} 手的确认")
+                    for client in clients.values():
+                        if client is not mover:
+                            client.wait(placed, f"第 {row},{col} 手的广播")
+
+                if expected and expected[2] == 'timeout':
+                    for client in clients.values():
+                        client.wait(_stage('game_over'), '超时判负')
+            except ReplayError as e:
+                result['error'] = str(e)
+
+            ends = [event for event in server_events if event['event_type'] == 'game_end']
+            if ends:
+                result['actual'] = (ends[0].get('winner'), ends[0].get('winner_color'), ends[0].get('reason'))
+            result['ok'] = result['error'] is None and result['actual'] == expected and len(ends) <= 1
+    finally:
+        with contextlib.redirect_stdout(output):
+            for client in clients.values():
+                client.close()
+            # 等服务器线程处理完断开，再删除临时日志目录
+            deadline = time.monotonic() + REPLY_TIMEOUT
+            while server and server.sessions and time.monotonic() < deadline:
+                time.sleep(0.01)
+        shutil.rmtree(log_dir, ignore_errors=True)
+    if not result['ok']:
+        result['output'] = output.getvalue()
+    return result
+
+
+def log_paths(sources):
+    """展开日志目录，按文件名（即时间）排序"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(os.path.join(source, name) for name in sorted(os.listdir(source))
+                         if name.endswith('.json'))
+        else:
+            paths.append(source)
+    return paths
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def run(sources=('game_logs',), binary=False, rule='standard', repeat=1, verbose=False):
+    """回放所有日志，打印每局的结果和各类消息的耗时，返回不一致的对局数"""
+    latencies = {}
+    failures = 0
+    games = 0
+    begin = time.perf_counter()
+    for path in log_paths(sources):
+        try:
+            events = read_log(path)
+        except OSError as e:
+            print(f"{path}: 无法读取 ({e})")
+            continue
+        for _ in range(repeat):
+            try:
+                result = replay_game(events, binary, rule)
+            except ValueError as e:
+                print(f"{os.path.basename(path)}: 跳过 ({e})")
+                break
+            games += 1
+            for message_type, values in result['latencies'].items():
+                latencies.setdefault(message_type, []).extend(values)
+            if not result['ok']:
+                failures += 1
+            if not result['ok'] or verbose:
+                status = '一致' if result['ok'] else '不一致'
+                print(f"{os.path.basename(path)}: {status}，{result['moves']} 手，"
+                      f"日志 {result['expected']}，回放 {result['actual']}")
+                if result['error']:
+                    print(f"  错误: {result['error']}")
+                if result['output']:
+                    print('  服务器输出（最后10行）:')
+                    for line in result['output'].splitlines()[-10:]:
+                        print(f"    {line}")
+    elapsed = time.perf_counter() - begin
+
+    print(f"回放 {games} 局，用时 {elapsed:.2f} 秒，不一致 {failures} 局")
+    if latencies:
+        print(f"{'消息类型':<14}{'数量':>8}{'平均ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'最大ms':>10}")
+        for message_type, values in sorted(latencies.items()):
+            print(f"{message_type:<16}{len(values):>8}{sum(values) / len(values) * 1000:>10.3f}"
+                  f"{percentile(values, 0.5) * 1000:>10.3f}{percentile(values, 0.99) * 1000:>10.3f}"
+                  f"{max(values) * 1000:>10.3f}")
+    return failures
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description='用对局日志驱动真实的服务器进行回放测试')
+    parser.add_argument('sources', nargs='*', default=['game_logs'], help='日志目录或日志文件')
+    parser.add_argument('--binary', action='store_true', help='两个客户端都使用二进制协议')
+    parser.add_argument('--rule', choices=['standard', 'renju'], default='standard')
+    parser.add_argument('--repeat', type=int, default=1, help='每局回放的次数，用于得到稳定的耗时')
+    parser.add_argument('--verbose', action='store_true', help='一致的对局也打印结果')
+    args = parser.parse_args()
+    sys.exit(1 if run(args.sources, args.binary, args.rule, args.repeat, args.verbose) else 0)
@@ -0,0 +1,322 @@
+import socket
+import json
+import threading
+import selectors
+import bisect
+import itertools
+import time
+
+from server import GomokuServer, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, set_send_timeout
+from protocol import first_message
+from timer_wheel import get_wheel
+from ratings import INITIAL_RATING, open_store
+
+BASE_WINDOW = 50  # 匹配时允许的初始积分差
+WINDOW_GROWTH = 25  # 每等待一秒放宽的积分差
+MAX_WINDOW = 600  # 积分差上限
+MATCH_INTERVAL = 0.5  # 匹配周期（秒）
+AUTH_TIMEOUT = 10  # 等待身份验证消息的超时时间（秒）
+RATINGS_PATH = 'ratings.json'  # 积分文件，不存在时从对局日志重建
+
+
+class Matchmaker:
+    """按积分排序的等待队列，积分相近的玩家优先配对，等待越久允许的积分差越大"""
+
+    def __init__(self, base_window=BASE_WINDOW, window_growth=WINDOW_GROWTH, max_window=MAX_WINDOW):
+        self.base_window = base_window
+        self.window_growth = window_growth
+        self.max_window = max_window
+        self.queue = []  # 按 (积分, 序号) 排序的 [(积分, 序号, 玩家)]
+        self.entries = {}  # 玩家 -> (积分, 序号, 入队时间)
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def enqueue(self, player, rating, now=None):
+        if player in self.entries:
+            return
+        seq = next(self.counter)
+        self.entries[player] = (rating, seq, time.monotonic() if now is None else now)
+        bisect.insort(self.queue, (rating, seq, player))
+
+    def remove(self, player):
+        entry = self.entries.pop(player, None)
+        if entry is None:
+            return False
+        rating, seq, _ = entry
+        index = bisect.bisect_left(self.queue, (rating, seq))
+        if index < len(self.queue) and self.queue[index][1] == seq:
+            del self.queue[index]
+        return True
+
+    def window(self, player, now):
+        """该玩家当前可以接受的积分差"""
+        waited = now - self.entries[player][2]
+        return min(self.base_window + self.window_growth * waited, self.max_window)
+
+    def pair(self, now=None):
+        """扫描一遍有序队列，把相邻且积分差在可接受范围内的玩家配对，返回 [(玩家, 玩家)]"""
+        if now is None:
+            now = time.monotonic()
+        pairs = []
+        remaining = []
+        queue = self.queue
+        i = 0
+        while i < len(queue) - 1:
+            rating_a, _, player_a = queue[i]
+            rating_b, _, player_b = queue[i + 1]
+            gap = rating_b - rating_a
+            # 大多数相邻玩家的积分差都在初始范围内，不必计算等待时间
+            if gap <= self.base_window or gap <= max(self.window(player_a, now), self.window(player_b, now)):
+                pairs.append((player_a, player_b))
+                del self.entries[player_a]
+                del self.entries[player_b]
+                i += 2
+            else:
+                remaining.append(queue[i])
+                i += 1
+        remaining.extend(queue[i:])
+        self.queue = remaining
+        return pairs
+
+
+class LobbyServer:
+    """匹配大厅：玩家排队等待，按积分自动配对并分配到房间"""
+
+    def __init__(self, host='0.0.0.0', port=5000, password='admin123', log_dir='game_logs', rule='standard',
+                 move_time=0, ratings_path=RATINGS_PATH, analysis=None):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(128)
+        self.password = password
+        self.log_dir = log_dir
+        self.rule = rule
+        self.move_time = move_time
+        self.analysis = analysis  # 所有房间共用的局面分析服务
+        self.ratings = open_store(ratings_path, log_dir)
+        self.matchmaker = Matchmaker()
+        self.waiting = {}  # 排队中的连接 -> (地址, 身份验证消息, 用户名)
+        self.last_seen = {}  # 排队中的连接 -> 最后一次收到数据的时间
+        self.selector = selectors.DefaultSelector()
+        self.rooms = {}  # 房间编号 -> GomokuServer
+        self.room_counter = itertools.count(1)
+        self.lock = threading.Lock()
+        print(f"匹配大厅启动在 {host}:{port}，已载入 {len(self.ratings)} 名玩家的积分")
+
+    def get_room(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = GomokuServer(password=self.password, room_id=room_id, listen=False, log_dir=self.log_dir,
+                                rule=self.rule, move_time=self.move_time, analysis=self.analysis)
+            # 房间写日志时更新积分
+            room.on_event = self.ratings.consume
+            self.rooms[room_id] = room
+        return room
+
+    def admit(self, client_socket, addr):
+        """读取身份验证消息，指定房间的直接进入房间，否则进入匹配队列
+
+        持有 self.lock 时不向客户端发送数据：对端不读数据时 send 会阻塞，整个大厅都会停下来。
+        """
+        set_send_timeout(client_socket)
+        try:
+            client_socket.settimeout(AUTH_TIMEOUT)
+            data = client_socket.recv(1024)
+            client_socket.settimeout(None)
+            message = first_message(data)
+            if message.get('type') != 'authentication' or message.get('password', '') != self.password:
+                client_socket.send(json.dumps({
+                    'stage': 'authentication',
+                    'auth_success': False,
+                    'message': '密码错误，请重试'
+                }).encode('utf-8'))
+                client_socket.close()
+                return
+        except Exception as e:
+            print(f"客户端 {addr} 身份验证出错: {e}")
+            client_socket.close()
+            return
+
+        username = message.get('username') or f"玩家{addr[1]}"
+        with self.lock:
+            if message.get('room'):
+                room = self.get_room(str(message['room']))
+                # 房间满员时 add_client 会发送拒绝消息，所以先判断，满员时到锁外再拒绝
+                if len(room.sessions) < 2:
+                    room.add_client(client_socket, addr, data)
+                    return
+        if message.get('room'):
+            try:
+                client_socket.send(json.dumps({"error": "服务器已满"}).encode('utf-8'))
+            except OSError:
+                pass
+            client_socket.close()
+            print(f"拒绝客户端 {addr} 连接，房间 {message['room']} 已满")
+            return
+        with self.lock:
+            rating = self.ratings.rating(username)
+            self.waiting[client_socket] = (addr, data, username)
+            self.last_seen[client_socket] = time.monotonic()
+            self.matchmaker.enqueue(client_socket, rating)
+            self.selector.register(client_socket, selectors.EVENT_READ)
+            queue_size = len(self.matchmaker)
+        print(f"玩家 {username}（积分 {rating:.0f}）进入匹配队列，当前排队 {queue_size} 人")
+        client_socket.send(json.dumps({
+            'stage': 'waiting_join',
+            'auth_success': True,
+            'message': '正在匹配对手...',
+            'rating': round(rating),
+            'queue_size': queue_size
+        }).encode('utf-8'))
+
+    def drop_waiting(self, client_socket):
+        """移除排队中的连接（调用方持有锁）"""
+        self.matchmaker.remove(client_socket)
+        self.selector.unregister(client_socket)
+        self.last_seen.pop(client_socket, None)
+        addr, _, username = self.waiting.pop(client_socket)
+        return addr, username
+
+    def check_waiting(self):
+        """检查排队中的连接是否断开，收到任何数据（包括心跳回复）都说明连接存活"""
+        for key, _ in self.selector.select(timeout=MATCH_INTERVAL):
+            client_socket = key.fileobj
+            with self.lock:
+                if client_socket not in self.waiting:
+                    continue
+                try:
+                    data = client_socket.recv(1024)
+                except OSError:
+                    data = b''
+                # 排队期间客户端发送的消息直接丢弃
+                if not data:
+                    _, username = self.drop_waiting(client_socket)
+                    client_socket.close()
+                    print(f"玩家 {username} 离开匹配队列")
+                else:
+                    self.last_seen[client_socket] = time.monotonic()
+
+    def heartbeat(self):
+        """时间轮回调：向排队中的连接发送心跳，断开长时间没有回复的连接
+
+        客户端超过 HEARTBEAT_TIMEOUT 收不到数据会自行断开，排队时没有房间替它发送心跳。
+        """
+        get_wheel().schedule_blocking(HEARTBEAT_INTERVAL, self.heartbeat)
+        now = time.monotonic()
+        with self.lock:
+            alive = []
+            for client_socket in list(self.waiting):
+                if now - self.last_seen[client_socket] >= HEARTBEAT_TIMEOUT:
+                    _, username = self.drop_waiting(client_socket)
+                    client_socket.close()
+                    print(f"玩家 {username} 心跳超时，移出匹配队列")
+                else:
+                    alive.append(client_socket)
+        # 在锁外发送；期间被配对送入房间的连接多收到一次心跳也没有关系，房间会处理回复
+        ping = json.dumps({'type': 'ping'}).encode('utf-8')
+        for client_socket in alive:
+            try:
+                client_socket.send(ping)
+            except OSError:
+                pass  # 连接已断开或发送超时时由 check_waiting 移出队列
+
+    def dispatch(self):
+        """执行一轮配对，把配对成功的玩家送入新房间"""
+        with self.lock:
+            for player_a, player_b in self.matchmaker.pair():
+                room_id = f"match_{next(self.room_counter)}"
+                room = self.get_room(room_id)
+                names = []
+                for client_socket in (player_a, player_b):
+                    self.selector.unregister(client_socket)
+                    self.last_seen.pop(client_socket, None)
+                    addr, data, username = self.waiting.pop(client_socket)
+                    room.add_client(client_socket, addr, data)  # 新房间不会满员，不会在锁内发送
+                    names.append(username)
+                print(f"匹配成功: {names[0]} vs {names[1]}，进入房间 {room_id}")
+
+            # 清理已经没有玩家的房间（包括玩家指定的房间），同时取消房间的定时器和分析请求
+            for room_id, room in list(self.rooms.items()):
+                if not room.sessions:
+                    del self.rooms[room_id]
+                    room.close()
+
+    def run_matchmaking(self):
+        while True:
+            try:
+                self.check_waiting()
+                self.dispatch()
+            except Exception as e:
+                print(f"匹配出错: {e}")
+
+    def start(self):
+        get_wheel().schedule_blocking(HEARTBEAT_INTERVAL, self.heartbeat)
+        thread = threading.Thread(target=self.run_matchmaking)
+        thread.daemon = True
+        thread.start()
+        while True:
+            try:
+                client_socket, addr = self.server.accept()
+                print(f"客户端 {addr} 已连接")
+                thread = threading.Thread(target=self.admit, args=(client_socket, addr))
+                thread.daemon = True
+                thread.start()
+            except Exception as e:
+                print(f"接受客户端连接出错: {e}")
+
+
+def benchmark(player_count=100000, seed=0):
+    """测量10万名排队玩家时的入队、出队和配对性能"""
+    import random
+    rng = random.Random(seed)
+    ratings = [rng.gauss(INITIAL_RATING, 300) for _ in range(player_count)]
+
+    matchmaker = Matchmaker()
+    start = time.perf_counter()
+    for player, rating in enumerate(ratings):
+        matchmaker.enqueue(player, rating, now=0.0)
+    enqueue_time = time.perf_counter() - start
+
+    # 随机取消1%的玩家
+    cancelled = rng.sample(range(player_count), player_count // 100)
+    start = time.perf_counter()
+    for player in cancelled:
+        matchmaker.remove(player)
+    remove_time = time.perf_counter() - start
+
+    # 模拟时间流逝，每一轮配对相当于经过一个匹配周期
+    rounds = 0
+    paired = 0
+    gaps = []
+    waits = []
+    pass_times = []
+    now = 0.0
+    while len(matchmaker) > 1 and rounds < 100:
+        start = time.perf_counter()
+        pairs = matchmaker.pair(now)
+        pass_times.append(time.perf_counter() - start)
+        paired += len(pairs)
+        gaps.extend(abs(ratings[a] - ratings[b]) for a, b in pairs)
+        waits.extend([now] * len(pairs))
+        rounds += 1
+        now += MATCH_INTERVAL
+    pair_time = sum(pass_times)
+
+    gaps.sort()
+    print(f"排队玩家: {player_count}")
+    print(f"入队: {enqueue_time * 1e6 / player_count:.2f} 微秒/人，出队: {remove_time * 1e6 / len(cancelled):.2f} 微秒/人")
+    print(f"首轮配对耗时 {pass_times[0] * 1000:.1f} ms（队列 {player_count - len(cancelled)} 人）")
+    print(f"配对: {rounds} 轮共 {pair_time * 1000:.1f} ms，产生 {paired} 对，{paired / pair_time:.0f} 对/秒")
+    print(f"模拟等待时间中位数 {waits[len(waits) // 2]:.1f} 秒，95分位 {waits[int(len(waits) * 0.95)]:.1f} 秒，"
+          f"剩余未配对 {len(matchmaker)} 人")
+    print(f"积分差中位数 {gaps[len(gaps) // 2]:.1f}，95分位 {gaps[int(len(gaps) * 0.95)]:.1f}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='匹配队列基准测试')
+    parser.add_argument('--players', type=int, default=100000)
+    args = parser.parse_args()
+    benchmark(args.players)
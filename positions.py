@@ -0,0 +1,476 @@
+import os
+import json
+import mmap
+import heapq
+import random
+import struct
+import time
+
+from record import read_records
+
+# 局面索引
+#
+# 回答“哪些历史对局走到过这个局面、后来怎么下、结果如何”。每个局面用 Zobrist 哈希表示：
+# 每种颜色、每个格子一个固定的64位随机数，局面的哈希是所有棋子对应随机数的异或，落子时只需异或一次。
+# 棋盘有8种对称（旋转、翻转），同时维护8个方向的哈希，取最小值作为规范哈希，对称的局面因此落在同一个键上。
+# 索引文件是按哈希排序的定长记录 (规范哈希, 对局序号, 手数, 规范方向下的下一手)，查询时在 mmap 上二分查找，
+# 不需要把索引读入内存。新对局先写入较小的增量文件 <path>.new（同样有序），增量文件超过主文件的
+# 1/MERGE_RATIO 时再合并进主文件；两个文件都是写临时文件后用 rename 原子替换。
+# 对局表 <path>.games 每局一行JSON（对局编号、来源、胜者、胜方颜色、手数），行号即对局序号。
+
+INDEX_PATH = 'positions.idx'
+ZOBRIST_SEED = 20250413  # 固定的随机种子，索引文件与查询必须使用同一组随机数
+BOARD_SIZE = 15
+CELLS = BOARD_SIZE * BOARD_SIZE
+ENTRY = struct.Struct('<QIBB')  # 规范哈希、对局序号、手数（该局面之前的落子数）、下一手
+HASH = struct.Struct('<Q')
+NO_MOVE = 255  # 终局之后没有下一手
+MERGE_RATIO = 8
+MIN_MERGE = 1 << 16  # 增量文件少于这么多条记录时不合并
+CHUNK_ENTRIES = 1 << 16  # 读写索引文件时每批的记录数
+FINISHED = ('game_end', 'game_restart', 'player_disconnect')  # 出现这些事件之后对局不会再有新的落子，中途断线的对局也算结束
+STALE_AGE = 24 * 3600  # 日志超过这么多秒没有再写入时视为已结束（服务器在对局中途退出，没有写结束事件）
+
+
+def _symmetries():
+    """8种对称变换，每种为 格子 -> 变换后的格子"""
+    maps = []
+    for symmetry in range(8):
+        table = []
+        for cell in range(CELLS):
+            row, col = divmod(cell, BOARD_SIZE)
+            if symmetry & 4:
+                row, col = col, row
+            if symmetry & 1:
+                row = BOARD_SIZE - 1 - row
+            if symmetry & 2:
+                col = BOARD_SIZE - 1 - col
+            table.append(row * BOARD_SIZE + col)
+        maps.append(table)
+    return maps
+
+
+SYMMETRIES = _symmetries()
+INVERSE = []
+for _table in SYMMETRIES:
+    _inverse = [0] * CELLS
+    for _cell, _target in enumerate(_table):
+        _inverse[_target] = _cell
+    INVERSE.append(_inverse)
+
+
+def _zobrist_keys():
+    """KEYS[颜色][格子] 为该棋子在8个对称方向下的随机数，颜色 1 黑 2 白"""
+    rng = random.Random(ZOBRIST_SEED)
+    keys = [[rng.getrandbits(64) for _ in range(CELLS)] for _ in range(2)]
+    return [None] + [[tuple(keys[color][table[cell]] for table in SYMMETRIES) for cell in range(CELLS)]
+                     for color in range(2)]
+
+
+KEYS = _zobrist_keys()
+
+
+def position_hashes(cells):
+    """依次生成空棋盘和每手之后的 (规范哈希, 取到最小值的对称方向)，落子黑白交替"""
+    hashes = (0,) * 8
+    yield 0, 0
+    for ply, cell in enumerate(cells):
+        hashes = tuple(h ^ k for h, k in zip(hashes, KEYS[1 + ply % 2][cell]))
+        canonical = min(hashes)
+        yield canonical, hashes.index(canonical)
+
+
+def canonical_hash(cells):
+    """cells 全部下完之后局面的 (规范哈希, 对称方向)"""
+    result = (0, 0)
+    for result in position_hashes(cells):
+        pass
+    return result
+
+
+def game_entries(number, cells):
+    """一局的全部索引记录"""
+    entries = []
+    for ply, (canonical, symmetry) in enumerate(position_hashes(cells)):
+        following = SYMMETRIES[symmetry][cells[ply]] if ply < len(cells) else NO_MOVE
+        entries.append((canonical, number, ply, following))
+    return entries
+
+
+def _read_log(path):
+    """读取一个日志文件，返回 (落子格子列表, 胜者, 胜方颜色, 是否已结束)"""
+    cells = []
+    winner = winner_color = None
+    finished = False
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if ('"move"' not in line and '"game_end"' not in line and '"game_restart"' not in line
+                    and '"player_disconnect"' not in line):
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            event_type = event.get('event_type')
+            if event_type == 'move':
+                row, col = event['position']
+                cells.append(row * BOARD_SIZE + col)
+            elif event_type in FINISHED and not finished:
+                finished = True
+                if event_type == 'game_end':
+                    winner, winner_color = event.get('winner'), event.get('winner_color')
+    return cells, winner, winner_color, finished
+
+
+def _scan_games(sources, known):
+    """逐局生成还没有索引的 (对局编号, 来源, 落子格子列表, 胜者, 胜方颜色)
+
+    日志目录中的对局编号取自文件名，已索引的日志不打开。还在进行的对局跳过，
+    等结束之后的某次更新再索引，否则只会索引到前半局且以后不再重新读取。
+    结束事件包括中途断线；很久没有写入的日志也视为已结束，不会每次更新都重新读取。
+    """
+    for source in sources:
+        if source.endswith('.gkr'):
+            try:
+                for record in read_records(source):
+                    if record['game_id'] in known:
+                        continue
+                    end = next((extra if event_type == 'game_end' else (None, None, None)
+                                for _, event_type, extra in record['events'] if event_type in FINISHED), None)
+                    if end is None:
+                        continue
+                    yield record['game_id'], source, list(record['moves']), end[0], end[1]
+            except (OSError, ValueError) as e:
+                print(f"读取棋谱 {source} 失败: {e}")
+            continue
+        if not os.path.isdir(source):
+            continue
+        for name in sorted(entry.name for entry in os.scandir(source) if entry.name.endswith('.json')):
+            game_id = name[len('game_'):-len('.json')] if name.startswith('game_') else name[:-len('.json')]
+            if game_id in known:
+                continue
+            path = os.path.join(source, name)
+            try:
+                cells, winner, winner_color, finished = _read_log(path)
+                if not finished:
+                    finished = time.time() - os.path.getmtime(path) > STALE_AGE
+            except (OSError, KeyError, ValueError) as e:
+                print(f"读取日志 {name} 失败: {e}")
+                continue
+            if finished:
+                yield game_id, source, cells, winner, winner_color
+
+
+def _iter_entries(path):
+    """按顺序读出索引文件中的记录"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(ENTRY.size * CHUNK_ENTRIES)
+            if not chunk:
+                return
+            yield from ENTRY.iter_unpack(chunk)
+
+
+def _write_entries(path, entries):
+    """把有序的记录写入临时文件后原子替换 path，跳过重复的记录，返回写入的条数"""
+    tmp_path = path + '.tmp'
+    count = 0
+    previous = None
+    batch = []
+    with open(tmp_path, 'wb') as f:
+        for entry in entries:
+            if entry == previous:
+                continue
+            previous = entry
+            batch.append(ENTRY.pack(*entry))
+            if len(batch) >= CHUNK_ENTRIES:
+                f.write(b''.join(batch))
+                count += len(batch)
+                batch = []
+        f.write(b''.join(batch))
+        count += len(batch)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def _search(data, count, key):
+    """在有序的记录中二分查找哈希为 key 的记录，逐条生成 (对局序号, 手数, 下一手)"""
+    size = ENTRY.size
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if HASH.unpack_from(data, middle * size)[0] < key:
+            low = middle + 1
+        else:
+            high = middle
+    while low < count:
+        value, number, ply, following = ENTRY.unpack_from(data, low * size)
+        if value != key:
+            return
+        yield number, ply, following
+        low += 1
+
+
+class PositionIndex:
+    """磁盘上的局面索引：增量更新，按局面（含对称）查询"""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.delta_path = path + '.new'
+        self.games_path = path + '.games'
+        self.games = []  # 对局序号 -> (对局编号, 来源, 胜者, 胜方颜色, 手数)
+        self.known = set()  # 已索引的对局编号
+        self.files = []  # [(mmap, 记录数)]，主文件和增量文件
+        self._load_games()
+        self._open()
+
+    def _load_games(self):
+        if not os.path.exists(self.games_path):
+            return
+        valid = 0
+        with open(self.games_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError
+                    game = tuple(json.loads(line))
+                except ValueError:
+                    break  # 崩溃时写了一半的行
+                self.games.append(game)
+                self.known.add(game[0])
+                valid += len(line)
+        if valid != os.path.getsize(self.games_path):
+            with open(self.games_path, 'r+b') as f:
+                f.truncate(valid)
+
+    def _open(self):
+        self.close()
+        for path in (self.path, self.delta_path):
+            if os.path.exists(path) and os.path.getsize(path) >= ENTRY.size:
+                with open(path, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.files.append((data, len(data) // ENTRY.size))
+
+    def close(self):
+        for data, _ in self.files:
+            data.close()
+        self.files = []
+
+    def __len__(self):
+        return len(self.games)
+
+    def entry_count(self):
+        return sum(count for _, count in self.files)
+
+    def update(self, sources=('game_logs',)):
+        """索引 sources（日志目录或 .gkr 棋谱文件）中新增的对局，返回新增的对局数"""
+        committed = len(self.games)
+        new_games = []
+        seen = set(self.known)
+        entries = []
+        for game_id, source, cells, winner, winner_color in _scan_games(sources, seen):
+            seen.add(game_id)
+            entries.extend(game_entries(committed + len(new_games), cells))
+            new_games.append((game_id, source, winner, winner_color, len(cells)))
+        if not new_games:
+            return 0
+        entries.sort()
+
+        # 先写增量文件，再追加对局表；对局表才是提交点，之前崩溃留下的序号不小于 committed 的记录丢弃
+        old = (entry for entry in _iter_entries(self.delta_path) if entry[1] < committed)
+        delta_count = _write_entries(self.delta_path, heapq.merge(old, entries))
+        with open(self.games_path, 'a', encoding='utf-8') as f:
+            for game in new_games:
+                f.write(json.dumps(game, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.games.extend(new_games)
+        self.known.update(game[0] for game in new_games)
+
+        main_count = os.path.getsize(self.path) // ENTRY.size if os.path.exists(self.path) else 0
+        if delta_count > max(MIN_MERGE, main_count // MERGE_RATIO):
+            self.compact()
+        else:
+            self._open()
+        return len(new_games)
+
+    def compact(self):
+        """把增量文件合并进主文件"""
+        self.close()
+        merged = heapq.merge(_iter_entries(self.path), _iter_entries(self.delta_path))
+        _write_entries(self.path, merged)
+        # 主文件替换后、增量文件清空前崩溃只会留下重复的记录，查询和下次合并时都会去重
+        _write_entries(self.delta_path, [])
+        self._open()
+
+    def lookup(self, cells):
+        """查找走到过与 cells 下完之后相同局面（含对称）的对局
+
+        返回 [{'game_id', 'source', 'ply', 'next', 'winner', 'winner_color'}]，
+        next 为该局接下来的一手，已换算到查询局面的方向，终局时为None。
+        """
+        canonical, symmetry = canonical_hash(cells)
+        inverse = INVERSE[symmetry]
+        ply_count = len(cells)
+        found = {}
+        for data, count in self.files:
+            for number, ply, following in _search(data, count, canonical):
+                # 手数不同一定是哈希碰撞
+                if ply == ply_count and number < len(self.games):
+                    found[number] = following
+        matches = []
+        for number, following in sorted(found.items()):
+            game_id, source, winner, winner_color, _ = self.games[number]
+            matches.append({
+                'game_id': game_id,
+                'source': source,
+                'ply': ply_count,
+                'next': divmod(inverse[following], BOARD_SIZE) if following != NO_MOVE else None,
+                'winner': winner,
+                'winner_color': winner_color
+            })
+        return matches
+
+    def summary(self, cells):
+        """局面的统计：对局数、黑胜、白胜，以及接下来各手的 [次数, 黑胜, 白胜]（按次数从多到少）"""
+        matches = self.lookup(cells)
+        result = {'games': len(matches), 'black': 0, 'white': 0, 'next': {}}
+        following = {}
+        for match in matches:
+            color = match['winner_color']
+            if color in ('black', 'white'):
+                result[color] += 1
+            if match['next'] is not None:
+                stats = following.setdefault(match['next'], [0, 0, 0])
+                stats[0] += 1
+                if color in ('black', 'white'):
+                    stats[1 if color == 'black' else 2] += 1
+        result['next'] = dict(sorted(following.items(), key=lambda item: -item[1][0]))
+        return result
+
+
+def parse_moves(text):
+    """把 "7,7 7,8 ..." 解析为格子列表"""
+    cells = []
+    for move in text.split():
+        row, col = (int(value) for value in move.split(','))
+        cells.append(row * BOARD_SIZE + col)
+    return cells
+
+
+def _transform(cells, symmetry):
+    return [SYMMETRIES[symmetry][cell] for cell in cells]
+
+
+def benchmark(games=20000, moves_per_game=40, queries=2000, seed=0):
+    """建立随机对局的索引，比较索引查询与逐局扫描的耗时，并检查对称局面能被找到"""
+    import shutil
+    import tempfile
+    from record import RecordWriter
+
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix='positions_')
+    try:
+        archive = os.path.join(directory, 'archive.gkr')
+        all_moves = []
+        with RecordWriter(archive) as writer:
+            for index in range(games):
+                cells = rng.sample(range(CELLS), moves_per_game)
+                # 四分之三的对局沿用之前某一局的前6手，使索引中有多局走到同一个局面
+                if all_moves and index % 4:
+                    opening = all_moves[rng.randrange(len(all_moves))][:6]
+                    cells = opening + [cell for cell in cells if cell not in opening][:moves_per_game - 6]
+                all_moves.append(cells)
+                writer.write({'game_id': f"bench_{index:06d}", 'start': 0,
+                              'players': [('a', 'black'), ('b', 'white')], 'moves': bytes(cells),
+                              'events': [(len(cells), 'game_end', ('a', 'black', None))]})
+
+        path = os.path.join(directory, 'positions.idx')
+        index = PositionIndex(path)
+        start = time.perf_counter()
+        index.update([archive])
+        build_time = time.perf_counter() - start
+        entries = index.entry_count()
+        size = sum(os.path.getsize(p) for p in (path, index.delta_path, index.games_path) if os.path.exists(p))
+
+        targets = []
+        for _ in range(queries):
+            cells = all_moves[rng.randrange(games)]
+            targets.append(_transform(cells[:rng.randint(1, len(cells))], rng.randrange(8)))
+        start = time.perf_counter()
+        found = 0
+        for cells in targets:
+            found += len(index.lookup(cells)) > 0
+        query_time = (time.perf_counter() - start) / queries
+        assert found == queries, "对称变换后的局面没有找到"
+
+        # 不用索引时需要逐局摆棋计算每个局面的哈希
+        scan_count = 20
+        start = time.perf_counter()
+        for cells in targets[:scan_count]:
+            key = canonical_hash(cells)[0]
+            matched = sum(1 for moves in all_moves
+                          if len(moves) >= len(cells) and canonical_hash(moves[:len(cells)])[0] == key)
+            assert matched == len(index.lookup(cells))
+        scan_time = (time.perf_counter() - start) / scan_count
+
+        # 增量更新：再加100局只写增量文件
+        with RecordWriter(archive) as writer:
+            for extra in range(100):
+                cells = rng.sample(range(CELLS), moves_per_game)
+                writer.write({'game_id': f"bench_new_{extra:03d}", 'start': 0,
+                              'players': [('a', 'black'), ('b', 'white')], 'moves': bytes(cells),
+                              'events': [(len(cells), 'game_end', ('a', 'black', None))]})
+        start = time.perf_counter()
+        added = index.update([archive])
+        update_time = time.perf_counter() - start
+        start = time.perf_counter()
+        PositionIndex(path).close()
+        open_time = time.perf_counter() - start
+        index.close()
+
+        print(f"{games} 局 {moves_per_game} 手：建立索引 {build_time:.2f} 秒，{entries} 条记录，"
+              f"文件共 {size / 2 ** 20:.1f} MB，打开索引 {open_time * 1000:.1f} ms")
+        print(f"查询（随机对称变换）: {query_time * 1e6:.0f} µs/次")
+        print(f"逐局扫描: {scan_time * 1000:.0f} ms/次（{scan_time / query_time:.0f} 倍）")
+        print(f"增量更新 {added} 局: {update_time * 1000:.0f} ms（读棋谱和重写增量文件）")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='历史对局的局面索引')
+    parser.add_argument('--index', default=INDEX_PATH, help='索引文件')
+    subparsers = parser.add_subparsers(dest='command')
+    update_parser = subparsers.add_parser('update', help='索引新增的对局')
+    update_parser.add_argument('sources', nargs='*', default=['game_logs'], help='日志目录或 .gkr 棋谱文件')
+    subparsers.add_parser('compact', help='把增量文件合并进主文件')
+    query_parser = subparsers.add_parser('query', help='查询局面')
+    query_parser.add_argument('moves', nargs='?', default='', help='落子序列，如 "7,7 7,8 8,8"')
+    bench_parser = subparsers.add_parser('benchmark')
+    bench_parser.add_argument('--games', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        benchmark(args.games)
+    elif args.command in ('update', 'compact', 'query'):
+        index = PositionIndex(args.index)
+        if args.command == 'update':
+            added = index.update(args.sources)
+            print(f"新增 {added} 局，共 {len(index)} 局，{index.entry_count()} 个局面记录")
+        elif args.command == 'compact':
+            index.compact()
+            print(f"合并完成，共 {index.entry_count()} 个局面记录")
+        else:
+            summary = index.summary(parse_moves(args.moves))
+            print(f"{summary['games']} 局走到过该局面：黑胜 {summary['black']}，白胜 {summary['white']}")
+            for (row, col), (count, black, white) in list(summary['next'].items())[:10]:
+                print(f"  下一手 ({row},{col}): {count} 局，黑胜 {black}，白胜 {white}")
+        index.close()
+    else:
+        parser.print_help()
@@ -0,0 +1,269 @@
+import json
+import struct
+
+MAX_BUFFER = 64 * 1024  # 未能解析出完整消息时允许缓存的最大字节数
+
+# 二进制协议
+#
+# 客户端在身份验证消息中带上 'protocol': 'binary'，服务器在认证成功的回复中确认后，
+# 双方可以改用下面的二进制帧。JSON消息总是以 '{' 开头，二进制帧的操作码都不小于0x80，
+# 所以同一条连接上两种格式可以混用，JSON 始终可以作为后备。
+#   MOVE    0x81 + 格子(1字节, row * 15 + col)          客户端落子，共2字节
+#   PLACED  0x82/0x83 + 格子(1字节)                      黑/白棋落子广播，共2字节
+#   STATE   0x84 + 长度(u16) + 固定字段 + 棋盘(57字节) + 其余字段(JSON)
+#   PING    0x85                                         心跳
+#   PONG    0x86                                         心跳回复
+# STATE 中的棋盘每格2位（0=空、1=黑、2=白），225格共57字节。
+OP_MOVE = 0x81
+OP_PLACED_BLACK = 0x82
+OP_PLACED_WHITE = 0x83
+OP_STATE = 0x84
+OP_PING = 0x85
+OP_PONG = 0x86
+
+BOARD_SIZE = 15
+BOARD_BYTES = (BOARD_SIZE * BOARD_SIZE + 3) // 4
+STAGES = ['authentication', 'waiting_join', 'color_selection', 'waiting_ready', 'playing', 'game_over']
+STAGE_CODES = {stage: i for i, stage in enumerate(STAGES)}
+COLORS = [None, 'black', 'white']
+COLOR_CODES = {color: i for i, color in enumerate(COLORS)}
+STATE_HEADER = struct.Struct('<BBBBBB')  # 阶段、当前玩家、胜者、标志位、准备人数、重开票数
+FRAME_LENGTH = struct.Struct('<H')
+FLAG_GAME_OVER = 0x01
+FLAG_GAME_STARTED = 0x02
+PACKED_KEYS = ('board', 'stage', 'current_player', 'winner', 'game_over', 'game_started',
+               'ready_players', 'restart_votes')
+
+# 一个字节对应4个格子，预先算好解码表
+_BYTE_CELLS = [tuple((COLORS + [None])[(value >> shift) & 3] for shift in (0, 2, 4, 6)) for value in range(256)]
+_row_cache = {}  # 一行棋子 -> 30位编码，每手棋只有一行会变化
+ROW_CACHE_SIZE = 4096
+
+
+def _row_bits(row):
+    key = tuple(row)
+    bits = _row_cache.get(key)
+    if bits is None:
+        bits = 0
+        for cell in reversed(key):
+            bits = bits << 2 | COLOR_CODES[cell]
+        if len(_row_cache) >= ROW_CACHE_SIZE:
+            _row_cache.clear()
+        _row_cache[key] = bits
+    return bits
+
+
+def pack_board(board):
+    """把15x15棋盘打包为57字节，每格2位"""
+    value = 0
+    for row in reversed(board):
+        value = value << (2 * BOARD_SIZE) | _row_bits(row)
+    return value.to_bytes(BOARD_BYTES, 'little')
+
+
+def unpack_board(data):
+    """把57字节还原为15x15棋盘"""
+    cells = []
+    for value in data:
+        cells.extend(_BYTE_CELLS[value])
+    return [cells[row * BOARD_SIZE:(row + 1) * BOARD_SIZE] for row in range(BOARD_SIZE)]
+
+
+def encode_state(state):
+    """把游戏状态编码为 STATE 帧，未打包的字段以JSON附在末尾"""
+    flags = (FLAG_GAME_OVER if state.get('game_over') else 0) | \
+            (FLAG_GAME_STARTED if state.get('game_started') else 0)
+    header = STATE_HEADER.pack(
+        STAGE_CODES.get(state.get('stage'), 0xFF),
+        COLOR_CODES.get(state.get('current_player'), 0),
+        COLOR_CODES.get(state.get('winner'), 0),
+        flags,
+        state.get('ready_players', 0),
+        state.get('restart_votes', 0)
+    )
+    extra = {key: value for key, value in state.items() if key not in PACKED_KEYS}
+    payload = header + pack_board(state['board'])
+    if extra:
+        payload += json.dumps(extra, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return bytes([OP_STATE]) + FRAME_LENGTH.pack(len(payload)) + payload
+
+
+def decode_state(payload):
+    """解码 STATE 帧的负载，返回与JSON格式相同的状态字典"""
+    stage, current_player, winner, flags, ready_players, restart_votes = STATE_HEADER.unpack_from(payload)
+    pos = STATE_HEADER.size
+    state = {
+        'board': unpack_board(payload[pos:pos + BOARD_BYTES]),
+        'current_player': COLORS[current_player],
+        'winner': COLORS[winner],
+        'game_over': bool(flags & FLAG_GAME_OVER),
+        'game_started': bool(flags & FLAG_GAME_STARTED),
+        'ready_players': ready_players,
+        'restart_votes': restart_votes
+    }
+    if stage < len(STAGES):
+        state['stage'] = STAGES[stage]
+    pos += BOARD_BYTES
+    if pos < len(payload):
+        state.update(json.loads(payload[pos:].decode('utf-8')))
+    return state
+
+
+def encode_move(row, col):
+    return bytes([OP_MOVE, row * BOARD_SIZE + col])
+
+
+def encode_placed(row, col, color):
+    return bytes([OP_PLACED_BLACK if color == 'black' else OP_PLACED_WHITE, row * BOARD_SIZE + col])
+
+
+def encode_message(message, binary):
+    """按连接协商的协议编码一条消息"""
+    if binary:
+        message_type = message.get('type')
+        if message_type == 'ping':
+            return bytes([OP_PING])
+        if message_type == 'pong':
+            return bytes([OP_PONG])
+        if message_type == 'move':
+            return encode_move(message['row'], message['col'])
+        if 'board' in message:
+            return encode_state(message)
+    return json.dumps(message).encode('utf-8')
+
+
+_decoder = json.JSONDecoder()
+
+
+class MessageReader:
+    """从TCP字节流中切分出完整的消息
+
+    消息之间没有分隔符，一次recv可能收到多条粘在一起的消息，也可能只收到半条。
+    JSON消息和二进制帧都会被解码为字典。
+    每个连接一个实例，使用 __slots__ 并共用同一个无状态的 JSONDecoder，空闲连接多时也只占很少的内存。
+    """
+    __slots__ = ('buffer', 'max_message', 'scan_from')
+
+    def __init__(self, max_message=MAX_BUFFER):
+        self.buffer = b''
+        self.max_message = max_message  # 未能解析出完整消息时允许缓存的最大字节数
+        self.scan_from = 0  # 上次JSON解析失败时缓冲区的长度
+
+    def _next(self, pos):
+        """从 pos 开始解析一条消息，数据不完整时返回 (None, pos)"""
+        buffer = self.buffer
+        op = buffer[pos]
+        if op == OP_MOVE or op == OP_PLACED_BLACK or op == OP_PLACED_WHITE:
+            if pos + 2 > len(buffer):
+                return None, pos
+            row, col = divmod(buffer[pos + 1], BOARD_SIZE)
+            if op == OP_MOVE:
+                return {'type': 'move', 'row': row, 'col': col}, pos + 2
+            color = 'black' if op == OP_PLACED_BLACK else 'white'
+            return {'type': 'placed', 'row': row, 'col': col, 'color': color}, pos + 2
+        if op == OP_PING:
+            return {'type': 'ping'}, pos + 1
+        if op == OP_PONG:
+            return {'type': 'pong'}, pos + 1
+        if op == OP_STATE:
+            if pos + 3 > len(buffer):
+                return None, pos
+            (length,) = FRAME_LENGTH.unpack_from(buffer, pos + 1)
+            end = pos + 3 + length
+            if end > len(buffer):
+                return None, pos
+            return decode_state(buffer[pos + 3:end]), end
+        if op == 0x7B:  # '{'
+            # 上次解析失败后没有再收到右花括号时，消息一定还不完整，不必再次解析
+            if buffer.find(b'}', max(pos, self.scan_from)) < 0:
+                return None, pos
+            text = buffer[pos:].decode('utf-8', 'replace')
+            try:
+                message, end = _decoder.raw_decode(text)
+            except ValueError:
+                self.scan_from = len(buffer)
+                return None, pos
+            return message, pos + len(text[:end].encode('utf-8'))
+        raise ValueError(f"无法识别的消息类型: 0x{op:02x}")
+
+    def feed(self, data):
+        """追加收到的字节，返回其中所有完整的消息"""
+        self.buffer += data
+        messages = []
+        pos = 0
+        while True:
+            # 跳过JSON消息之间可能存在的空白
+            while pos < len(self.buffer) and self.buffer[pos] in b' \t\r\n':
+                pos += 1
+            if pos >= len(self.buffer):
+                break
+            message, pos = self._next(pos)
+            if message is None:
+                break
+            messages.append(message)
+        self.buffer = self.buffer[pos:]
+        self.scan_from = max(0, self.scan_from - pos)
+        if len(self.buffer) > self.max_message:
+            raise ValueError("消息过长或格式错误")
+        return messages
+
+
+def first_message(data):
+    """解析连接上收到的第一段数据中的第一条消息，解析失败时返回空字典"""
+    try:
+        messages = MessageReader().feed(data)
+    except ValueError:
+        return {}
+    if messages and isinstance(messages[0], dict):
+        return messages[0]
+    return {}
+
+
+def benchmark(rounds=2000):
+    """比较每手棋的JSON全量广播与二进制协议的字节数和编解码耗时"""
+    import random
+    import time
+
+    rng = random.Random(0)
+    board = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    for ply, cell in enumerate(rng.sample(range(BOARD_SIZE * BOARD_SIZE), 40)):
+        board[cell // BOARD_SIZE][cell % BOARD_SIZE] = 'black' if ply % 2 == 0 else 'white'
+    game_state = {
+        'board': board, 'current_player': 'black', 'game_over': False, 'winner': None,
+        'game_started': True, 'ready_players': 2,
+        'players': {'ke': {'color': 'black', 'ready': True}, 'xuan': {'color': 'white', 'ready': True}},
+        'stage': 'playing', 'restart_votes': 0, 'rule': 'standard', 'forbidden': [], 'move_time': 0
+    }
+
+    def timed(func, *args):
+        # 取5次中最快的一次，减少机器抖动的影响
+        best = None
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                result = func(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best * 1e6 / rounds
+
+    json_text, json_encode = timed(json.dumps, game_state)
+    _, json_decode = timed(json.loads, json_text)
+    state_frame, state_encode = timed(encode_state, game_state)
+    _, state_decode = timed(lambda: MessageReader().feed(state_frame))
+    placed, placed_encode = timed(encode_placed, 7, 7, 'black')
+    _, placed_decode = timed(lambda: MessageReader().feed(placed))
+    move_json = json.dumps({'type': 'move', 'row': 7, 'col': 7})
+
+    json_bytes = len(json_text.encode('utf-8'))
+    print(f"局面: 40手，每手的消息 = 客户端落子 + 服务器向两个客户端广播")
+    print(f"{'':12}{'字节':>8}{'编码(微秒)':>12}{'解码(微秒)':>12}")
+    print(f"{'JSON全量状态':10}{json_bytes:>8}{json_encode:>12.2f}{json_decode:>12.2f}")
+    print(f"{'二进制STATE':10}{len(state_frame):>8}{state_encode:>12.2f}{state_decode:>12.2f}")
+    print(f"{'二进制PLACED':10}{len(placed):>8}{placed_encode:>12.2f}{placed_decode:>12.2f}")
+    json_per_move = len(move_json) + 2 * json_bytes
+    binary_per_move = 2 + 2 * len(placed)
+    print(f"每手总字节: JSON {json_per_move}，二进制 {binary_per_move}（{json_per_move / binary_per_move:.0f} 倍）")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,72 @@
+import time
+
+# 连接限流
+#
+# 每个连接一个总的令牌桶，每种消息类型再各有一个令牌桶：令牌按固定速率补充，
+# 最多积累到桶的容量，每条消息消耗一个令牌，没有令牌时丢弃该消息。
+# 正常操作（点击落子、准备、投票）远低于这些速率；持续超过总速率的连接
+# 累计 FLOOD_STRIKES 次后由服务器断开，处理一个恶意连接的开销因此有上限。
+
+# 消息类型 -> (每秒补充的令牌数, 桶容量)
+RATE_LIMITS = {
+    'authentication': (1, 3),
+    'select_color': (2, 5),
+    'ready': (1, 3),
+    'move': (4, 8),
+    'restart_vote': (1, 3),
+    'ping': (1, 3),
+    'pong': (1, 3),
+    'analyze': (1, 3),
+}
+DEFAULT_LIMIT = (2, 5)  # 其他消息类型
+CONNECTION_LIMIT = (10, 20)  # 每个连接所有消息合计
+FLOOD_STRIKES = 50  # 超过总速率的次数达到该值时断开连接
+
+
+class TokenBucket:
+    """令牌桶"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, now=None):
+        """取一个令牌，没有令牌时返回False"""
+        if now is None:
+            now = time.monotonic()
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+
+class RateLimiter:
+    """一个连接的限流状态：总令牌桶 + 按消息类型的令牌桶（第一次收到该类型时创建）"""
+    __slots__ = ('total', 'buckets', 'strikes')
+
+    def __init__(self, now=None):
+        self.total = TokenBucket(*CONNECTION_LIMIT, now=now)
+        self.buckets = {}
+        self.strikes = 0
+
+    def allow(self, message_type, now=None):
+        """返回是否处理这条消息；连接持续刷消息时抛出ValueError"""
+        if now is None:
+            now = time.monotonic()
+        if not self.total.consume(now):
+            self.strikes += 1
+            if self.strikes >= FLOOD_STRIKES:
+                raise ValueError("发送消息过于频繁")
+            return False
+        # 未知的类型共用一个桶，避免用随机类型名创建大量桶
+        key = message_type if message_type in RATE_LIMITS else None
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*RATE_LIMITS.get(key, DEFAULT_LIMIT), now=now)
+        return bucket.consume(now)
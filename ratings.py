@@ -0,0 +1,332 @@
+import os
+import json
+import bisect
+import threading
+import time
+
+from record import read_records
+
+# 积分与排行榜
+#
+# RatingStore 作为 GomokuServer.on_event 回调逐条消费日志事件：game_start 时记下对局的玩家，
+# game_end 时更新双方的 Elo 积分，玩家断线或重新开始时对局作废，丢掉记下的玩家。排行榜是按 (-积分, 用户名) 排序的列表，
+# 每局只需用二分查找删除、插入两名玩家，前K名和名次查询不必对所有玩家排序。
+# 持久化与检查点文件相同，采用“快照 + 只追加的日志”：
+#   快照 <path>：所有玩家的积分和最后一条已计入快照的结果序号，用 rename 原子替换
+#   结果日志 <path>.journal：每局结果一行 JSON，带递增序号
+# 启动时读快照，再补上序号更大的结果；结果日志达到 SNAPSHOT_INTERVAL 条时写新快照并清空结果日志。
+# 快照写完但结果日志还没清空时崩溃也不会重复计分，因为重放时按序号跳过。
+
+INITIAL_RATING = 1500  # 新玩家的初始积分
+ELO_K = 32  # Elo 更新系数
+SNAPSHOT_INTERVAL = 1000  # 结果日志达到多少条时写一次快照
+MAX_GAMES = 10000  # 最多记住多少局进行中对局的玩家，超出时丢掉最早开始的，结束时再从日志文件读取
+
+
+def expected_score(rating, opponent_rating):
+    """Elo 期望得分"""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def read_game_start(log_dir, game_id):
+    """从日志文件第一行读出对局的玩家列表，找不到或不是这一局时返回空列表"""
+    try:
+        with open(os.path.join(log_dir, f"game_{game_id}.json"), encoding='utf-8') as f:
+            event = json.loads(f.readline())
+    except (OSError, ValueError):
+        return []
+    if event.get('event_type') != 'game_start' or event.get('game_id') != game_id:
+        return []
+    return list(event.get('players', {}))
+
+
+class RatingStore:
+    """增量更新的积分表和排行榜"""
+
+    def __init__(self, path=None, log_dir='game_logs', snapshot_interval=SNAPSHOT_INTERVAL, max_games=MAX_GAMES):
+        self.path = path  # 为None时只保存在内存中
+        self.journal_path = path + '.journal' if path else None
+        self.log_dir = log_dir
+        self.snapshot_interval = snapshot_interval
+        self.max_games = max_games
+        self.lock = threading.Lock()
+        self.reset()
+        if path and os.path.exists(path):
+            self.load()
+
+    def reset(self):
+        self.ratings = {}  # 用户名 -> 积分
+        self.stats = {}  # 用户名 -> [对局数, 胜局数]
+        self.board = []  # 排行榜，按 (-积分, 用户名) 排序
+        self.games = {}  # 进行中的对局编号 -> 玩家列表，按开始的先后排列
+        self.seq = 0  # 最后一条结果的序号
+        self.snapshot_seq = 0  # 已计入快照的结果序号
+        self.journal = None
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def _set(self, name, rating):
+        """修改积分并同步更新排行榜"""
+        old = self.ratings.get(name)
+        if old is not None:
+            index = bisect.bisect_left(self.board, (-old, name))
+            del self.board[index]
+        self.ratings[name] = rating
+        bisect.insort(self.board, (-rating, name))
+
+    def apply(self, winner, losers):
+        """计入一局结果（调用方持有锁）"""
+        for loser in losers:
+            if loser == winner:
+                continue
+            winner_rating = self.ratings.get(winner, INITIAL_RATING)
+            loser_rating = self.ratings.get(loser, INITIAL_RATING)
+            delta = ELO_K * (1 - expected_score(winner_rating, loser_rating))
+            self._set(winner, winner_rating + delta)
+            self._set(loser, loser_rating - delta)
+            self.stats.setdefault(winner, [0, 0])[0] += 1
+            self.stats[winner][1] += 1
+            self.stats.setdefault(loser, [0, 0])[0] += 1
+
+    def consume(self, event):
+        """消费一条日志事件，可直接用作 GomokuServer.on_event"""
+        event_type = event.get('event_type')
+        if event_type not in ('game_start', 'game_end', 'player_disconnect', 'game_restart'):
+            return
+        with self.lock:
+            if event_type == 'game_start':
+                self.games.pop(event['game_id'], None)
+                self.games[event['game_id']] = list(event.get('players', {}))
+                while len(self.games) > self.max_games:
+                    del self.games[next(iter(self.games))]
+                return
+            players = self.games.pop(event['game_id'], None)
+            if event_type != 'game_end':
+                # 对局作废，不计积分
+                return
+            if players is None:
+                # 对局开始于本进程启动之前（如从检查点恢复），从日志文件读取玩家
+                players = read_game_start(self.log_dir, event['game_id'])
+            winner = event.get('winner')
+            if winner not in players:
+                return
+            losers = [player for player in players if player != winner]
+            self.apply(winner, losers)
+            self.seq += 1
+            if self.path:
+                self.append_journal({'seq': self.seq, 'game_id': event['game_id'],
+                                     'winner': winner, 'losers': losers})
+
+    def append_journal(self, entry):
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.journal.flush()
+        if self.seq - self.snapshot_seq >= self.snapshot_interval:
+            self.save()
+
+    def save(self):
+        """写快照并清空结果日志（调用方持有锁）"""
+        if not self.path:
+            return
+        state = {
+            'seq': self.seq,
+            'players': {name: [rating] + self.stats.get(name, [0, 0]) for name, rating in self.ratings.items()}
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if self.journal:
+            self.journal.close()
+        self.journal = open(self.journal_path, 'w', encoding='utf-8')
+        self.snapshot_seq = self.seq
+
+    def load(self):
+        """读取快照，再补上结果日志中序号更大的结果"""
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        for name, (rating, games, wins) in state['players'].items():
+            self.ratings[name] = rating
+            self.stats[name] = [games, wins]
+        self.board = sorted((-rating, name) for name, rating in self.ratings.items())
+        self.seq = self.snapshot_seq = state['seq']
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path):
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # 崩溃时写了一半的行
+                    if entry['seq'] > self.seq:
+                        self.apply(entry['winner'], entry['losers'])
+                        self.seq = entry['seq']
+            # 立即写新快照，同时去掉结果日志末尾可能不完整的行
+            self.save()
+
+    def rebuild(self, sources=None):
+        """清空后按时间顺序扫描一遍历史对局重新计算，sources 为日志目录或 .gkr 棋谱文件，返回计入的对局数"""
+        sources = sources or [self.log_dir]
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+            self.reset()
+            count = 0
+            for winner, players in _scan_results(sources):
+                if winner in players:
+                    self.apply(winner, [player for player in players if player != winner])
+                    count += 1
+            self.save()
+        return count
+
+    def rating(self, name):
+        return self.ratings.get(name, INITIAL_RATING)
+
+    def top(self, k=10):
+        """前 k 名，返回 [(名次, 用户名, 积分, 对局数, 胜局数)]"""
+        with self.lock:
+            return [(rank, name, -key) + tuple(self.stats.get(name, [0, 0]))
+                    for rank, (key, name) in enumerate(self.board[:k], 1)]
+
+    def player(self, name):
+        """单个玩家的名次和战绩，没有对局记录时返回None"""
+        with self.lock:
+            rating = self.ratings.get(name)
+            if rating is None:
+                return None
+            games, wins = self.stats.get(name, [0, 0])
+            return {
+                'name': name,
+                'rating': rating,
+                'rank': bisect.bisect_left(self.board, (-rating, name)) + 1,
+                'games': games,
+                'wins': wins
+            }
+
+    def close(self):
+        with self.lock:
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+
+def _scan_results(sources):
+    """流式读取历史对局，逐局生成 (胜者, 玩家列表)
+
+    日志目录中的文件名带有时间戳，按文件名排序即为时间顺序；
+    落子行不含 game_start/game_end，直接跳过而不解析JSON。
+    """
+    for source in sources:
+        if source.endswith('.gkr'):
+            for record in read_records(source):
+                players = [name for name, _ in record['players']]
+                for _, event_type, extra in record['events']:
+                    if event_type == 'game_end':
+                        yield extra[0], players
+            continue
+        if not os.path.isdir(source):
+            continue
+        for name in sorted(entry.name for entry in os.scandir(source) if entry.name.endswith('.json')):
+            players = []
+            with open(os.path.join(source, name), encoding='utf-8') as f:
+                for line in f:
+                    if '"game_start"' not in line and '"game_end"' not in line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if event.get('event_type') == 'game_start':
+                        players = list(event.get('players', {}))
+                    elif event.get('event_type') == 'game_end':
+                        yield event.get('winner'), players
+
+
+def open_store(path, log_dir='game_logs'):
+    """打开积分文件，文件不存在时先从日志重建"""
+    store = RatingStore(path, log_dir)
+    if path is None or not os.path.exists(path):
+        count = store.rebuild()
+        print(f"从 {log_dir} 重建积分：{count} 局，{len(store)} 名玩家")
+    return store
+
+
+def benchmark(games=200000, players=20000, queries=10000, seed=0):
+    """测量逐局更新积分和排行榜查询的速度，与每次查询都重新排序对比"""
+    import random
+    rng = random.Random(seed)
+    names = [f"player{i}" for i in range(players)]
+    store = RatingStore()
+
+    start = time.perf_counter()
+    for index in range(games):
+        game_id = str(index)
+        pair = rng.sample(names, 2)
+        store.consume({'event_type': 'game_start', 'game_id': game_id, 'players': {name: {} for name in pair}})
+        store.consume({'event_type': 'game_end', 'game_id': game_id, 'winner': rng.choice(pair)})
+    update_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(queries):
+        store.top(10)
+    top_time = (time.perf_counter() - start) / queries
+
+    sample = rng.sample(names, 1000)
+    start = time.perf_counter()
+    for name in sample:
+        store.player(name)
+    rank_time = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    for _ in range(20):
+        ordered = sorted(store.ratings.items(), key=lambda item: -item[1])[:10]
+    sort_time = (time.perf_counter() - start) / 20
+    assert [name for name, _ in ordered] == [entry[1] for entry in store.top(10)]
+
+    print(f"{games} 局，{players} 名玩家")
+    print(f"逐局更新积分和排行榜: {update_time * 1e6 / games:.1f} 微秒/局")
+    print(f"前10名查询: {top_time * 1e6:.1f} 微秒，单个玩家名次: {rank_time * 1e6:.1f} 微秒")
+    print(f"每次查询重新排序: {sort_time * 1e6:.0f} 微秒（{sort_time / top_time:.0f} 倍）")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='积分与排行榜')
+    parser.add_argument('--path', default='ratings.json', help='积分文件')
+    parser.add_argument('--log-dir', default='game_logs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help='从历史对局重建积分')
+    rebuild_parser.add_argument('sources', nargs='*', help='日志目录或 .gkr 棋谱文件，默认为 --log-dir')
+    top_parser = subparsers.add_parser('top', help='显示排行榜')
+    top_parser.add_argument('k', type=int, nargs='?', default=10)
+    player_parser = subparsers.add_parser('player', help='显示玩家的积分和名次')
+    player_parser.add_argument('name')
+    benchmark_parser = subparsers.add_parser('benchmark')
+    benchmark_parser.add_argument('--games', type=int, default=200000)
+    benchmark_parser.add_argument('--players', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        benchmark(args.games, args.players)
+    elif args.command == 'rebuild':
+        store = RatingStore(args.path, args.log_dir)
+        start = time.perf_counter()
+        count = store.rebuild(args.sources)
+        print(f"重建完成：{count} 局，{len(store)} 名玩家，用时 {time.perf_counter() - start:.2f} 秒")
+        store.close()
+    else:
+        store = open_store(args.path, args.log_dir)
+        if args.command == 'top':
+            for rank, name, rating, games, wins in store.top(args.k):
+                print(f"{rank:4d}  {name:20s}  {rating:7.1f}  {games} 局 {wins} 胜")
+        else:
+            info = store.player(args.name)
+            if info is None:
+                print(f"玩家 {args.name} 没有对局记录")
+            else:
+                print(f"{info['name']}：积分 {info['rating']:.1f}，第 {info['rank']} 名，"
+                      f"{info['games']} 局 {info['wins']} 胜")
+        store.close()
@@ -0,0 +1,501 @@
+import os
+import json
+import calendar
+import datetime
+import struct
+import itertools
+
+# 紧凑棋谱格式
+#
+# 文件以魔数开头，之后是一局接一局的对局记录，每局前面是变长整数表示的长度，
+# 读取时不需要的对局可以直接跳过：
+#   文件头: 魔数(4字节) + 版本(1字节)
+#   对局:   长度(varint) + 对局编号(varint长度 + UTF-8) + 开始时间(u32 秒)
+#           + 玩家数(1字节) + 每个玩家: 颜色(1字节) + 用户名(varint长度 + UTF-8)
+#           + 手数(varint) + 每手一个字节(row * 15 + col)
+#           + 事件数(varint) + 每个事件: 类型(1字节) + 发生在第几手之后(varint) + 附加字段
+#           + 时间差(zigzag varint，单位秒)：按时间顺序依次为每一手和每个事件相对上一条的时间差
+# 落子的颜色按黑白交替推出，落子的玩家就是执该颜色的玩家，所以每手只需要一个字节。
+# 时间差放在对局末尾，不需要时间的读取方只解析对局头和事件，落子直接切片取出。
+MAGIC = b'GKRC'
+VERSION = 1
+START = struct.Struct('<IB')  # 开始时间 + 玩家数
+BOARD_SIZE = 15
+
+COLORS = [None, 'black', 'white']
+COLOR_CODES = {color: i for i, color in enumerate(COLORS)}
+EVENTS = [None, 'game_end', 'player_disconnect', 'game_restart', 'game_resume']
+EVENT_CODES = {event: i for i, event in enumerate(EVENTS) if event}
+REASONS = [None, 'timeout']
+REASON_CODES = {reason: i for i, reason in enumerate(REASONS)}
+PLAYER_NONE = 0xFF  # 玩家引用：空
+PLAYER_NAME = 0xFE  # 玩家引用：不在玩家列表中，后面跟用户名
+RESTART_MESSAGE = "玩家投票重新开始游戏"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ZIGZAG = [(value >> 1) if not value & 1 else -((value + 1) >> 1) for value in range(0x80)]
+
+
+def _pack_varint(value, out):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _unpack_varint(data, pos):
+    value = data[pos]
+    pos += 1
+    if value < 0x80:
+        return value, pos
+    value &= 0x7F
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _pack_str(value, out):
+    data = value.encode('utf-8')
+    _pack_varint(len(data), out)
+    out += data
+
+
+def _unpack_str(data, pos):
+    length, pos = _unpack_varint(data, pos)
+    return data[pos:pos + length].decode('utf-8'), pos + length
+
+
+def parse_time(timestamp):
+    """日志中的时间字符串 -> 秒（按UTC换算，只用于保证能原样还原）"""
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+def format_time(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime(TIME_FORMAT)
+
+
+def encode_game(game):
+    """把一局对局编码为一条记录（含长度前缀）"""
+    players = game['players']
+    index = {name: i for i, (name, _) in enumerate(players)}
+
+    def pack_player(name, out):
+        if name is None:
+            out.append(PLAYER_NONE)
+        elif name in index:
+            out.append(index[name])
+        else:
+            out.append(PLAYER_NAME)
+            _pack_str(name, out)
+
+    body = bytearray()
+    _pack_str(game['game_id'], body)
+    body += START.pack(game['start'], len(players))
+    for name, color in players:
+        body.append(COLOR_CODES[color])
+        _pack_str(name, body)
+    _pack_varint(len(game['moves']), body)
+    body += game['moves']
+    _pack_varint(len(game['events']), body)
+    for ply, event_type, extra in game['events']:
+        body.append(EVENT_CODES[event_type])
+        _pack_varint(ply, body)
+        if event_type == 'game_end':
+            winner, winner_color, reason = extra
+            pack_player(winner, body)
+            body.append(COLOR_CODES[winner_color])
+            body.append(REASON_CODES[reason])
+        elif event_type == 'player_disconnect':
+            pack_player(extra, body)
+    previous = 0
+    for offset in game.get('times') or [0] * (len(game['moves']) + len(game['events'])):
+        delta = offset - previous
+        previous = offset
+        _pack_varint(delta << 1 if delta >= 0 else (-delta << 1) - 1, body)
+
+    out = bytearray()
+    _pack_varint(len(body), out)
+    return bytes(out + body)
+
+
+def decode_game(data, pos=0, times=False):
+    """解码一条记录的内容，times=False 时跳过时间差"""
+    # 长度、计数和编号通常都小于128，只占一个字节，先走单字节的快速路径
+    length = data[pos]
+    if length < 0x80:
+        game_id = data[pos + 1:pos + 1 + length].decode('utf-8')
+        pos += 1 + length
+    else:
+        game_id, pos = _unpack_str(data, pos)
+    start, count = START.unpack_from(data, pos)
+    pos += START.size
+    players = []
+    for _ in range(count):
+        color = COLORS[data[pos]]
+        length = data[pos + 1]
+        if length < 0x80:
+            # 用户名通常不超过127字节，长度只占一个字节
+            pos += 2
+            name = data[pos:pos + length].decode('utf-8')
+            pos += length
+        else:
+            name, pos = _unpack_str(data, pos + 1)
+        players.append((name, color))
+    move_count = data[pos]
+    if move_count < 0x80:
+        pos += 1
+    else:
+        move_count, pos = _unpack_varint(data, pos)
+    moves = data[pos:pos + move_count]
+    pos += move_count
+    event_count = data[pos]
+    pos += 1
+    if event_count >= 0x80:
+        event_count, pos = _unpack_varint(data, pos - 1)
+    events = []
+    for _ in range(event_count):
+        event_type = EVENTS[data[pos]]
+        ply = data[pos + 1]
+        if ply < 0x80:
+            pos += 2
+        else:
+            ply, pos = _unpack_varint(data, pos + 1)
+        extra = None
+        if event_type == 'game_end':
+            ref = data[pos]
+            if ref < len(players):
+                winner = players[ref][0]
+                pos += 1
+            else:
+                winner, pos = _unpack_player(data, pos, players)
+            extra = (winner, COLORS[data[pos]], REASONS[data[pos + 1]])
+            pos += 2
+        elif event_type == 'player_disconnect':
+            extra, pos = _unpack_player(data, pos, players)
+        events.append((ply, event_type, extra))
+    game = {'game_id': game_id, 'start': start, 'players': players, 'moves': moves, 'events': events}
+    if times:
+        count = move_count + event_count
+        block = data[pos:pos + count]
+        if len(block) == count and (not block or max(block) < 0x80):
+            # 时间差都小于64秒时每个只占一个字节，直接查表累加
+            game['times'] = list(itertools.accumulate(map(ZIGZAG.__getitem__, block)))
+        else:
+            offsets = []
+            offset = 0
+            for _ in range(count):
+                value, pos = _unpack_varint(data, pos)
+                offset += (value >> 1) if not value & 1 else -((value + 1) >> 1)
+                offsets.append(offset)
+            game['times'] = offsets
+    return game
+
+
+def _unpack_player(data, pos, players):
+    ref = data[pos]
+    if ref == PLAYER_NONE:
+        return None, pos + 1
+    if ref == PLAYER_NAME:
+        return _unpack_str(data, pos + 1)
+    return players[ref][0], pos + 1
+
+
+class GameRecord:
+    """棋谱中的一局，读取时只切出字节，字段在第一次访问时才解码
+
+    用法和 decode_game 返回的字典相同（game['moves']、game.get('times')），
+    只需要筛选或计数的读取方不必付出解析的开销。
+    """
+    __slots__ = ('data', 'times', '_game')
+
+    def __init__(self, data, times=False):
+        self.data = data
+        self.times = times
+        self._game = None
+
+    def decode(self):
+        if self._game is None:
+            self._game = decode_game(self.data, 0, self.times)
+        return self._game
+
+    def __getitem__(self, key):
+        return self.decode()[key]
+
+    def get(self, key, default=None):
+        return self.decode().get(key, default)
+
+
+class RecordWriter:
+    """顺序追加对局记录"""
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC + bytes([VERSION]))
+
+    def write(self, game):
+        self.file.write(encode_game(game))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path, times=False, chunk_size=1 << 20):
+    """流式读取棋谱文件，逐局返回 GameRecord"""
+    with open(path, 'rb') as f:
+        header = f.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} 不是棋谱文件")
+        if header[len(MAGIC)] != VERSION:
+            raise ValueError(f"不支持的棋谱版本: {header[len(MAGIC)]}")
+        buffer = b''
+        while True:
+            chunk = f.read(chunk_size)
+            buffer = buffer[pos:] + chunk if buffer else chunk
+            pos = 0
+            size = len(buffer)
+            while pos < size:
+                # 记录长度通常只占一到两个字节，直接取出；长度前缀本身也可能被截断在块边界上
+                length = buffer[pos]
+                if length < 0x80:
+                    start = pos + 1
+                elif pos + 1 < size and buffer[pos + 1] < 0x80:
+                    length = length & 0x7F | buffer[pos + 1] << 7
+                    start = pos + 2
+                else:
+                    try:
+                        length, start = _unpack_varint(buffer, pos)
+                    except IndexError:
+                        break
+                if start + length > size:
+                    break
+                yield GameRecord(buffer[start:start + length], times)
+                pos = start + length
+            if not chunk:
+                if pos < size:
+                    print(f"棋谱文件 {path} 末尾有不完整的对局，已忽略")
+                return
+
+
+def game_from_events(events):
+    """把一个日志文件中的事件转换为对局字典，不支持的日志抛出ValueError"""
+    if not events or events[0].get('event_type') != 'game_start':
+        raise ValueError("日志不是以 game_start 开头")
+    first = events[0]
+    start = parse_time(first['timestamp'])
+    players = [(name, info.get('color')) for name, info in first.get('players', {}).items()]
+    colors = {color: name for name, color in players}
+    moves = bytearray()
+    game_events = []
+    times = []
+    for event in events[1:]:
+        event_type = event.get('event_type')
+        times.append(parse_time(event['timestamp']) - start)
+        if event_type == 'move':
+            row, col = event['position']
+            color = 'black' if len(moves) % 2 == 0 else 'white'
+            if event.get('color') != color or event.get('player') != colors.get(color):
+                raise ValueError(f"第 {len(moves) + 1} 手的颜色或玩家与黑白交替不符")
+            moves.append(row * BOARD_SIZE + col)
+        elif event_type == 'game_end':
+            extra = (event.get('winner'), event.get('winner_color'), event.get('reason'))
+            if extra[2] not in REASON_CODES:
+                raise ValueError(f"未知的结束原因: {extra[2]}")
+            game_events.append((len(moves), event_type, extra))
+        elif event_type == 'player_disconnect':
+            game_events.append((len(moves), event_type, event.get('player')))
+        elif event_type in ('game_restart', 'game_resume'):
+            game_events.append((len(moves), event_type, None))
+        else:
+            raise ValueError(f"未知的事件类型: {event_type}")
+    return {
+        'game_id': first['game_id'],
+        'start': start,
+        'players': players,
+        'moves': bytes(moves),
+        'events': game_events,
+        'times': times
+    }
+
+
+def game_to_events(game):
+    """把对局字典还原为与服务器写入格式相同的日志事件列表"""
+    game_id = game['game_id']
+    start = game['start']
+    colors = {color: name for name, color in game['players']}
+    times = iter(game.get('times') or [])
+
+    def entry(event_type, data):
+        log_entry = {
+            "timestamp": format_time(start + next(times, 0)),
+            "event_type": event_type,
+            "game_id": game_id
+        }
+        log_entry.update(data)
+        return log_entry
+
+    events = [{
+        "timestamp": format_time(start),
+        "event_type": "game_start",
+        "game_id": game_id,
+        "players": {name: {"color": color} for name, color in game['players']}
+    }]
+    pending = list(game['events'])
+    pending.reverse()
+    for ply in range(len(game['moves']) + 1):
+        while pending and pending[-1][0] == ply:
+            _, event_type, extra = pending.pop()
+            if event_type == 'game_end':
+                data = {"winner": extra[0], "winner_color": extra[1]}
+                if extra[2]:
+                    data["reason"] = extra[2]
+            elif event_type == 'player_disconnect':
+                data = {"player": extra}
+            elif event_type == 'game_restart':
+                data = {"message": RESTART_MESSAGE}
+            else:
+                data = {"moves": ply}
+            events.append(entry(event_type, data))
+        if ply < len(game['moves']):
+            row, col = divmod(game['moves'][ply], BOARD_SIZE)
+            color = 'black' if ply % 2 == 0 else 'white'
+            events.append(entry("move", {"player": colors.get(color), "color": color, "position": [row, col]}))
+    return events
+
+
+def convert_logs(log_dir, path):
+    """把目录中的JSONL日志转换为一个棋谱文件，返回转换的对局数"""
+    count = 0
+    with RecordWriter(path) as writer:
+        for name in sorted(os.listdir(log_dir)):
+            if not name.endswith('.json'):
+                continue
+            events = []
+            with open(os.path.join(log_dir, name), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        continue
+            try:
+                writer.write(game_from_events(events))
+                count += 1
+            except (ValueError, KeyError) as e:
+                print(f"跳过日志 {name}: {e}")
+    return count
+
+
+def export_logs(path, log_dir):
+    """把棋谱文件还原为JSONL日志，每局一个文件，返回还原的对局数"""
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    count = 0
+    for game in read_records(path, times=True):
+        with open(os.path.join(log_dir, f"game_{game['game_id']}.json"), 'w', encoding='utf-8') as f:
+            for event in game_to_events(game):
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def benchmark(game_count=1000000, moves_per_game=40, path='benchmark.gkr', seed=0):
+    """生成大量对局，比较JSONL与棋谱格式的大小，以及读取棋谱时I/O与解析的耗时"""
+    import random
+    import time
+
+    rng = random.Random(seed)
+    sample = []
+    for i in range(100):
+        cells = bytes(rng.sample(range(BOARD_SIZE * BOARD_SIZE), moves_per_game))
+        times = sorted(rng.randrange(600) for _ in range(moves_per_game + 1))
+        sample.append({
+            'game_id': f"2025041314{i:04d}",
+            'start': 1744554758 + i,
+            'players': [(f"玩家{i}", 'black'), (f"对手{i}", 'white')],
+            'moves': cells,
+            'events': [(moves_per_game, 'game_end', (f"玩家{i}", 'black', None))],
+            'times': times
+        })
+    json_size = sum(len(json.dumps(event, ensure_ascii=False).encode('utf-8')) + 1
+                    for event in game_to_events(sample[0]))
+
+    start = time.perf_counter()
+    records = [encode_game(game) for game in sample]
+    encode_time = (time.perf_counter() - start) / len(sample)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + bytes([VERSION]))
+        for i in range(game_count):
+            f.write(records[i % len(records)])
+    file_size = os.path.getsize(path)
+
+    try:
+        # 先读一遍让文件进入页缓存，再分别测量纯读取和完整解析
+        with open(path, 'rb') as f:
+            while f.read(1 << 20):
+                pass
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            while f.read(1 << 20):
+                pass
+        io_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for game in read_records(path):
+            pass
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        moves = 0
+        for game in read_records(path):
+            moves += len(game['moves'])
+        read_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for game in read_records(path, times=True):
+            game.decode()
+        timed_read_time = time.perf_counter() - start
+    finally:
+        os.remove(path)
+
+    print(f"每局 {moves_per_game} 手: JSONL {json_size} 字节，棋谱 {len(records[0])} 字节"
+          f"（{json_size / len(records[0]):.0f} 倍），编码 {encode_time * 1e6:.1f} 微秒/局")
+    print(f"{game_count} 局共 {file_size / 1e6:.1f} MB，{moves} 手")
+    print(f"纯读取（页缓存）: {io_time:.2f} 秒；逐局切分: {scan_time:.2f} 秒，"
+          f"{scan_time / game_count * 1e6:.2f} 微秒/局")
+    print(f"解析玩家、落子和事件: {read_time:.2f} 秒，{read_time / game_count * 1e6:.2f} 微秒/局；"
+          f"含时间: {timed_read_time:.2f} 秒，{timed_read_time / game_count * 1e6:.2f} 微秒/局")
+    # 读取的瓶颈在解析而不是I/O，解析耗时是纯读取的多少倍
+    print(f"解析/读取: {read_time / max(io_time, 1e-9):.0f} 倍")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='紧凑棋谱格式转换')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    encode_parser = subparsers.add_parser('encode', help='把JSONL日志目录转换为棋谱文件')
+    encode_parser.add_argument('log_dir')
+    encode_parser.add_argument('path')
+    decode_parser = subparsers.add_parser('decode', help='把棋谱文件还原为JSONL日志目录')
+    decode_parser.add_argument('path')
+    decode_parser.add_argument('log_dir')
+    benchmark_parser = subparsers.add_parser('benchmark', help='读写基准测试')
+    benchmark_parser.add_argument('--games', type=int, default=1000000)
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        print(f"已转换 {convert_logs(args.log_dir, args.path)} 局")
+    elif args.command == 'decode':
+        print(f"已还原 {export_logs(args.path, args.log_dir)} 局")
+    else:
+        benchmark(args.games)
@@ -0,0 +1,309 @@
+import itertools
+
+# 连珠（Renju）禁手判断
+#
+# 棋盘上每个点在四个方向上各有一条“线”，取该点两侧各5个点共10个邻居，
+# 每个邻居编码为 0=空、1=己方、2=对方或棋盘外，按三进制组成线编码（0 ~ 3^10-1）。
+# 假设中心点落下己方棋子，线上的棋型只取决于这个编码，因此可以预先为所有编码算好：
+#   五连、长连、冲四数量、活三 —— 判断禁手只需要查4次表。
+# PatternBoard 为每个点、每个方向、黑白双方各维护一个线编码，落子时只更新
+# 受影响的至多 4 * 10 个点，不需要重新扫描棋盘。
+#
+# 活三按单条线判断：填一个空点后能形成活四（两端都能成五的四）即为活三，
+# 不再递归检查成活四的那一手本身是否禁手。
+
+BOARD_SIZE = 15
+EMPTY, BLACK, WHITE = 0, 1, 2
+COLORS = {'black': BLACK, 'white': WHITE}
+DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+HALF = 5  # 线窗口半径
+OWN, OTHER = 1, 2
+OFFSETS = [k for k in range(-HALF, HALF + 1) if k != 0]
+WEIGHTS = {k: 3 ** i for i, k in enumerate(OFFSETS)}
+TABLE_SIZE = 3 ** len(OFFSETS)
+
+# 表项中的标志位
+FIVE = 0x01  # 恰好五连
+OVERLINE = 0x02  # 长连（六个及以上）
+FOUR_SHIFT = 2  # 冲四数量（恰好成五），2位
+THREE_EXACT = 0x10  # 活三（恰好成五）
+FREE_FOUR_SHIFT = 5  # 冲四数量（五个及以上即可），2位
+THREE_FREE = 0x80  # 活三（五个及以上即可）
+
+FORBIDDEN_NAMES = {'overline': '长连', 'double_four': '四四', 'double_three': '三三'}
+
+
+def _five_points(line, exact):
+    """返回中心棋子所在连子两端的空点中，填上后能成五的位置"""
+    center = HALF
+    left = 0
+    while center - left - 1 >= 0 and line[center - left - 1] == OWN:
+        left += 1
+    right = 0
+    while center + right + 1 < len(line) and line[center + right + 1] == OWN:
+        right += 1
+    if left + right + 1 >= 5:
+        return []
+
+    points = []
+    # 只有紧挨着连子两端的空点才能与中心棋子连成一线
+    gap = center - left - 1
+    if gap >= 0 and line[gap] == EMPTY:
+        beyond = 0
+        while gap - beyond - 1 >= 0 and line[gap - beyond - 1] == OWN:
+            beyond += 1
+        run = left + right + 2 + beyond
+        if run == 5 or (not exact and run > 5):
+            points.append(gap)
+    gap = center + right + 1
+    if gap < len(line) and line[gap] == EMPTY:
+        beyond = 0
+        while gap + beyond + 1 < len(line) and line[gap + beyond + 1] == OWN:
+            beyond += 1
+        run = left + right + 2 + beyond
+        if run == 5 or (not exact and run > 5):
+            points.append(gap)
+    return points
+
+
+def _build_table():
+    """枚举所有线编码，计算中心落子后的棋型标志"""
+    table = bytearray(TABLE_SIZE)
+    straight = [bytearray(TABLE_SIZE), bytearray(TABLE_SIZE)]  # 是否为活四（恰好成五/五个及以上）
+    lines = {}
+
+    for digits in itertools.product((EMPTY, OWN, OTHER), repeat=len(OFFSETS)):
+        line = list(digits[:HALF]) + [OWN] + list(digits[HALF:])
+        index = sum(d * 3 ** i for i, d in enumerate(digits))
+        lines[index] = line
+
+        run = 1
+        k = HALF - 1
+        while k >= 0 and line[k] == OWN:
+            run += 1
+            k -= 1
+        k = HALF + 1
+        while k < len(line) and line[k] == OWN:
+            run += 1
+            k += 1
+
+        flags = 0
+        if run == 5:
+            flags |= FIVE
+        elif run > 5:
+            flags |= OVERLINE
+        for variant, (exact, shift) in enumerate(((True, FOUR_SHIFT), (False, FREE_FOUR_SHIFT))):
+            points = _five_points(line, exact)
+            fours = len(points)
+            # 两个成五点相距5格时是同一个活四（_XXXX_）
+            if fours == 2 and points[1] - points[0] == 5:
+                fours = 1
+                straight[variant][index] = 1
+            flags |= fours << shift
+        table[index] = flags
+
+    # 活三：本身还不是四（或五），在中心两侧4格内再下一子即可形成活四
+    for index, line in lines.items():
+        flags = table[index]
+        exact_open = not flags & (FIVE | OVERLINE) and not (flags >> FOUR_SHIFT) & 3
+        free_open = not flags & (FIVE | OVERLINE) and not (flags >> FREE_FOUR_SHIFT) & 3
+        for k in range(1, 2 * HALF):
+            if k == HALF or line[k] != EMPTY:
+                continue
+            offset = k - HALF
+            filled = index + WEIGHTS[offset] * OWN
+            if exact_open and straight[0][filled]:
+                flags |= THREE_EXACT
+            if free_open and straight[1][filled]:
+                flags |= THREE_FREE
+        table[index] = flags
+    return bytes(table)
+
+
+_table = None
+
+
+def get_table():
+    """线编码 -> 棋型标志表，第一次使用时生成"""
+    global _table
+    if _table is None:
+        _table = _build_table()
+    return _table
+
+
+def _build_neighbors():
+    """对每个方向、每个点，列出落子会影响到的点以及该点线编码中对应的权重"""
+    affected = []
+    edge_codes = []
+    for dx, dy in DIRECTIONS:
+        per_cell = []
+        edges = []
+        for row in range(BOARD_SIZE):
+            for col in range(BOARD_SIZE):
+                cells = []
+                edge = 0
+                for k in OFFSETS:
+                    r, c = row + k * dx, col + k * dy
+                    if 0 <= r < BOARD_SIZE and 0 <= c < BOARD_SIZE:
+                        # (row, col) 的棋子位于 (r, c) 这条线上偏移 -k 的位置
+                        cells.append((r * BOARD_SIZE + c, WEIGHTS[-k]))
+                    else:
+                        edge += WEIGHTS[k] * OTHER
+                per_cell.append(cells)
+                edges.append(edge)
+        affected.append(per_cell)
+        edge_codes.append(edges)
+    return affected, edge_codes
+
+
+AFFECTED, EDGE_CODES = _build_neighbors()
+
+
+class PatternBoard:
+    """增量维护线编码的棋盘"""
+
+    def __init__(self):
+        self.table = get_table()
+        self.cells = [EMPTY] * (BOARD_SIZE * BOARD_SIZE)
+        # codes[颜色][方向][点]：以该颜色为“己方”的线编码，下标 0 不使用
+        self.codes = [None] + [[list(EDGE_CODES[d]) for d in range(4)] for _ in (BLACK, WHITE)]
+
+    def place(self, row, col, color):
+        """落子，color 为 BLACK 或 WHITE"""
+        cell = row * BOARD_SIZE + col
+        self.cells[cell] = color
+        own = self.codes[color]
+        other = self.codes[BLACK + WHITE - color]
+        for d in range(4):
+            own_d = own[d]
+            other_d = other[d]
+            for n, weight in AFFECTED[d][cell]:
+                own_d[n] += weight * OWN
+                other_d[n] += weight * OTHER
+
+    def remove(self, row, col):
+        """撤销落子"""
+        cell = row * BOARD_SIZE + col
+        color = self.cells[cell]
+        self.cells[cell] = EMPTY
+        own = self.codes[color]
+        other = self.codes[BLACK + WHITE - color]
+        for d in range(4):
+            own_d = own[d]
+            other_d = other[d]
+            for n, weight in AFFECTED[d][cell]:
+                own_d[n] -= weight * OWN
+                other_d[n] -= weight * OTHER
+
+    def flags(self, row, col, color):
+        """在 (row, col) 落下 color 后四个方向的棋型标志"""
+        cell = row * BOARD_SIZE + col
+        table = self.table
+        codes = self.codes[color]
+        return [table[codes[d][cell]] for d in range(4)]
+
+    def forbidden(self, row, col):
+        """黑棋在 (row, col) 落子是否为禁手，返回禁手类型或None"""
+        if self.cells[row * BOARD_SIZE + col] != EMPTY:
+            return None
+        flags = self.flags(row, col, BLACK)
+        # 成五优先于禁手
+        if any(f & FIVE for f in flags):
+            return None
+        if any(f & OVERLINE for f in flags):
+            return 'overline'
+        if sum((f >> FOUR_SHIFT) & 3 for f in flags) >= 2:
+            return 'double_four'
+        if sum(1 for f in flags if f & THREE_EXACT) >= 2:
+            return 'double_three'
+        return None
+
+    def forbidden_points(self):
+        """当前局面下黑棋的所有禁手点"""
+        points = []
+        for cell in range(BOARD_SIZE * BOARD_SIZE):
+            if self.cells[cell] == EMPTY:
+                row, col = divmod(cell, BOARD_SIZE)
+                if self.forbidden(row, col):
+                    points.append([row, col])
+        return points
+
+    def update_forbidden(self, row, col, points):
+        """在 (row, col) 落子或撤销之后原地更新禁手点集合 points（格子编号）
+
+        一个点是否禁手只取决于它四个方向的线编码，落子只改变四条线上两侧各5个点的线编码，
+        所以只需重新检查这至多40个点和落子点本身，不必扫描全盘。
+        """
+        cell = row * BOARD_SIZE + col
+        if self.forbidden(row, col):
+            points.add(cell)
+        else:
+            points.discard(cell)
+        for d in range(4):
+            for n, _ in AFFECTED[d][cell]:
+                if self.forbidden(*divmod(n, BOARD_SIZE)):
+                    points.add(n)
+                else:
+                    points.discard(n)
+
+    @classmethod
+    def from_board(cls, board):
+        """从服务器的二维棋盘（'black'/'white'/None）构造"""
+        pattern_board = cls()
+        for row in range(BOARD_SIZE):
+            for col in range(BOARD_SIZE):
+                if board[row][col]:
+                    pattern_board.place(row, col, COLORS[board[row][col]])
+        return pattern_board
+
+
+def benchmark(rounds=2000, seed=0):
+    """测量建表、增量更新和禁手判断的耗时"""
+    import random
+    import time
+
+    global _table
+    _table = None
+    start = time.perf_counter()
+    get_table()
+    build_time = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    board = PatternBoard()
+    cells = rng.sample(range(BOARD_SIZE * BOARD_SIZE), 60)
+    place_time = check_time = scan_time = update_time = 0.0
+    checks = 0
+    points = set()
+    for _ in range(rounds // 60 + 1):
+        for ply, cell in enumerate(cells):
+            row, col = divmod(cell, BOARD_SIZE)
+            start = time.perf_counter()
+            board.place(row, col, BLACK if ply % 2 == 0 else WHITE)
+            place_time += time.perf_counter() - start
+            target = rng.randrange(BOARD_SIZE * BOARD_SIZE)
+            start = time.perf_counter()
+            board.forbidden(*divmod(target, BOARD_SIZE))
+            check_time += time.perf_counter() - start
+            start = time.perf_counter()
+            board.update_forbidden(row, col, points)
+            update_time += time.perf_counter() - start
+            checks += 1
+        start = time.perf_counter()
+        full = board.forbidden_points()
+        scan_time += time.perf_counter() - start
+        assert sorted(points) == [row * BOARD_SIZE + col for row, col in full]
+        for cell in cells:
+            board.remove(*divmod(cell, BOARD_SIZE))
+            board.update_forbidden(*divmod(cell, BOARD_SIZE), points)
+        assert not points
+
+    passes = rounds // 60 + 1
+    print(f"建表: {build_time * 1000:.1f} ms（{TABLE_SIZE} 个线编码）")
+    print(f"落子增量更新: {place_time * 1e6 / checks:.2f} 微秒/手")
+    print(f"单点禁手判断: {check_time * 1e6 / checks:.2f} 微秒")
+    print(f"落子后增量更新禁手点: {update_time * 1000 / checks:.3f} ms/手，全盘禁手扫描: {scan_time * 1000 / passes:.3f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,247 @@
+import os
+import json
+import random
+import time
+
+from record import read_records, format_time
+
+# 棋谱回放
+#
+# 对局列表是惰性的：目录只在需要更多条目时继续扫描，JSONL日志只在列表显示到它时读第一行
+# （game_start），选中后才读取整个文件；.gkr 棋谱文件同样逐局流式读取。
+# 载入一局时每隔 KEYFRAME_INTERVAL 手保存一份棋盘快照（关键帧），跳到任意一手时
+# 从最近的关键帧复制棋盘，只补上之后不到 KEYFRAME_INTERVAL 手，长对局里拖动进度条也不需要从头摆棋。
+
+BOARD_SIZE = 15
+KEYFRAME_INTERVAL = 16  # 关键帧间隔（手数）
+EMPTY, BLACK, WHITE = 0, 1, 2
+COLOR_CODES = {'black': BLACK, 'white': WHITE}
+COLOR_NAMES = [None, 'black', 'white']
+
+
+class LogEntry:
+    """目录中的一个JSONL日志，标题只读第一行"""
+
+    def __init__(self, path):
+        self.path = path
+        self._title = None
+
+    def title(self):
+        if self._title is None:
+            name = os.path.basename(self.path)
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    first = json.loads(f.readline())
+                players = [f"{player}({'黑' if info.get('color') == 'black' else '白'})"
+                           for player, info in first.get('players', {}).items()]
+                self._title = f"{first.get('timestamp', name)}  {' vs '.join(players)}"
+            except (OSError, ValueError, AttributeError) as e:
+                self._title = f"{name} (无法读取: {e})"
+        return self._title
+
+    def load(self):
+        """读取整个日志，返回 Replay"""
+        moves = []
+        colors = []
+        end = None
+        first = None
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                event_type = event.get('event_type')
+                if event_type == 'game_start' and first is None:
+                    first = event
+                elif event_type == 'move':
+                    row, col = event['position']
+                    moves.append(row * BOARD_SIZE + col)
+                    colors.append(COLOR_CODES.get(event.get('color'), BLACK if len(moves) % 2 else WHITE))
+                elif event_type == 'game_end':
+                    end = event
+        if first is None:
+            raise ValueError("日志中没有 game_start")
+        return Replay(moves, colors, title=self.title(), result=_result_text(end))
+
+
+class RecordEntry:
+    """棋谱文件中的一局，GameRecord 在第一次访问时才解码"""
+
+    def __init__(self, record):
+        self.record = record
+
+    def title(self):
+        players = [f"{name}({'黑' if color == 'black' else '白'})" for name, color in self.record['players']]
+        return f"{format_time(self.record['start'])}  {' vs '.join(players)}"
+
+    def load(self):
+        moves = list(self.record['moves'])
+        colors = [BLACK if ply % 2 == 0 else WHITE for ply in range(len(moves))]
+        end = None
+        for ply, event_type, extra in self.record['events']:
+            if event_type == 'game_end':
+                end = {'winner': extra[0], 'winner_color': extra[1], 'reason': extra[2]}
+        return Replay(moves, colors, title=self.title(), result=_result_text(end))
+
+
+def _result_text(end):
+    if not end:
+        return "未分胜负"
+    text = "黑方胜" if end.get('winner_color') == 'black' else "白方胜"
+    if end.get('winner'):
+        text += f" ({end['winner']})"
+    if end.get('reason') == 'timeout':
+        text += "，对方超时"
+    return text
+
+
+def _scan(sources):
+    """按顺序逐条生成对局条目：目录中的 .json/.gkr 文件，或直接给出的 .gkr 文件"""
+    for source in sources:
+        if os.path.isdir(source):
+            # 只取文件名排序，不打开任何文件
+            names = sorted(entry.name for entry in os.scandir(source) if entry.is_file())
+            paths = [os.path.join(source, name) for name in names]
+        else:
+            paths = [source]
+        for path in paths:
+            if path.endswith('.json'):
+                yield LogEntry(path)
+            elif path.endswith('.gkr'):
+                try:
+                    for record in read_records(path):
+                        yield RecordEntry(record)
+                except (OSError, ValueError) as e:
+                    print(f"读取棋谱 {path} 失败: {e}")
+
+
+class GameList:
+    """惰性的对局列表，只在访问到的位置之前生成条目"""
+
+    def __init__(self, sources=('game_logs',)):
+        self.entries = []
+        self._source = _scan([s for s in sources if os.path.exists(s)])
+        self.complete = False
+
+    def fill(self, count):
+        """确保至少生成 count 个条目（或列表已经结束）"""
+        while not self.complete and len(self.entries) < count:
+            try:
+                self.entries.append(next(self._source))
+            except StopIteration:
+                self.complete = True
+
+    def page(self, start, size):
+        """返回 [start, start + size) 的条目，多取一个用于判断是否还有下一页"""
+        self.fill(start + size + 1)
+        return self.entries[start:start + size]
+
+    def has_more(self, end):
+        self.fill(end + 1)
+        return len(self.entries) > end
+
+
+class Replay:
+    """一局棋的回放，用关键帧实现任意跳转"""
+
+    def __init__(self, moves, colors, title='', result='', interval=KEYFRAME_INTERVAL):
+        self.moves = moves  # 每手的格子编号 row * 15 + col
+        self.colors = colors  # 每手的颜色 BLACK/WHITE
+        self.title = title
+        self.result = result
+        self.interval = interval
+        # keyframes[k] 为前 k * interval 手之后的棋盘
+        self.keyframes = []
+        board = bytearray(BOARD_SIZE * BOARD_SIZE)
+        for ply, cell in enumerate(moves):
+            if ply % interval == 0:
+                self.keyframes.append(bytes(board))
+            board[cell] = colors[ply]
+        if len(moves) % interval == 0:
+            self.keyframes.append(bytes(board))
+
+    def __len__(self):
+        return len(self.moves)
+
+    def cells_at(self, ply):
+        """前 ply 手之后的棋盘，长度225的 bytearray"""
+        ply = max(0, min(ply, len(self.moves)))
+        key = ply // self.interval
+        board = bytearray(self.keyframes[key])
+        moves = self.moves
+        colors = self.colors
+        for index in range(key * self.interval, ply):
+            board[moves[index]] = colors[index]
+        return board
+
+    def board_at(self, ply):
+        """前 ply 手之后的二维棋盘，格式与客户端的 board 相同"""
+        cells = self.cells_at(ply)
+        return [[COLOR_NAMES[value] for value in cells[row * BOARD_SIZE:(row + 1) * BOARD_SIZE]]
+                for row in range(BOARD_SIZE)]
+
+    def last_move(self, ply):
+        """第 ply 手的 (row, col)，ply 为0时返回None"""
+        if 0 < ply <= len(self.moves):
+            return divmod(self.moves[ply - 1], BOARD_SIZE)
+        return None
+
+
+def benchmark(moves_per_game=225, seeks=20000, seed=0):
+    """比较关键帧跳转与从头摆棋的耗时"""
+    rng = random.Random(seed)
+    moves = rng.sample(range(BOARD_SIZE * BOARD_SIZE), moves_per_game)
+    colors = [BLACK if ply % 2 == 0 else WHITE for ply in range(moves_per_game)]
+    targets = [rng.randint(0, moves_per_game) for _ in range(seeks)]
+
+    start = time.perf_counter()
+    replay = Replay(moves, colors)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ply in targets:
+        replay.cells_at(ply)
+    keyframe_time = (time.perf_counter() - start) / seeks
+
+    scratch = Replay(moves, colors, interval=moves_per_game + 1)
+    start = time.perf_counter()
+    for ply in targets:
+        scratch.cells_at(ply)
+    scratch_time = (time.perf_counter() - start) / seeks
+
+    for ply in targets[:200]:
+        assert replay.cells_at(ply) == scratch.cells_at(ply)
+
+    print(f"{moves_per_game} 手的对局，建立 {len(replay.keyframes)} 个关键帧用时 {build_time * 1000:.3f} ms")
+    print(f"关键帧跳转: {keyframe_time * 1e6:.1f} us/次")
+    print(f"从头摆棋: {scratch_time * 1e6:.1f} us/次（{scratch_time / keyframe_time:.1f} 倍）")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='棋谱回放（命令行查看或测试跳转速度）')
+    parser.add_argument('sources', nargs='*', default=['game_logs'], help='日志目录或 .gkr 棋谱文件')
+    parser.add_argument('--game', type=int, default=None, help='显示第几局（从0开始），不指定时列出对局')
+    parser.add_argument('--ply', type=int, default=None, help='显示第几手之后的局面，默认为终局')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+    elif args.game is None:
+        games = GameList(args.sources)
+        games.fill(float('inf'))
+        for index, entry in enumerate(games.entries):
+            print(f"{index:4d}  {entry.title()}")
+    else:
+        games = GameList(args.sources)
+        entries = games.page(args.game, 1)
+        if not entries:
+            print(f"没有第 {args.game} 局")
+        else:
+            replay = entries[0].load()
+            ply = len(replay) if args.ply is None else args.ply
+            print(f"{replay.title}  {replay.result}  第 {min(max(ply, 0), len(replay))}/{len(replay)} 手")
+            for row in replay.board_at(ply):
+                print(' '.join({'black': 'X', 'white': 'O'}.get(cell, '.') for cell in row))
@@ -0,0 +1,221 @@
+import os
+import json
+import random
+import time
+import multiprocessing
+
+from server import check_win
+from renju import PatternBoard, BOARD_SIZE, COLORS
+from engine import Engine, WEIGHTS
+from evaluation import LearnedEngine
+from record import game_to_events, RecordWriter
+
+# 自我对弈
+#
+# 每个工作进程独立下完一批对局，按服务器的规则判断：黑棋先行、轮流落子、
+# 用 server.check_win 判断胜负，连珠规则下用 PatternBoard 判断黑棋禁手。
+# 工作进程把每局的落子和结果传回主进程，主进程按到达顺序写出
+# 服务器日志格式（每局一个JSONL文件）或紧凑棋谱文件。
+
+BATCH_SIZE = 20  # 每个任务包含的对局数
+DEFAULT_POLICY = 'engine:noise=0.2'  # 不加扰动时同样的两个引擎每局都下出同一盘棋
+
+
+class RandomPolicy:
+    """在已有棋子附近随机落子"""
+    name = 'random'
+
+    def __init__(self, rule='standard', seed=None):
+        self.rule = rule
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        self.random = random.Random(seed)
+        self.board = PatternBoard()
+        self.empty = set(range(BOARD_SIZE * BOARD_SIZE))
+        self.near = set()
+
+    def place(self, row, col, color):
+        cell = row * BOARD_SIZE + col
+        self.board.place(row, col, COLORS[color])
+        self.empty.discard(cell)
+        self.near.discard(cell)
+        for r in range(max(row - 1, 0), min(row + 2, BOARD_SIZE)):
+            for c in range(max(col - 1, 0), min(col + 2, BOARD_SIZE)):
+                if r * BOARD_SIZE + c in self.empty:
+                    self.near.add(r * BOARD_SIZE + c)
+
+    def choose(self, color):
+        cells = sorted(self.near or self.empty)
+        self.random.shuffle(cells)
+        for cell in cells:
+            row, col = divmod(cell, BOARD_SIZE)
+            if self.rule != 'renju' or color != 'black' or not self.board.forbidden(row, col):
+                return row, col
+        # 附近都是禁手时在整个棋盘上找
+        for cell in sorted(self.empty):
+            row, col = divmod(cell, BOARD_SIZE)
+            if not self.board.forbidden(row, col):
+                return row, col
+        return None
+
+
+POLICIES = {'random': RandomPolicy, 'engine': Engine, 'learned': LearnedEngine}
+# 各策略在描述中可以设置的参数及其类型，engine 另外可以调整各项棋型分
+POLICY_OPTIONS = {
+    'random': {'seed': int},
+    'engine': dict({'noise': float, 'defense': float, 'seed': int, 'vcf': int}, **{key: float for key in WEIGHTS}),
+    'learned': {'noise': float, 'seed': int, 'vcf': int},
+}
+
+
+def parse_policy(spec):
+    """解析策略描述，如 'random'、'engine'、'engine:noise=0.2,defense=1.2'，返回 (策略名, 参数字典)
+
+    未知的策略、参数或无法转换的值抛出 ValueError，不会被默默忽略。
+    """
+    name, _, options = spec.partition(':')
+    if name not in POLICIES:
+        raise ValueError(f"未知的策略: {name}")
+    known = POLICY_OPTIONS[name]
+    params = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        key = key.strip()
+        if key not in known:
+            raise ValueError(f"策略 {name} 没有参数 {key}，可用的参数: {', '.join(known)}")
+        try:
+            params[key] = known[key](value)
+        except ValueError:
+            raise ValueError(f"策略 {name} 的参数 {key} 取值无效: {value!r}") from None
+    return name, params
+
+
+def make_policy(spec, rule='standard'):
+    """根据描述创建策略，描述的格式见 parse_policy"""
+    name, params = parse_policy(spec)
+    return POLICIES[name](rule=rule, **params)
+
+
+def play_game(black, white, rule='standard', seed=None, opening=()):
+    """下一局，返回 (落子列表, 胜方颜色)，下满棋盘为和棋，胜方为None
+
+    opening 为开局的若干手 [(row, col), ...]，先按顺序摆上，之后由双方的策略落子。
+    """
+    policies = {'black': black, 'white': white}
+    for index, policy in enumerate((black, white)):
+        policy.reset(None if seed is None else seed * 2 + index)
+    board = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    referee = PatternBoard() if rule == 'renju' else None
+    moves = []
+    color = 'black'
+    while len(moves) < BOARD_SIZE * BOARD_SIZE:
+        move = opening[len(moves)] if len(moves) < len(opening) else policies[color].choose(color)
+        if move is None:
+            break
+        row, col = move
+        if not (0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE) or board[row][col] is not None:
+            raise ValueError(f"{policies[color].name} 给出了无效的落子 ({row},{col})")
+        if referee and color == 'black' and referee.forbidden(row, col):
+            raise ValueError(f"{policies[color].name} 下了禁手 ({row},{col})")
+        board[row][col] = color
+        moves.append((row, col))
+        if referee:
+            referee.place(row, col, COLORS[color])
+        for policy in (black, white):
+            policy.place(row, col, color)
+        if check_win(board, row, col):
+            return moves, color
+        color = 'white' if color == 'black' else 'black'
+    return moves, None
+
+
+def play_batch(task):
+    """工作进程：下一批对局，返回 (胜方颜色, 对局字典) 列表，对局字典格式同 record 模块"""
+    black_spec, white_spec, rule, seed, first, count = task
+    black = make_policy(black_spec, rule)
+    white = make_policy(white_spec, rule)
+    names = {'black': f"{black_spec}#black", 'white': f"{white_spec}#white"}
+    start = int(time.time())
+    games = []
+    for index in range(first, first + count):
+        moves, winner = play_game(black, white, rule, seed * 1000003 + index)
+        events = []
+        if winner:
+            events.append((len(moves), 'game_end', (names[winner], winner, None)))
+        games.append((winner, {
+            'game_id': f"selfplay_{seed}_{index:08d}",
+            'start': start,
+            'players': [(names['black'], 'black'), (names['white'], 'white')],
+            'moves': bytes(row * BOARD_SIZE + col for row, col in moves),
+            'events': events
+        }))
+    return games
+
+
+def run(games, black_spec=DEFAULT_POLICY, white_spec=DEFAULT_POLICY, rule='standard', workers=None, seed=0,
+        output=None, output_format='jsonl', batch_size=BATCH_SIZE):
+    """并行自我对弈，返回 (对局数, 耗时秒数, 胜负统计)"""
+    workers = workers or os.cpu_count() or 1
+    tasks = [(black_spec, white_spec, rule, seed, first, min(batch_size, games - first))
+             for first in range(0, games, batch_size)]
+    results = {'black': 0, 'white': 0, None: 0}
+    writer = None
+    if output and output_format == 'record':
+        writer = RecordWriter(output)
+    elif output and not os.path.exists(output):
+        os.makedirs(output)
+
+    start = time.perf_counter()
+    done = 0
+    with multiprocessing.Pool(workers) as pool:
+        for games in pool.imap_unordered(play_batch, tasks):
+            for winner, game in games:
+                if writer:
+                    writer.write(game)
+                elif output:
+                    path = os.path.join(output, f"game_{game['game_id']}.json")
+                    with open(path, 'w', encoding='utf-8') as f:
+                        for event in game_to_events(game):
+                            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                results[winner] += 1
+                done += 1
+    elapsed = time.perf_counter() - start
+    if writer:
+        writer.close()
+    return done, elapsed, results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='自我对弈生成对局数据')
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--black', default=DEFAULT_POLICY, help="黑方策略，如 random、engine、engine:noise=0.2、learned")
+    parser.add_argument('--white', default=DEFAULT_POLICY)
+    parser.add_argument('--rule', choices=['standard', 'renju'], default='standard')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认为CPU核数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='输出目录（jsonl）或文件（record），不指定时只统计')
+    parser.add_argument('--format', choices=['jsonl', 'record'], default='jsonl')
+    parser.add_argument('--scaling', action='store_true', help='分别用1到工作进程数个进程运行，测量扩展性')
+    args = parser.parse_args()
+    for spec in (args.black, args.white):
+        try:
+            parse_policy(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.scaling:
+        max_workers = args.workers or os.cpu_count() or 1
+        counts = sorted({1, *(2 ** i for i in range(max_workers.bit_length())), max_workers})
+        baseline = None
+        for workers in (n for n in counts if n <= max_workers):
+            done, elapsed, _ = run(args.games, args.black, args.white, args.rule, workers, args.seed)
+            rate = done / elapsed
+            baseline = baseline or rate
+            print(f"{workers} 个进程: {rate:.1f} 局/秒，加速 {rate / baseline:.2f} 倍")
+    else:
+        done, elapsed, results = run(args.games, args.black, args.white, args.rule, args.workers, args.seed,
+                                     args.output, args.format)
+        print(f"{done} 局，用时 {elapsed:.2f} 秒，{done / elapsed:.1f} 局/秒")
+        print(f"黑胜 {results['black']}，白胜 {results['white']}，和棋 {results[None]}")
@@ -4,15 +4,90 @@ import threading
 import datetime
 import os
 import hashlib
+import time
+import struct
+import itertools
+
+from renju import PatternBoard, COLORS, FORBIDDEN_NAMES
+from protocol import MessageReader, encode_message, encode_placed
+from session import Session
+from timer_wheel import get_wheel
+
+HEARTBEAT_INTERVAL = 15  # 服务器发送心跳的间隔（秒）
+HEARTBEAT_TIMEOUT = 45  # 超过该时间没有收到任何消息（包括心跳回复）视为断线
+STAGE_TIMEOUTS = {  # 各阶段客户端没有任何操作时的超时时间（秒）
+    'authentication': 30,
+    'color_selection': 300,
+    'waiting_ready': 300,
+}
+MAX_CLIENT_MESSAGE = 4096  # 客户端单条消息的最大字节数，超过时断开连接
+RESUME_TIMEOUT = 300  # 从检查点恢复的对局等待原玩家重新连接的最长时间（秒），超时后对局作废
+SEND_TIMEOUT = 5  # 向客户端发送数据最多阻塞的时间（秒），对端不读数据时超时断开
+
+
+def check_win(board, row, col):
+    """board[row][col] 上的棋子在任一方向上是否连成五个或以上"""
+    directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
+    current_player = board[row][col]
+    
+    for dx, dy in directions:
+        count = 1
+        # 正向检查
+        for i in range(1, 5):
+            new_row, new_col = row + i * dx, col + i * dy
+            if not (0 <= new_row < 15 and 0 <= new_col < 15):
+                break
+            if board[new_row][new_col] != current_player:
+                break
+            count += 1
+        # 反向检查
+        for i in range(1, 5):
+            new_row, new_col = row - i * dx, col - i * dy
+            if not (0 <= new_row < 15 and 0 <= new_col < 15):
+                break
+            if board[new_row][new_col] != current_player:
+                break
+            count += 1
+        if count >= 5:
+            return True
+    return False
+
+
+_game_counter = itertools.count(1)
+
+
+def new_game_id():
+    """新对局的编号：秒级时间戳在前（按文件名排序即为时间顺序），再加微秒、进程号和进程内序号，
+    同一进程中的多个房间、多个工作进程在同一秒开始的对局也不会写入同一个日志文件"""
+    now = datetime.datetime.now()
+    return f"{now:%Y%m%d%H%M%S}_{now.microsecond:06d}_{os.getpid()}_{next(_game_counter)}"
+
+
+def set_send_timeout(client_socket, seconds=SEND_TIMEOUT):
+    """限制阻塞的 send 最多等待 seconds 秒，超时抛出 OSError；不影响 recv"""
+    if os.name == 'nt':
+        value = struct.pack('I', int(seconds * 1000))
+    else:
+        value = struct.pack('ll', int(seconds), int(seconds % 1 * 1000000))
+    try:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
+    except OSError as e:
+        print(f"设置发送超时失败: {e}")
+
 
 class GomokuServer:
-    def __init__(self, host='0.0.0.0', port=5000, password='admin123'):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((host, port))
-        self.server.listen(2)
-        self.clients = []
-        self.client_info = {}  # 存储客户端信息，包括颜色选择、用户名等
-        self.ready_clients = set()
+    def __init__(self, host='0.0.0.0', port=5000, password='admin123', room_id='default', listen=True,
+                 log_dir='game_logs', rule='standard', move_time=0, rate_limit=True, analysis=None):
+        # listen=False 时只作为房间使用，由外部（如多进程工作进程）负责接受连接
+        self.server = None
+        if listen:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.bind((host, port))
+            self.server.listen(2)
+        self.room_id = room_id  # 房间编号
+        self.sessions = {}  # 连接 -> Session，按加入顺序，是房间中连接和玩家的唯一登记表
+        # 处理消息的连接线程、读秒到期的定时器线程和写检查点的线程都会访问对局状态，修改和读取时持有该锁
+        self.lock = threading.RLock()
         self.color_selection = {}  # 存储玩家颜色选择
         self.server_password = password  # 服务器密码
         self.game_state = {
@@ -21,20 +96,37 @@ class GomokuServer:
             'game_over': False,
             'winner': None,
             'game_started': False,
-            'ready_players': 0,
-            'players': {},  # 存储玩家信息
             'stage': 'waiting_join',  # 游戏阶段: waiting_join, color_selection, waiting_ready, playing, game_over
-            'restart_votes': 0  # 重新开始的投票数
+            'rule': rule,  # 规则: standard（无禁手）或 renju（黑棋有禁手）
+            'forbidden': [],  # 连珠规则下黑棋当前的禁手点
+            'move_time': move_time  # 每手限时（秒），0 表示不限时
         }
+        self.rule = rule
+        self.rate_limit = rate_limit  # 是否按连接和消息类型限流
+        self.analysis = analysis  # 局面分析服务（AnalysisService），可由多个房间共用，None 表示不提供分析
+        self.pattern_board = None  # 连珠规则下增量维护的棋型棋盘
+        self.forbidden_cells = set()  # 连珠规则下黑棋的禁手点（格子编号），与 game_state['forbidden'] 一致
+        self.reset_patterns()
+        
+        # 心跳、空闲超时和读秒共用进程内的一个时间轮，回调中会发送数据，都交给时间轮的线程池执行
+        self.wheel = get_wheel()
+        self.move_time = move_time
+        self.move_clock = None  # 当前一手的读秒定时器
         
         # 确保日志目录存在
-        self.log_dir = "game_logs"
+        self.log_dir = log_dir
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
             
         self.current_game_id = None
-        print(f"服务器启动在 {host}:{port}")
-        print(f"使用密码: {password}")
+        self.moves = []  # 当前对局的落子顺序 [(row, col), ...]
+        self.log_offset = 0  # 当前对局日志文件已写入的字节数
+        self.resume_players = {}  # 从检查点恢复、等待重新连接的玩家 {用户名: 颜色}
+        self.resume_clock = None  # 等待原玩家重新连接的定时器
+        self.on_event = None  # 写入日志事件后的回调（如匹配大厅用来更新积分）
+        if listen:
+            print(f"服务器启动在 {host}:{port}")
+            print(f"使用密码: {password}")
 
     def log_game_event(self, event_type, data=None):
         """记录游戏事件到日志文件"""
@@ -57,263 +149,385 @@ class GomokuServer:
         try:
             with open(log_file, "a", encoding="utf-8") as f:
                 f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+                self.log_offset = f.tell()
         except Exception as e:
             print(f"写入日志失败: {e}")
+        
+        if self.on_event:
+            self.on_event(log_entry)
 
     def verify_password(self, password):
         """验证密码是否正确"""
         return password == self.server_password
 
-    def handle_client(self, client_socket, addr):
-        # 初始化客户端信息
-        self.client_info[client_socket] = {
-            'addr': addr,
-            'username': None,
-            'color': None,
-            'ready': False,
-            'authenticated': False  # 新增认证标志
-        }
+    @property
+    def clients(self):
+        """房间中的所有连接，按加入顺序"""
+        return list(self.sessions)
+
+    def players(self):
+        """已通过身份验证的玩家 {用户名: {'color', 'ready'}}，由会话表生成"""
+        return {session.username: {'color': session.color, 'ready': session.ready}
+                for session in self.sessions.values() if session.username}
+
+    def state(self):
+        """发给客户端的游戏状态：game_state 加上由会话表统计的玩家、准备人数和重开票数"""
+        state = dict(self.game_state)
+        state['players'] = self.players()
+        state['ready_players'] = sum(1 for session in self.sessions.values() if session.ready)
+        state['restart_votes'] = sum(1 for session in self.sessions.values() if session.voted)
+        return state
+
+    def handle_client(self, client_socket, addr, first_data=None):
+        # 会话已在 add_client 中登记
+        self.schedule_idle_check(client_socket, HEARTBEAT_INTERVAL)
         
         # 发送初始状态 - 要求进行身份验证
         initial_state = {
             'stage': 'authentication',  # 认证阶段
             'message': '请输入服务器密码和您的用户名',
-            'client_id': len(self.clients) - 1  # 客户端ID（0或1）
+            'client_id': len(self.sessions) - 1  # 客户端ID（0或1）
         }
         client_socket.send(json.dumps(initial_state).encode('utf-8'))
         
+        reader = MessageReader(MAX_CLIENT_MESSAGE)
         while True:
             try:
-                data = client_socket.recv(1024).decode('utf-8')
+                # 由工作进程转交的连接会带上已经读取的第一条消息
+                if first_data:
+                    data, first_data = first_data, None
+                else:
+                    data = client_socket.recv(1024)
                 if not data:
                     break
                 
-                message = json.loads(data)
-                
-                # 处理身份验证
-                if message.get('type') == 'authentication':
-                    password = message.get('password', '')
-                    username = message.get('username', f"玩家{len(self.clients)}")
+                for message in reader.feed(data):
+                    with self.lock:
+                        if self.allow_message(client_socket, message):
+                            self.handle_message(client_socket, message)
                     
-                    if self.verify_password(password):
-                        self.client_info[client_socket]['authenticated'] = True
-                        self.client_info[client_socket]['username'] = username
-                        self.game_state['players'][username] = {'color': None, 'ready': False}
-                        print(f"玩家 {username} 已验证身份并连接")
-                        
-                        # 发送认证成功消息
-                        auth_success = {
-                            'stage': 'waiting_join',
-                            'auth_success': True,
-                            'message': '身份验证成功'
-                        }
-                        auth_success.update(self.game_state)
-                        client_socket.send(json.dumps(auth_success).encode('utf-8'))
-                        
-                        # 更新游戏状态
-                        if len(self.clients) == 2 and all(info['authenticated'] for info in self.client_info.values()):
-                            self.game_state['stage'] = 'color_selection'
-                            self.broadcast(json.dumps(self.game_state))
-                    else:
-                        # 认证失败，通知客户端
-                        auth_failed = {
-                            'stage': 'authentication',
-                            'auth_success': False,
-                            'message': '密码错误，请重试'
-                        }
-                        client_socket.send(json.dumps(auth_failed).encode('utf-8'))
-                        continue
+            except Exception as e:
+                print(f"处理客户端消息出错: {e}")
+                break
+        
+        # 客户端断开连接的处理
+        with self.lock:
+            session = self.remove_session(client_socket)
+            username = session.username if session else "未知"
+            print(f"客户端 {username}({addr}) 断开连接")
+            client_socket.close()
+            
+            # 更新游戏状态
+            if self.game_state['stage'] == 'playing':
+                # 如果游戏正在进行，记录对方断开连接
+                self.log_game_event("player_disconnect", {
+                    "player": username
+                })
+                self.game_state['stage'] = 'waiting_join'
+                self.game_state['game_started'] = False
+            
+            # 重置游戏状态（从检查点恢复的对局会一直保留到原玩家回来）
+            if len(self.sessions) < 2 and not self.resume_players:
+                self.reset_game_state()
+                self.game_state['stage'] = 'waiting_join'
+            
+            # 广播更新后的游戏状态
+            self.broadcast_state()
+
+    def allow_message(self, client_socket, message):
+        """按连接和消息类型限流，连接持续刷消息时抛出ValueError由 handle_client 断开"""
+        limiter = self.sessions[client_socket].limiter
+        if limiter is None or limiter.allow(message.get('type')):
+            return True
+        # 被丢弃的落子也要通知客户端，撤销预先显示的棋子
+        if message.get('type') == 'move':
+            self.reject_move(client_socket, message.get('row'), message.get('col'), 'rate_limited', "操作过于频繁")
+        return False
+
+    def handle_message(self, client_socket, message):
+        """处理客户端发来的一条消息"""
+        session = self.sessions[client_socket]
+        session.last_seen = time.monotonic()
+        
+        # 心跳消息只用于确认连接存活
+        if message.get('type') == 'ping':
+            self.send_message(client_socket, {'type': 'pong'})
+            return
+        if message.get('type') == 'pong':
+            return
+        session.last_action = session.last_seen
+        
+        # 处理身份验证
+        if message.get('type') == 'authentication':
+            password = message.get('password', '')
+            username = message.get('username', f"玩家{len(self.sessions)}")
+            
+            if self.verify_password(password):
+                session.authenticated = True
+                session.username = username
+                print(f"玩家 {username} 已验证身份并连接")
+                
+                # 从检查点恢复的对局，原玩家重新连接后沿用原来的颜色
+                if username in self.resume_players:
+                    session.color = self.resume_players[username]
+                    session.ready = True
                 
-                # 以下消息都需要已通过身份验证
-                if not self.client_info[client_socket]['authenticated']:
-                    auth_required = {
-                        'stage': 'authentication',
-                        'auth_success': False,
-                        'message': '请先进行身份验证'
-                    }
-                    client_socket.send(json.dumps(auth_required).encode('utf-8'))
-                    continue
+                # 发送认证成功消息
+                auth_success = {
+                    'stage': 'waiting_join',
+                    'auth_success': True,
+                    'message': '身份验证成功'
+                }
+                auth_success.update(self.state())
+                # 客户端请求二进制协议时在回复中确认，之后的状态和落子都用二进制帧发送
+                if message.get('protocol') == 'binary':
+                    session.binary = True
+                    auth_success['protocol'] = 'binary'
+                self.send_message(client_socket, auth_success)
                 
-                # 处理设置用户名 - 现在用户名在认证时已提供
-                if message.get('type') == 'set_username':
-                    # 更新游戏状态
-                    if len(self.clients) == 2 and all(info['authenticated'] for info in self.client_info.values()):
+                # 更新游戏状态
+                if len(self.sessions) == 2 and all(s.authenticated for s in self.sessions.values()):
+                    if self.resume_players:
+                        connected = {s.username for s in self.sessions.values()}
+                        if connected == set(self.resume_players):
+                            self.resume_game()
+                    else:
                         self.game_state['stage'] = 'color_selection'
-                        self.broadcast(json.dumps(self.game_state))
+                        self.broadcast_state()
+            else:
+                # 认证失败，通知客户端
+                auth_failed = {
+                    'stage': 'authentication',
+                    'auth_success': False,
+                    'message': '密码错误，请重试'
+                }
+                client_socket.send(json.dumps(auth_failed).encode('utf-8'))
+                return
+        
+        # 以下消息都需要已通过身份验证
+        if not session.authenticated:
+            auth_required = {
+                'stage': 'authentication',
+                'auth_success': False,
+                'message': '请先进行身份验证'
+            }
+            client_socket.send(json.dumps(auth_required).encode('utf-8'))
+            return
+        
+        # 处理设置用户名 - 现在用户名在认证时已提供
+        if message.get('type') == 'set_username':
+            # 更新游戏状态
+            if len(self.sessions) == 2 and all(s.authenticated for s in self.sessions.values()):
+                self.game_state['stage'] = 'color_selection'
+                self.broadcast_state()
+        
+        # 处理颜色选择
+        elif message.get('type') == 'select_color':
+            if self.game_state['stage'] == 'color_selection':
+                selected_color = message.get('color')
                 
-                # 处理颜色选择
-                elif message.get('type') == 'select_color':
-                    if self.game_state['stage'] == 'color_selection':
-                        selected_color = message.get('color')
-                        username = self.client_info[client_socket]['username']
+                # 检查颜色是否可用
+                if selected_color in ['black', 'white']:
+                    taken_colors = [s.color for s in self.sessions.values() if s.color]
+                    if selected_color not in taken_colors:
+                        session.color = selected_color
                         
-                        # 检查颜色是否可用
-                        if selected_color in ['black', 'white']:
-                            taken_colors = [info['color'] for info in self.client_info.values() if info['color']]
-                            if selected_color not in taken_colors:
-                                self.client_info[client_socket]['color'] = selected_color
-                                self.game_state['players'][username]['color'] = selected_color
-                                
-                                # 如果所有玩家都选择了颜色
-                                if all(info['color'] for info in self.client_info.values()):
-                                    self.game_state['stage'] = 'waiting_ready'
-                                
-                                # 如果只有一个玩家选择了颜色，给另一个玩家分配另一个颜色
-                                elif len([info for info in self.client_info.values() if info['color']]) == 1:
-                                    other_color = 'white' if selected_color == 'black' else 'black'
-                                    for c, info in self.client_info.items():
-                                        if c != client_socket and not info['color']:
-                                            info['color'] = other_color
-                                            self.game_state['players'][info['username']]['color'] = other_color
-                                    self.game_state['stage'] = 'waiting_ready'
-                                
-                                # 为每个客户端发送包含其颜色的游戏状态
-                                for client, info in self.client_info.items():
-                                    if info['authenticated'] and info['color']:
-                                        client_state = self.game_state.copy()
-                                        client_state['your_color'] = info['color']
-                                        client.send(json.dumps(client_state).encode('utf-8'))
-                                    else:
-                                        # 对于未选择颜色的客户端，发送当前状态
-                                        client.send(json.dumps(self.game_state).encode('utf-8'))
-                
-                # 处理准备状态
-                elif message.get('type') == 'ready':
-                    if self.game_state['stage'] == 'waiting_ready':
-                        if client_socket not in self.ready_clients:
-                            self.ready_clients.add(client_socket)
-                            username = self.client_info[client_socket]['username']
-                            self.client_info[client_socket]['ready'] = True
-                            self.game_state['players'][username]['ready'] = True
-                            self.game_state['ready_players'] = len(self.ready_clients)
-                            
-                            # 当两个玩家都准备好时，开始游戏
-                            if len(self.ready_clients) == 2:
-                                self.start_new_game()
-                            
-                            # 广播更新后的游戏状态
-                            self.broadcast(json.dumps(self.game_state))
-                
-                # 处理移动
-                elif message.get('type') == 'move' and self.game_state['stage'] == 'playing':
-                    row, col = message['row'], message['col']
-                    current_player = self.game_state['current_player']
-                    client_color = self.client_info[client_socket]['color']
+                        # 如果所有玩家都选择了颜色
+                        if all(s.color for s in self.sessions.values()):
+                            self.game_state['stage'] = 'waiting_ready'
+                        
+                        # 如果只有一个玩家选择了颜色，给另一个玩家分配另一个颜色
+                        elif len([s for s in self.sessions.values() if s.color]) == 1:
+                            other_color = 'white' if selected_color == 'black' else 'black'
+                            for other in self.sessions.values():
+                                if other is not session and not other.color:
+                                    other.color = other_color
+                            self.game_state['stage'] = 'waiting_ready'
+                        
+                        # 为每个客户端发送包含其颜色的游戏状态
+                        state = self.state()
+                        for client, other in list(self.sessions.items()):
+                            if other.authenticated and other.color:
+                                self.send_message(client, dict(state, your_color=other.color))
+                            else:
+                                # 对于未选择颜色的客户端，发送当前状态
+                                self.send_message(client, state)
+        
+        # 处理准备状态
+        elif message.get('type') == 'ready':
+            if self.game_state['stage'] == 'waiting_ready':
+                if not session.ready:
+                    session.ready = True
                     
-                    print(f"处理移动: 玩家 {self.client_info[client_socket]['username']} ({client_color}) "
-                          f"尝试在 ({row},{col}) 放置棋子, 当前回合: {current_player}")
+                    # 当两个玩家都准备好时，开始游戏
+                    if sum(1 for s in self.sessions.values() if s.ready) == 2:
+                        self.start_new_game()
                     
-                    # 确保只有当前回合的玩家可以下棋
-                    if client_color == current_player:
-                        # 确保位置有效且为空
-                        if (0 <= row < 15 and 0 <= col < 15 and 
-                            self.game_state['board'][row][col] is None and 
-                            not self.game_state['game_over']):
-                            
-                            print(f"有效移动: 在 ({row},{col}) 放置 {current_player} 棋子")
-                            
-                            # 更新棋盘
-                            self.game_state['board'][row][col] = current_player
-                            
-                            # 记录移动
-                            self.log_game_event("move", {
-                                "player": self.client_info[client_socket]['username'],
-                                "color": current_player,
-                                "position": [row, col]
-                            })
-                            
-                            # 检查胜利条件
-                            if self.check_win(row, col):
-                                self.game_state['game_over'] = True
-                                self.game_state['winner'] = current_player
-                                self.game_state['stage'] = 'game_over'
-                                winner_username = self.client_info[client_socket]['username']
-                                
-                                # 记录游戏结束
-                                self.log_game_event("game_end", {
-                                    "winner": winner_username,
-                                    "winner_color": current_player
-                                })
-                            else:
-                                self.game_state['current_player'] = 'white' if current_player == 'black' else 'black'
-                            
-                            # 广播更新后的游戏状态
-                            self.broadcast(json.dumps(self.game_state))
-                        else:
-                            print(f"无效移动: 位置 ({row},{col}) 已被占用或超出边界")
-                    else:
-                        print(f"越权移动: 当前回合是 {current_player}, 但 {client_color} 尝试移动")
+                    # 广播更新后的游戏状态
+                    self.broadcast_state()
+        
+        # 处理移动
+        elif message.get('type') == 'move' and self.game_state['stage'] == 'playing':
+            row, col = message.get('row'), message.get('col')
+            if type(row) is not int or type(col) is not int:
+                self.reject_move(client_socket, row, col, 'invalid', "落子位置格式错误")
+                return
+            current_player = self.game_state['current_player']
+            client_color = session.color
+            
+            print(f"处理移动: 玩家 {session.username} ({client_color}) "
+                  f"尝试在 ({row},{col}) 放置棋子, 当前回合: {current_player}")
+            
+            # 确保只有当前回合的玩家可以下棋
+            if client_color == current_player:
+                # 连珠规则下黑棋不能下禁手
+                forbidden = self.forbidden_move(row, col, current_player)
+                if forbidden:
+                    print(f"禁手: 黑棋在 ({row},{col}) 落子为 {forbidden}")
+                    self.reject_move(client_socket, row, col, 'forbidden', f"禁手（{FORBIDDEN_NAMES[forbidden]}）")
                 
-                # 处理重新开始投票
-                elif message.get('type') == 'restart_vote' and self.game_state['stage'] == 'game_over':
-                    self.game_state['restart_votes'] += 1
+                # 确保位置有效且为空
+                elif (0 <= row < 15 and 0 <= col < 15 and 
+                    self.game_state['board'][row][col] is None and 
+                    not self.game_state['game_over']):
                     
-                    # 如果所有玩家都投票重新开始
-                    if self.game_state['restart_votes'] >= len(self.clients):
-                        self.reset_game_state()
-                        self.ready_clients.clear()
-                        self.game_state['stage'] = 'color_selection'
+                    print(f"有效移动: 在 ({row},{col}) 放置 {current_player} 棋子")
+                    
+                    # 更新棋盘
+                    self.game_state['board'][row][col] = current_player
+                    self.moves.append((row, col))
+                    self.update_patterns(row, col, current_player)
+                    # 局面已变化，还没有结果的当前局面分析不再需要
+                    self.cancel_analysis()
+                    
+                    # 记录移动
+                    self.log_game_event("move", {
+                        "player": session.username,
+                        "color": current_player,
+                        "position": [row, col]
+                    })
+                    
+                    # 检查胜利条件
+                    placed = None
+                    if self.check_win(row, col):
+                        self.game_state['game_over'] = True
+                        self.game_state['winner'] = current_player
+                        self.game_state['stage'] = 'game_over'
+                        winner_username = session.username
                         
-                        # 重置玩家颜色和准备状态
-                        for client in self.client_info:
-                            self.client_info[client]['ready'] = False
-                            self.client_info[client]['color'] = None  # 重置颜色
-                            username = self.client_info[client]['username']
-                            if username in self.game_state['players']:
-                                self.game_state['players'][username]['ready'] = False
-                                self.game_state['players'][username]['color'] = None  # 重置颜色
-                            
-                        # 记录游戏重新开始
-                        self.log_game_event("game_restart", {
-                            "message": "玩家投票重新开始游戏"
+                        # 记录游戏结束
+                        self.log_game_event("game_end", {
+                            "winner": winner_username,
+                            "winner_color": current_player
                         })
-                        
-                        print("玩家投票重新开始游戏，进入颜色选择阶段")
-                        
-                    # 广播更新后的游戏状态
-                    self.broadcast(json.dumps(self.game_state))
+                    else:
+                        self.game_state['current_player'] = 'white' if current_player == 'black' else 'black'
+                        self.start_move_clock()
+                        # 禁手点不变时，二进制客户端只需要知道这一手落在哪里
+                        if self.rule != 'renju':
+                            placed = (row, col, current_player)
                     
-            except Exception as e:
-                print(f"处理客户端消息出错: {e}")
-                break
+                    # 广播更新后的游戏状态
+                    self.broadcast_state(placed)
+                else:
+                    print(f"无效移动: 位置 ({row},{col}) 已被占用或超出边界")
+                    self.reject_move(client_socket, row, col, 'invalid', "该位置已有棋子或超出棋盘")
+            else:
+                print(f"越权移动: 当前回合是 {current_player}, 但 {client_color} 尝试移动")
+                self.reject_move(client_socket, row, col, 'not_your_turn', "还没有轮到你下棋")
         
-        # 客户端断开连接的处理
-        username = self.client_info[client_socket]['username'] if client_socket in self.client_info else "未知"
-        print(f"客户端 {username}({addr}) 断开连接")
+        elif message.get('type') == 'move':
+            self.reject_move(client_socket, message.get('row'), message.get('col'), 'not_playing', "对局未在进行中")
         
-        if client_socket in self.ready_clients:
-            self.ready_clients.remove(client_socket)
-        if client_socket in self.clients:
-            self.clients.remove(client_socket)
-        if client_socket in self.client_info:
-            del self.client_info[client_socket]
+        # 处理重新开始投票
+        elif message.get('type') == 'restart_vote' and self.game_state['stage'] == 'game_over':
+            # 同一个连接重复投票只计一次
+            if session.voted:
+                return
+            session.voted = True
             
-        client_socket.close()
-        
-        # 更新游戏状态
-        self.game_state['ready_players'] = len(self.ready_clients)
-        if self.game_state['stage'] == 'playing':
-            # 如果游戏正在进行，记录对方断开连接
-            self.log_game_event("player_disconnect", {
-                "player": username
-            })
-            self.game_state['stage'] = 'waiting_join'
-            self.game_state['game_started'] = False
+            # 如果所有玩家都投票重新开始
+            if all(s.voted for s in self.sessions.values()):
+                self.reset_game_state()
+                self.game_state['stage'] = 'color_selection'
+                
+                # 重置玩家颜色和准备状态
+                for other in self.sessions.values():
+                    other.ready = False
+                    other.color = None  # 重置颜色
+                    
+                # 记录游戏重新开始
+                self.log_game_event("game_restart", {
+                    "message": "玩家投票重新开始游戏"
+                })
+                
+                print("玩家投票重新开始游戏，进入颜色选择阶段")
+                
+            # 广播更新后的游戏状态
+            self.broadcast_state()
         
-        # 更新玩家列表
-        self.game_state['players'] = {
-            info['username']: {'color': info['color'], 'ready': info['ready']}
-            for client, info in self.client_info.items()
-            if info['username']
-        }
+        # 处理局面分析请求，结果由分析服务稍后单独发送
+        elif message.get('type') == 'analyze':
+            self.request_analysis(client_socket, message.get('ply'))
+
+    def request_analysis(self, client_socket, ply=None):
+        """分析本局前 ply 手之后的局面（默认为当前局面），结果到达时发给该连接"""
+        if self.analysis is None:
+            self.send_message(client_socket, {'type': 'analysis', 'error': '服务器未开启局面分析'})
+            return
+        if ply is None:
+            moves = list(self.moves)
+            owner = self  # 再下一手时取消
+        elif type(ply) is int and 0 <= ply <= len(self.moves):
+            moves = self.moves[:ply]
+            owner = (self, self.current_game_id)  # 开始新的一局时取消
+        else:
+            self.send_message(client_socket, {'type': 'analysis', 'error': '手数超出范围'})
+            return
+        game_id = self.current_game_id
         
-        # 重置游戏状态
-        if len(self.clients) < 2:
-            self.reset_game_state()
-            self.game_state['stage'] = 'waiting_join'
+        def deliver(result):
+            if client_socket not in self.sessions:
+                return
+            if result is None:
+                reply = {'type': 'analysis', 'error': '局面分析失败'}
+            else:
+                reply = dict(result, type='analysis', game_id=game_id, ply=len(moves))
+            try:
+                self.send_message(client_socket, reply)
+            except OSError:
+                pass
         
-        # 广播更新后的游戏状态
-        self.broadcast(json.dumps(self.game_state))
+        if self.analysis.submit(moves, self.rule, deliver, owner) == 'busy':
+            self.send_message(client_socket, {'type': 'analysis', 'error': '分析服务繁忙，请稍后再试'})
+
+    def cancel_analysis(self, game_id=None):
+        """取消当前局面（给出 game_id 时还包括该局指定手数）还在等待的分析请求"""
+        if self.analysis is None:
+            return
+        self.analysis.cancel(self)
+        if game_id:
+            self.analysis.cancel((self, game_id))
+
+    def close(self):
+        """房间不再使用时取消读秒和等待重连的定时器以及还在等待的分析请求"""
+        if self.move_clock:
+            self.move_clock.cancel()
+            self.move_clock = None
+        if self.resume_clock:
+            self.resume_clock.cancel()
+            self.resume_clock = None
+        self.cancel_analysis(self.current_game_id)
+
+    def reject_move(self, client_socket, row, col, reason, text):
+        """通知客户端这一手被拒绝，客户端据此撤销预先显示的棋子"""
+        self.send_message(client_socket, {
+            'type': 'move_rejected',
+            'row': row,
+            'col': col,
+            'reason': reason,
+            'message': text
+        })
 
     def start_new_game(self):
         """开始新游戏"""
@@ -323,16 +537,20 @@ class GomokuServer:
         self.game_state['board'] = [[None for _ in range(15)] for _ in range(15)]
         self.game_state['game_over'] = False
         self.game_state['winner'] = None
-        self.game_state['restart_votes'] = 0
+        self.clear_votes()
+        self.cancel_analysis(self.current_game_id)
+        self.moves = []
+        self.reset_patterns()
         
         # 生成游戏ID
-        self.current_game_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        self.current_game_id = new_game_id()
+        self.log_offset = 0
         
         # 记录游戏开始
         player_info = {}
-        for client, info in self.client_info.items():
-            player_info[info['username']] = {
-                "color": info['color']
+        for session in self.sessions.values():
+            player_info[session.username] = {
+                "color": session.color
             }
         
         self.log_game_event("game_start", {
@@ -340,6 +558,167 @@ class GomokuServer:
         })
         
         print(f"游戏 {self.current_game_id} 开始!")
+        self.start_move_clock()
+
+    def schedule_idle_check(self, client_socket, delay):
+        """在时间轮上安排下一次超时检查"""
+        session = self.sessions.get(client_socket)
+        if session is not None:
+            session.timer = self.wheel.schedule_blocking(delay, self.check_idle, client_socket)
+
+    def check_idle(self, client_socket):
+        """时间轮回调：检查连接是否超时，并按需发送心跳"""
+        session = self.sessions.get(client_socket)
+        if session is None:
+            return
+        now = time.monotonic()
+        stage = self.game_state['stage'] if session.authenticated else 'authentication'
+        if stage != session.stage:
+            session.stage = stage
+            session.stage_since = now
+        
+        deadline = session.last_seen + HEARTBEAT_TIMEOUT
+        reason = '心跳超时'
+        if stage in STAGE_TIMEOUTS:
+            stage_deadline = max(session.last_action, session.stage_since) + STAGE_TIMEOUTS[stage]
+            if stage_deadline < deadline:
+                deadline = stage_deadline
+                reason = f"{stage} 阶段长时间无操作"
+        if now >= deadline:
+            print(f"客户端 {session.username or session.addr} {reason}，断开连接")
+            try:
+                # 关闭读写后 handle_client 中的 recv 返回，走正常的断开流程
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+        
+        if now - session.last_ping >= HEARTBEAT_INTERVAL:
+            session.last_ping = now
+            try:
+                self.send_message(client_socket, {'type': 'ping'})
+            except OSError:
+                pass
+        self.schedule_idle_check(client_socket, min(session.last_ping + HEARTBEAT_INTERVAL, deadline) - now)
+
+    def start_move_clock(self):
+        """开始当前一手的读秒（不限时时什么都不做）"""
+        if self.move_clock:
+            self.move_clock.cancel()
+            self.move_clock = None
+        if self.move_time > 0 and self.game_state['stage'] == 'playing':
+            self.move_clock = self.wheel.schedule_blocking(self.move_time, self.move_timeout,
+                                                           self.current_game_id, len(self.moves))
+
+    def move_timeout(self, game_id, ply):
+        """读秒到期：这一手仍未落子则判负"""
+        with self.lock:
+            if (self.game_state['stage'] != 'playing' or self.current_game_id != game_id
+                    or len(self.moves) != ply):
+                return
+            loser = self.game_state['current_player']
+            winner = 'white' if loser == 'black' else 'black'
+            self.game_state['game_over'] = True
+            self.game_state['winner'] = winner
+            self.game_state['stage'] = 'game_over'
+            winner_username = next((session.username for session in self.sessions.values()
+                                    if session.color == winner), None)
+            self.log_game_event("game_end", {
+                "winner": winner_username,
+                "winner_color": winner,
+                "reason": "timeout"
+            })
+            print(f"{loser} 超时未落子，{winner} 获胜")
+            self.broadcast_state()
+
+    def snapshot(self):
+        """返回进行中对局的紧凑快照，没有进行中的对局时返回None"""
+        with self.lock:
+            if self.resume_players:
+                players = self.resume_players
+            elif self.game_state['stage'] == 'playing':
+                players = {session.username: session.color for session in self.sessions.values()
+                           if session.username and session.color}
+            else:
+                return None
+            
+            colors = {color: name for name, color in players.items()}
+            return {
+                'room_id': self.room_id,
+                'game_id': self.current_game_id,
+                'black': colors.get('black', ''),
+                'white': colors.get('white', ''),
+                'moves': bytes(row * 15 + col for row, col in self.moves),
+                'log_offset': self.log_offset
+            }
+
+    def restore(self, snapshot):
+        """从快照恢复对局，等待原玩家重新连接"""
+        self.reset_game_state()
+        self.current_game_id = snapshot['game_id']
+        self.log_offset = snapshot['log_offset']
+        self.moves = [divmod(cell, 15) for cell in snapshot['moves']]
+        color = 'black'
+        for row, col in self.moves:
+            self.game_state['board'][row][col] = color
+            color = 'white' if color == 'black' else 'black'
+        self.game_state['current_player'] = color
+        self.reset_patterns()
+        self.resume_players = {snapshot['black']: 'black', snapshot['white']: 'white'}
+        self.game_state['stage'] = 'waiting_join'
+        if self.resume_clock:
+            self.resume_clock.cancel()
+        self.resume_clock = self.wheel.schedule_blocking(RESUME_TIMEOUT, self.resume_timeout, self.current_game_id)
+        print(f"从检查点恢复对局 {self.current_game_id}（{len(self.moves)} 手），等待玩家重新连接")
+
+    def resume_timeout(self, game_id):
+        """恢复的对局超时仍没有等到双方玩家：记录缺席的玩家断线，对局作废，房间重新开放
+
+        resume_players 清空后快照返回None，下一次检查点就不再包含这局。
+        """
+        with self.lock:
+            if not self.resume_players or self.current_game_id != game_id:
+                return
+            self.resume_clock = None
+            connected = {session.username for session in self.sessions.values()}
+            for username in self.resume_players:
+                if username not in connected:
+                    self.log_game_event("player_disconnect", {
+                        "player": username,
+                        "reason": "resume_timeout"
+                    })
+            print(f"对局 {game_id} 等待玩家重新连接超时，已作废")
+            self.resume_players = {}
+            self.moves = []
+            self.reset_game_state()
+            for session in self.sessions.values():
+                session.color = None
+                session.ready = False
+            if len(self.sessions) == 2 and all(session.authenticated for session in self.sessions.values()):
+                self.game_state['stage'] = 'color_selection'
+            else:
+                self.game_state['stage'] = 'waiting_join'
+            self.broadcast_state()
+
+    def resume_game(self):
+        """恢复的对局双方都已回来，继续对局"""
+        self.resume_players = {}
+        if self.resume_clock:
+            self.resume_clock.cancel()
+            self.resume_clock = None
+        self.game_state['game_started'] = True
+        self.game_state['stage'] = 'playing'
+        for session in self.sessions.values():
+            session.ready = True
+        self.log_game_event("game_resume", {
+            "moves": len(self.moves)
+        })
+        print(f"对局 {self.current_game_id} 继续进行")
+        self.start_move_clock()
+        
+        state = self.state()
+        for client, session in list(self.sessions.items()):
+            self.send_message(client, dict(state, your_color=session.color))
 
     def reset_game_state(self):
         """重置游戏状态"""
@@ -347,74 +726,156 @@ class GomokuServer:
         self.game_state['game_over'] = False
         self.game_state['winner'] = None
         self.game_state['game_started'] = False
-        self.game_state['restart_votes'] = 0
+        self.clear_votes()
+        self.reset_patterns()
+
+    def clear_votes(self):
+        for session in self.sessions.values():
+            session.voted = False
+
+    def reset_patterns(self):
+        """连珠规则下根据当前棋盘重建棋型棋盘和禁手点"""
+        if self.rule != 'renju':
+            return
+        self.pattern_board = PatternBoard.from_board(self.game_state['board'])
+        self.game_state['forbidden'] = self.pattern_board.forbidden_points()
+        self.forbidden_cells = {row * 15 + col for row, col in self.game_state['forbidden']}
+
+    def update_patterns(self, row, col, color):
+        """落子后增量更新棋型棋盘和禁手点，只重新检查经过落子点的四条线上的点"""
+        if self.rule != 'renju':
+            return
+        self.pattern_board.place(row, col, COLORS[color])
+        self.pattern_board.update_forbidden(row, col, self.forbidden_cells)
+        self.game_state['forbidden'] = [list(divmod(cell, 15)) for cell in sorted(self.forbidden_cells)]
+
+    def forbidden_move(self, row, col, color):
+        """连珠规则下黑棋的禁手判断，返回禁手类型或None"""
+        if self.rule != 'renju' or color != 'black':
+            return None
+        if not (0 <= row < 15 and 0 <= col < 15):
+            return None
+        return self.pattern_board.forbidden(row, col)
     
     def check_win(self, row, col):
-        directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
-        current_player = self.game_state['board'][row][col]
-        
-        for dx, dy in directions:
-            count = 1
-            # 正向检查
-            for i in range(1, 5):
-                new_row, new_col = row + i * dx, col + i * dy
-                if not (0 <= new_row < 15 and 0 <= new_col < 15):
-                    break
-                if self.game_state['board'][new_row][new_col] != current_player:
-                    break
-                count += 1
-            # 反向检查
-            for i in range(1, 5):
-                new_row, new_col = row - i * dx, col - i * dy
-                if not (0 <= new_row < 15 and 0 <= new_col < 15):
-                    break
-                if self.game_state['board'][new_row][new_col] != current_player:
-                    break
-                count += 1
-            if count >= 5:
-                return True
-        return False
+        return check_win(self.game_state['board'], row, col)
+
+    def send_message(self, client_socket, message):
+        """按该连接协商的协议发送一条消息"""
+        session = self.sessions.get(client_socket)
+        client_socket.send(encode_message(message, session is not None and session.binary))
 
-    def broadcast(self, message):
-        for client in self.clients:
+    def broadcast_state(self, placed=None):
+        """广播游戏状态，每种协议只编码一次
+
+        placed 为刚落下的 (row, col, color) 时，二进制客户端只收到2字节的落子帧。
+        """
+        encoded = {}
+        state = None
+        for client, session in list(self.sessions.items()):
+            binary = session.binary
+            if binary not in encoded:
+                if binary and placed:
+                    encoded[binary] = encode_placed(*placed)
+                else:
+                    state = state or self.state()
+                    encoded[binary] = encode_message(state, binary)
+            self.broadcast(encoded[binary], [client])
+
+    def broadcast(self, message, clients=None):
+        for client in list(self.clients if clients is None else clients):
             try:
-                client.send(message.encode('utf-8'))
+                client.send(message if isinstance(message, bytes) else message.encode('utf-8'))
             except Exception as e:
                 print(f"广播消息给客户端出错: {e}")
-                if client in self.ready_clients:
-                    self.ready_clients.remove(client)
-                if client in self.client_info:
-                    del self.client_info[client]
-                if client in self.clients:
-                    self.clients.remove(client)
+                self.remove_session(client)
+
+    def remove_session(self, client_socket):
+        """从会话表中移除连接并取消它的超时检查，返回被移除的会话"""
+        session = self.sessions.pop(client_socket, None)
+        if session is not None and session.timer:
+            session.timer.cancel()
+        return session
+
+    def add_client(self, client_socket, addr, first_data=None):
+        """接纳一个客户端连接，房间已满时拒绝"""
+        set_send_timeout(client_socket)
+        with self.lock:
+            # 只接受两个客户端
+            full = len(self.sessions) >= 2
+            if not full:
+                self.sessions[client_socket] = Session(client_socket, addr, rate_limit=self.rate_limit)
+        if full:
+            try:
+                client_socket.send(json.dumps({"error": "服务器已满"}).encode('utf-8'))
+            except OSError:
+                pass
+            client_socket.close()
+            print(f"拒绝客户端 {addr} 连接，服务器已满")
+            return False
+        
+        thread = threading.Thread(target=self.handle_client, args=(client_socket, addr, first_data))
+        thread.daemon = True
+        thread.start()
+        return True
 
     def start(self):
         while True:
             try:
                 client_socket, addr = self.server.accept()
                 print(f"客户端 {addr} 已连接")
-                
-                # 只接受两个客户端
-                if len(self.clients) >= 2:
-                    client_socket.send(json.dumps({"error": "服务器已满"}).encode('utf-8'))
-                    client_socket.close()
-                    print(f"拒绝客户端 {addr} 连接，服务器已满")
-                    continue
-                
-                self.clients.append(client_socket)
-                thread = threading.Thread(target=self.handle_client, args=(client_socket, addr))
-                thread.daemon = True
-                thread.start()
+                self.add_client(client_socket, addr)
             except Exception as e:
                 print(f"接受客户端连接出错: {e}")
 
 if __name__ == '__main__':
-    # 从命令行或配置文件读取密码
-    import sys
-    password = "admin123"  # 默认密码
+    # 从命令行读取密码和运行模式
+    import argparse
+    parser = argparse.ArgumentParser(description='五子棋服务器')
+    parser.add_argument('password', nargs='?', default='admin123', help='服务器密码')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='工作进程数量，大于0时以多进程模式运行（SO_REUSEPORT）')
+    parser.add_argument('--registry', default='/tmp/gomoku_rooms', help='多进程模式下的房间注册表目录')
+    parser.add_argument('--rule', choices=['standard', 'renju'], default='standard',
+                        help='对局规则，renju 为黑棋有禁手的连珠规则')
+    parser.add_argument('--move-time', type=int, default=0, help='每手限时（秒），0 表示不限时')
+    parser.add_argument('--log-dir', default='game_logs', help='对局日志目录')
+    parser.add_argument('--lobby', action='store_true', help='以匹配大厅模式运行，按积分自动配对')
+    parser.add_argument('--checkpoint', default=None,
+                        help='检查点文件（多进程模式下为目录），启动时从中恢复进行中的对局')
+    parser.add_argument('--ratings', default=None,
+                        help='积分文件，对局结束时增量更新积分（匹配大厅模式默认为 ratings.json）')
+    parser.add_argument('--analysis-workers', type=int, default=1,
+                        help='局面分析进程数，0 表示不提供局面分析（多进程模式下不支持）')
+    args = parser.parse_args()
     
-    if len(sys.argv) > 1:
-        password = sys.argv[1]
+    analysis = None
+    if args.analysis_workers > 0 and args.workers == 0:
+        from analysis import AnalysisService
+        analysis = AnalysisService(args.analysis_workers)
     
-    server = GomokuServer(password=password)
-    server.start() 
\ No newline at end of file
+    if args.lobby:
+        from lobby import LobbyServer
+        LobbyServer(host=args.host, port=args.port, password=args.password, log_dir=args.log_dir, rule=args.rule,
+                    move_time=args.move_time, ratings_path=args.ratings or 'ratings.json',
+                    analysis=analysis).start()
+    elif args.workers > 0:
+        from cluster import run_supervisor
+        run_supervisor(args.host, args.port, args.password, args.workers, args.registry,
+                       checkpoint_dir=args.checkpoint, rule=args.rule, move_time=args.move_time,
+                       log_dir=args.log_dir)
+    else:
+        server = GomokuServer(host=args.host, port=args.port, password=args.password, log_dir=args.log_dir,
+                              rule=args.rule, move_time=args.move_time, analysis=analysis)
+        if args.checkpoint:
+            from checkpoint import CheckpointStore, CheckpointWriter, recover
+            store = CheckpointStore(args.checkpoint)
+            for snapshot in recover(store, server.log_dir)[:1]:
+                server.restore(snapshot)
+            CheckpointWriter(store, lambda: [server]).start()
+        if args.ratings:
+            from ratings import open_store
+            server.on_event = open_store(args.ratings, server.log_dir).consume
+        server.start()
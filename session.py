@@ -0,0 +1,155 @@
+import time
+
+from ratelimit import RateLimiter
+
+# 连接会话
+#
+# 每个连接的全部状态都在一个 Session 里，房间的 sessions 字典（连接 -> 会话）是唯一的登记表：
+# 连接列表、准备人数、重开投票数和发给客户端的玩家列表都由它现场生成，不再分别保存。
+# Session 使用 __slots__，没有实例字典，大量空闲连接时每个连接只占一百多字节的对象本身。
+
+
+class Session:
+    """一个客户端连接的状态"""
+    __slots__ = ('socket', 'addr', 'username', 'color', 'ready', 'authenticated', 'binary', 'voted',
+                 'last_seen', 'last_action', 'last_ping', 'stage', 'stage_since', 'timer', 'limiter')
+
+    def __init__(self, client_socket, addr, now=None, rate_limit=True):
+        if now is None:
+            now = time.monotonic()
+        self.socket = client_socket
+        self.addr = addr
+        self.username = None
+        self.color = None
+        self.ready = False
+        self.authenticated = False
+        self.binary = False  # 是否已协商使用二进制协议
+        self.voted = False  # 是否已投票重新开始
+        self.last_seen = now  # 最后一次收到任何消息的时间
+        self.last_action = now  # 最后一次收到非心跳消息的时间
+        self.last_ping = now  # 最后一次发送心跳的时间
+        self.stage = None  # 超时检查时看到的阶段，以及进入该阶段的时间
+        self.stage_since = now
+        self.timer = None  # 时间轮中的超时检查定时器
+        self.limiter = RateLimiter(now) if rate_limit else None  # 限流状态
+
+
+def _old_entry(client_socket, addr, now):
+    """改为 Session 之前每个连接分散保存的状态，用于对比"""
+    info = {
+        'addr': addr,
+        'username': None,
+        'color': None,
+        'ready': False,
+        'authenticated': False,
+        'binary': False,
+        'last_seen': now,
+        'last_action': now,
+        'last_ping': now,
+        'stage': None,
+        'stage_since': now,
+        'timer': None,
+        'limiter': RateLimiter(now)
+    }
+    return info, {'color': None, 'ready': False}
+
+
+def measure(count, old=False):
+    """用 tracemalloc 测量 count 个空闲连接的会话状态占用的字节数
+
+    每个连接包括：会话（或旧的 client_info 字典、clients 列表中的一项和 players 中的一项）、
+    收到过一条消息后的限流桶、消息切分器和时间轮上的一个超时检查定时器。
+    套接字本身用占位对象代替，它和处理线程的开销见 measure_threads。
+    """
+    import tracemalloc
+    from protocol import MessageReader
+    from timer_wheel import TimerWheel
+
+    wheel = TimerWheel()
+    addrs = [('10.0.%d.%d' % divmod(i % 65536, 256), 40000 + i % 20000) for i in range(count)]
+    sockets = [object() for _ in range(count)]
+    now = time.monotonic()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if old:
+        client_info, clients, players = {}, [], {}
+        readers = []
+        for i in range(count):
+            info, player = _old_entry(sockets[i], addrs[i], now)
+            info['limiter'].allow('ping', now)
+            info['timer'] = wheel.schedule(15, None, sockets[i])
+            client_info[sockets[i]] = info
+            clients.append(sockets[i])
+            players[f"player{i}"] = player
+            readers.append(MessageReader())
+        keep = (client_info, clients, players, readers)
+    else:
+        sessions = {}
+        readers = []
+        for i in range(count):
+            session = Session(sockets[i], addrs[i], now)
+            session.limiter.allow('ping', now)
+            session.timer = wheel.schedule(15, None, sockets[i])
+            sessions[sockets[i]] = session
+            readers.append(MessageReader())
+        keep = (sessions, readers)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del keep
+    return used
+
+
+def _rss():
+    """当前进程的常驻内存（字节），只支持 Linux"""
+    import os
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure_threads(count=1000):
+    """每个阻塞在 recv 上的处理线程（含一对本地套接字）增加的常驻内存"""
+    import socket
+    import threading
+
+    pairs = []
+    threads = []
+    before = _rss()
+    for _ in range(count):
+        a, b = socket.socketpair()
+        thread = threading.Thread(target=a.recv, args=(1,))
+        thread.daemon = True
+        thread.start()
+        pairs.append((a, b))
+        threads.append(thread)
+    used = _rss() - before
+    for a, b in pairs:
+        b.close()
+        a.shutdown(socket.SHUT_RDWR)
+    for thread in threads:
+        thread.join()
+    for a, b in pairs:
+        a.close()
+    return used / count
+
+
+def benchmark(counts=(10000, 100000), thread_sample=1000):
+    for count in counts:
+        new = measure(count)
+        old = measure(count, old=True)
+        print(f"{count} 个空闲连接：会话状态 {new / count:.0f} 字节/连接（共 {new / 2 ** 20:.1f} MB），"
+              f"用字典分散保存时 {old / count:.0f} 字节/连接（共 {old / 2 ** 20:.1f} MB）")
+    try:
+        per_thread = measure_threads(thread_sample)
+    except OSError as e:
+        print(f"无法测量处理线程的内存: {e}")
+        return
+    print(f"每个处理线程和套接字约 {per_thread / 1024:.1f} KB 常驻内存（{thread_sample} 个线程取平均）")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='测量空闲连接的内存占用')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--threads', type=int, default=1000, help='测量线程开销时创建的线程数')
+    args = parser.parse_args()
+    benchmark(args.counts, args.threads)
@@ -0,0 +1,456 @@
+import time
+
+from renju import (PatternBoard, BOARD_SIZE, EMPTY, BLACK, WHITE, AFFECTED, FIVE, OVERLINE,
+                   FOUR_SHIFT, FREE_FOUR_SHIFT, THREE_EXACT, THREE_FREE)
+from positions import KEYS
+
+# 连续冲四（VCF）/ 连续进攻（VCT）求解
+#
+# 判断轮到进攻方时是否有必胜：VCF 只用冲四进攻，防守方每次只能挡在成五点上；
+# VCT 还可以用活三进攻，防守方可以挡活三（试下后活三消失的点），也可以先冲四反击。
+# 搜索用深度优先的证明数搜索（df-pn）：进攻方的节点只要有一个子节点被证明即被证明（证明数取最小），
+# 防守方的节点需要所有子节点被证明（证明数求和），每次沿证明数/反证数最小的方向展开，
+# 并用阈值控制何时回溯；搜过的局面按 (Zobrist 哈希, 节点类型, 未解除的活三) 存在备忘表中，
+# 同一局面经过不同顺序到达时不再重复搜索。展开的节点数达到上限时放弃，结果为“未知”。
+# 棋型判断全部查 renju 的线型表，连珠规则下黑棋按恰好五连计算，禁手点不能落子。
+
+INF = 10 ** 9
+DEFAULT_NODES = 20000  # 默认的节点上限
+PRECHECK_NODES = 300  # 引擎落子前的快速检查用的节点上限
+MEMO_SIZE = 1 << 20  # 备忘表超过这么多项时在下一次求解前清空
+NEAR_RANGE = 2  # 只考虑已有棋子周围这个距离内的空点（成五、冲四、活三点都在这个范围内）
+COLOR_NAMES = {BLACK: 'black', WHITE: 'white'}
+COLOR_CODES = {'black': BLACK, 'white': WHITE}
+
+_near_cells = []
+for _cell in range(BOARD_SIZE * BOARD_SIZE):
+    _row, _col = divmod(_cell, BOARD_SIZE)
+    _near_cells.append([r * BOARD_SIZE + c
+                        for r in range(max(_row - NEAR_RANGE, 0), min(_row + NEAR_RANGE + 1, BOARD_SIZE))
+                        for c in range(max(_col - NEAR_RANGE, 0), min(_col + NEAR_RANGE + 1, BOARD_SIZE))])
+_line_cells = [sorted({n for d in range(4) for n, _ in AFFECTED[d][cell]}) for cell in range(BOARD_SIZE * BOARD_SIZE)]
+
+
+class Solver:
+    """VCF/VCT 求解器，备忘表在同一个求解器的多次求解之间保留"""
+
+    def __init__(self, rule='standard', max_nodes=DEFAULT_NODES):
+        self.rule = rule
+        self.max_nodes = max_nodes
+        self.memo = {}  # (哈希, 进攻方, 是否VCT, 是否进攻方节点, 未解除的活三) -> (证明数, 反证数)
+        self.board = None
+        self.near = None
+        self.hash = 0
+        self.nodes = 0
+        self.limit = max_nodes
+
+    def setup(self, cells=()):
+        """从长度225的格子列表（0 空、1 黑、2 白）建立局面，之后可以用 place/remove 增量更新"""
+        self.board = PatternBoard()
+        self.near = [0] * (BOARD_SIZE * BOARD_SIZE)
+        self.hash = 0
+        for cell, color in enumerate(cells):
+            if color:
+                self.place(cell, color)
+
+    def place(self, cell, color):
+        """color 为 1（黑）或 2（白）"""
+        self.board.place(*divmod(cell, BOARD_SIZE), color)
+        self.hash ^= KEYS[color][cell][0]
+        near = self.near
+        for n in _near_cells[cell]:
+            near[n] += 1
+
+    def remove(self, cell):
+        color = self.board.cells[cell]
+        self.board.remove(*divmod(cell, BOARD_SIZE))
+        self.hash ^= KEYS[color][cell][0]
+        near = self.near
+        for n in _near_cells[cell]:
+            near[n] -= 1
+
+    def exact(self, color):
+        return self.rule == 'renju' and color == BLACK
+
+    def legal(self, cell, color):
+        if self.board.cells[cell] != EMPTY:
+            return False
+        return not (self.exact(color) and self.board.forbidden(*divmod(cell, BOARD_SIZE)))
+
+    def scan(self, color, threes=False):
+        """color 的成五点、冲四点、（threes 为真时）活三点"""
+        board = self.board
+        table = board.table
+        cells = board.cells
+        near = self.near
+        c0, c1, c2, c3 = board.codes[color]
+        if self.exact(color):
+            five_mask, shift, three_mask = FIVE, FOUR_SHIFT, THREE_EXACT
+        else:
+            five_mask, shift, three_mask = FIVE | OVERLINE, FREE_FOUR_SHIFT, THREE_FREE
+        fives = []
+        fours = []
+        three_points = []
+        for cell in range(BOARD_SIZE * BOARD_SIZE):
+            if cells[cell] or not near[cell]:
+                continue
+            f0, f1, f2, f3 = table[c0[cell]], table[c1[cell]], table[c2[cell]], table[c3[cell]]
+            if (f0 | f1 | f2 | f3) & five_mask:
+                fives.append(cell)
+            elif (f0 >> shift) & 3 or (f1 >> shift) & 3 or (f2 >> shift) & 3 or (f3 >> shift) & 3:
+                fours.append(cell)
+            elif threes and (f0 | f1 | f2 | f3) & three_mask:
+                three_points.append(cell)
+        if self.exact(color):
+            # 禁手点既不能成四也不能成三（成五优先于禁手，fives 不用过滤）
+            fours = [cell for cell in fours if self.legal(cell, color)]
+            three_points = [cell for cell in three_points if self.legal(cell, color)]
+        return fives, fours, three_points
+
+    def three_alive(self, cell, color):
+        """cell 上 color 的棋子所在的线是否还有活三"""
+        codes = self.board.codes[color]
+        table = self.board.table
+        mask = THREE_EXACT if self.exact(color) else THREE_FREE
+        return any(table[codes[d][cell]] & mask for d in range(4))
+
+    def three_alive_in(self, cell, d):
+        """进攻方在 cell 上的棋子在方向 d 上是否有活三"""
+        mask = THREE_EXACT if self.exact(self.attacker) else THREE_FREE
+        return bool(self.board.table[self.board.codes[self.attacker][d][cell]] & mask)
+
+    def moves(self, attack_node, threat):
+        """生成子节点 [(格子, 子节点的未解除活三)]，已分出胜负时返回 True（进攻方胜）或 False（进攻方失败）"""
+        attacker, defender = self.attacker, 3 - self.attacker
+        if attack_node:
+            fives, fours, threes = self.scan(attacker, self.vct)
+            if fives:
+                return True
+            defender_fives = self.scan(defender)[0]
+            if len(defender_fives) >= 2:
+                return False
+            if defender_fives:
+                # 防守方有成五点时只能先挡住，挡的这一手本身是进攻或者原来的活三还在才能继续
+                block = defender_fives[0]
+                if not self.legal(block, attacker):
+                    return False
+                if block in fours or block in threes:
+                    return [(block, block)]
+                return [(block, threat)] if threat is not None else False
+            return [(cell, cell) for cell in fours + threes]
+
+        if self.scan(defender)[0]:
+            return False  # 防守方直接成五
+        fives = self.scan(attacker)[0]
+        if len(fives) >= 2:
+            return True
+        if fives:
+            return [(fives[0], None)] if self.legal(fives[0], defender) else True
+        # 没有冲四时只能是活三：挡住活三的点，以及防守方先冲四反击
+        if threat is None or not self.three_alive(threat, attacker):
+            return False
+        children = []
+        for cell in _line_cells[threat]:
+            if not self.legal(cell, defender):
+                continue
+            self.board.place(*divmod(cell, BOARD_SIZE), defender)
+            if not self.three_alive(threat, attacker):
+                children.append((cell, None))
+            self.board.remove(*divmod(cell, BOARD_SIZE))
+        blocks = {cell for cell, _ in children}
+        _, counter_fours, _ = self.scan(defender)
+        children.extend((cell, threat) for cell in counter_fours if cell not in blocks)
+        return children or True  # 挡不住（如三三）
+
+    def block_one(self, threat):
+        """挡住 threat 所在的一条活三的点"""
+        defender = 3 - self.attacker
+        alive = [d for d in range(4) if self.three_alive_in(threat, d)]
+        for cell in _line_cells[threat]:
+            if not self.legal(cell, defender):
+                continue
+            self.board.place(*divmod(cell, BOARD_SIZE), defender)
+            blocked = any(not self.three_alive_in(threat, d) for d in alive)
+            self.board.remove(*divmod(cell, BOARD_SIZE))
+            if blocked:
+                return cell
+        return None
+
+    def lookup(self, key):
+        return self.memo.get(key, (1, 1))
+
+    def mid(self, attack_node, threat, pn_threshold, dn_threshold):
+        """df-pn 的一次展开，结果写入备忘表"""
+        key = (self.hash, self.attacker, self.vct, attack_node, threat)
+        children = self.moves(attack_node, threat)
+        if children is True or children is False or not children:
+            self.memo[key] = (0, INF) if children is True else (INF, 0)
+            return
+        self.nodes += 1
+        color = self.attacker if attack_node else 3 - self.attacker
+        keys = [(self.hash ^ KEYS[color][cell][0], self.attacker, self.vct, not attack_node, child_threat)
+                for cell, child_threat in children]
+        while True:
+            values = [self.lookup(child) for child in keys]
+            if attack_node:
+                pn = min(value[0] for value in values)
+                dn = min(INF, sum(value[1] for value in values))
+            else:
+                pn = min(INF, sum(value[0] for value in values))
+                dn = min(value[1] for value in values)
+            self.memo[key] = (pn, dn)
+            if pn >= pn_threshold or dn >= dn_threshold or self.nodes >= self.limit:
+                return
+            # 进攻方节点沿证明数最小的子节点展开，防守方节点沿反证数最小的子节点展开
+            side = 0 if attack_node else 1
+            order = sorted(range(len(values)), key=lambda i: values[i][side])
+            best = order[0]
+            second = values[order[1]][side] if len(order) > 1 else INF
+            if attack_node:
+                child_pn = min(pn_threshold, second + 1)
+                child_dn = dn_threshold - dn + values[best][1]
+            else:
+                child_dn = min(dn_threshold, second + 1)
+                child_pn = pn_threshold - pn + values[best][0]
+            cell, child_threat = children[best]
+            self.place(cell, color)
+            self.mid(not attack_node, child_threat, child_pn, min(child_dn, INF))
+            self.remove(cell)
+
+    def principal_line(self, attack_node, threat):
+        """沿已证明的子节点取出一条获胜的落子序列 [(row, col, 颜色), ...]"""
+        line = []
+        played = []
+        while len(line) < BOARD_SIZE * BOARD_SIZE:
+            children = self.moves(attack_node, threat)
+            if children is True:
+                fives = self.scan(self.attacker)[0]
+                if not attack_node:
+                    # 防守方挡住一个成五点（禁手点挡不了），进攻方在另一个点成五；
+                    # 活三挡不住时挡住其中一个，进攻方接着冲四或做活四
+                    defender = 3 - self.attacker
+                    block = fives[0] if fives else self.block_one(threat)
+                    if block is not None and self.legal(block, defender):
+                        line.append(divmod(block, BOARD_SIZE) + (COLOR_NAMES[defender],))
+                        self.place(block, defender)
+                        played.append(block)
+                    if not fives:
+                        attack_node, threat = True, None
+                        self.limit = self.nodes + self.max_nodes
+                        self.mid(True, None, INF, INF)
+                        continue
+                    fives = self.scan(self.attacker)[0]
+                line.append(divmod(fives[0], BOARD_SIZE) + (COLOR_NAMES[self.attacker],))
+                break
+            if children is False or not children:
+                break
+            color = self.attacker if attack_node else 3 - self.attacker
+            proven = [(cell, child_threat) for cell, child_threat in children
+                      if self.lookup((self.hash ^ KEYS[color][cell][0], self.attacker, self.vct,
+                                      not attack_node, child_threat))[0] == 0]
+            if not proven:
+                break
+            # 防守方选证明最“难”的一手（备忘表中没有更多信息时取第一个）
+            cell, threat = proven[0]
+            line.append(divmod(cell, BOARD_SIZE) + (COLOR_NAMES[color],))
+            self.place(cell, color)
+            played.append(cell)
+            attack_node = not attack_node
+        for cell in reversed(played):
+            self.remove(cell)
+        return line
+
+    def solve(self, cells, attacker, mode='vcf', max_nodes=None, after=None):
+        """从 cells（长度225的格子列表，0 空、1 黑、2 白）建立局面后求解，参数和返回值同 search"""
+        self.setup(cells)
+        return self.search(attacker, mode, max_nodes, after)
+
+    def search(self, attacker, mode='vcf', max_nodes=None, after=None):
+        """在当前局面上求解 attacker（'black' 或 'white'）是否有必胜
+
+        after 为进攻方刚下的一手（格子编号）时，判断的是轮到防守方时进攻方是否仍然必胜。
+        返回 {'result': 'win'/'none'/'unknown', 'line': [(row, col, 颜色), ...], 'nodes', 'time'}。
+        """
+        start = time.perf_counter()
+        self.attacker = COLOR_CODES[attacker]
+        self.vct = mode == 'vct'
+        self.nodes = 0
+        self.limit = max_nodes or self.max_nodes
+        if len(self.memo) > MEMO_SIZE:
+            self.memo.clear()
+        attack_node = after is None
+        if after is not None and self.board.cells[after] != self.attacker:
+            raise ValueError("after 必须是进攻方已经落下的棋子")
+        self.mid(attack_node, after, INF, INF)
+        pn, dn = self.memo[(self.hash, self.attacker, self.vct, attack_node, after)]
+        result = 'win' if pn == 0 else 'none' if dn == 0 else 'unknown'
+        line = self.principal_line(attack_node, after) if result == 'win' else []
+        return {'result': result, 'line': line, 'nodes': self.nodes, 'time': time.perf_counter() - start}
+
+    def clear(self):
+        self.memo.clear()
+
+
+def cells_from_moves(moves):
+    """落子序列 [(row, col), ...]（黑白交替）-> 格子列表"""
+    cells = [EMPTY] * (BOARD_SIZE * BOARD_SIZE)
+    for ply, (row, col) in enumerate(moves):
+        cells[row * BOARD_SIZE + col] = BLACK if ply % 2 == 0 else WHITE
+    return cells
+
+
+def missed_wins(moves, rule='standard', mode='vcf', max_nodes=DEFAULT_NODES):
+    """对局后分析：返回每一次“有必胜却没有走出来”的 {'ply', 'color', 'played', 'line'}
+
+    ply 为第几手（从1开始）。某一方有必胜、实际走的这一手之后证明已经不再必胜时记为错失，
+    超出节点上限无法判断的不算。
+    """
+    solver = Solver(rule, max_nodes)
+    solver.setup()
+    missed = []
+    for ply, (row, col) in enumerate(moves):
+        color = BLACK if ply % 2 == 0 else WHITE
+        cell = row * BOARD_SIZE + col
+        result = solver.search(COLOR_NAMES[color], mode)
+        winning = cell in solver.scan(color)[0]
+        solver.place(cell, color)
+        if result['result'] != 'win' or winning or result['line'][0][:2] == (row, col):
+            continue
+        if solver.search(COLOR_NAMES[color], mode, after=cell)['result'] == 'none':
+            missed.append({'ply': ply + 1, 'color': COLOR_NAMES[color], 'played': (row, col),
+                           'line': result['line']})
+    return missed
+
+
+def parse_moves(text):
+    return [tuple(int(value) for value in move.split(',')) for move in text.split()]
+
+
+# 谜题：(名称, 局面, 进攻方, 类型, 期望结果)
+# 局面为 {'black': [(row, col), ...], 'white': [...]}，或者黑白交替的落子序列字符串（取自自我对弈中引擎错过的 VCF）
+PUZZLES = [
+    ('活四', {'black': [(7, 5), (7, 6), (7, 7)], 'white': [(0, 0), (0, 14), (14, 0)]}, 'black', 'vcf', 'win'),
+    ('冲四活三', {'black': [(7, 4), (7, 5), (7, 6), (5, 8), (6, 8)],
+                'white': [(7, 3), (0, 0), (14, 14), (0, 14), (14, 0)]}, 'black', 'vcf', 'win'),
+    ('双四', {'black': [(7, 4), (7, 5), (7, 6), (4, 7), (5, 7), (6, 7)],
+              'white': [(7, 3), (3, 7), (0, 0), (14, 14), (0, 14), (14, 0)]}, 'black', 'vcf', 'win'),
+    ('自我对弈 5 手', '7,7 8,7 7,8 7,6 9,8 6,8 8,8 10,8 9,9 5,5 6,6 10,10 9,7 9,11 9,5 9,6 7,9 5,11',
+     'black', 'vcf', 'win'),
+    ('自我对弈 9 手', '7,7 7,6 8,7 6,7 8,5 8,8 9,6 7,8 10,7 11,8 7,4 6,3 11,7 9,7 10,8 10,6 11,5 7,9 6,10 5,6 '
+                  '8,9 3,4 4,5 6,8 9,8 4,8 5,8 7,10 12,5 11,6', 'black', 'vcf', 'win'),
+    ('无解', {'black': [(7, 7), (7, 8)], 'white': [(7, 6), (7, 9)]}, 'black', 'vcf', 'none'),
+    ('三三（VCT）', {'black': [(7, 6), (7, 7), (5, 8), (6, 8)], 'white': [(0, 0), (14, 14), (0, 14), (14, 0)]},
+     'black', 'vct', 'win'),
+    ('只有活三不够（VCF）', {'black': [(7, 6), (7, 7), (5, 8), (6, 8)], 'white': [(0, 0), (14, 14), (0, 14), (14, 0)]},
+     'black', 'vcf', 'none'),
+]
+
+
+def puzzle_cells(position):
+    if isinstance(position, str):
+        return cells_from_moves(parse_moves(position))
+    cells = [EMPTY] * (BOARD_SIZE * BOARD_SIZE)
+    for color, points in position.items():
+        for row, col in points:
+            cells[row * BOARD_SIZE + col] = COLOR_CODES[color]
+    return cells
+
+
+def check_line(cells, line, rule='standard'):
+    """检查获胜序列是否合法并以五连结束"""
+    from server import check_win
+    board = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    for cell, color in enumerate(cells):
+        if color:
+            board[cell // BOARD_SIZE][cell % BOARD_SIZE] = COLOR_NAMES[color]
+    for row, col, color in line:
+        if board[row][col] is not None:
+            return False
+        board[row][col] = color
+    row, col, _ = line[-1]
+    return check_win(board, row, col)
+
+
+def benchmark(max_nodes=DEFAULT_NODES, games=20, seed=0):
+    """求解谜题并报告耗时；再对自我对弈的对局做对局后分析"""
+    from selfplay import make_policy, play_game
+
+    print(f"{'谜题':<16}{'类型':>5}  {'结果':<8}{'节点':>8}{'耗时ms':>9}  获胜序列")
+    PatternBoard()  # 先建好线型表，不计入第一道谜题的耗时
+    for name, position, attacker, mode, expected in PUZZLES:
+        cells = puzzle_cells(position)
+        solver = Solver(max_nodes=max_nodes)
+        result = solver.solve(cells, attacker, mode)
+        status = result['result'] + ('' if result['result'] == expected else ' (错误)')
+        if result['line'] and not check_line(cells, result['line']):
+            status += ' (序列无效)'
+        line = ' '.join(f"{row},{col}" for row, col, _ in result['line'])
+        print(f"{name:<16}{mode:>5}  {status:<8}{result['nodes']:>8}{result['time'] * 1000:>9.1f}  {line}")
+
+    black = make_policy('engine:noise=0.3,vcf=0')
+    white = make_policy('engine:noise=0.3,vcf=0')
+    start = time.perf_counter()
+    total_moves = 0
+    found = 0
+    for index in range(games):
+        moves, _ = play_game(black, white, seed=seed * 1000 + index)
+        total_moves += len(moves)
+        found += len(missed_wins(moves, max_nodes=max_nodes))
+    elapsed = time.perf_counter() - start
+    print(f"对局后分析 {games} 局不检查 VCF 的引擎自我对弈（{total_moves} 手）：发现 {found} 次错失的 VCF，"
+          f"{elapsed * 1000 / max(total_moves, 1):.1f} ms/手")
+
+    # 引擎落子前的快速检查：同样的对局分别在不检查和检查 VCF 时每手的耗时
+    for vcf in (0, PRECHECK_NODES):
+        black = make_policy(f'engine:noise=0.3,vcf={vcf}')
+        white = make_policy(f'engine:noise=0.3,vcf={vcf}')
+        start = time.perf_counter()
+        total_moves = 0
+        for index in range(games):
+            moves, _ = play_game(black, white, seed=seed * 1000 + index)
+            total_moves += len(moves)
+        label = f"检查 VCF（{vcf} 个节点上限）" if vcf else "不检查 VCF"
+        print(f"引擎{label}: {(time.perf_counter() - start) * 1000 / total_moves:.2f} ms/手，平均每局 {total_moves / games:.1f} 手")
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='VCF/VCT 必胜求解')
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help='节点上限')
+    parser.add_argument('--rule', choices=['standard', 'renju'], default='standard')
+    parser.add_argument('--mode', choices=['vcf', 'vct'], default='vcf')
+    subparsers = parser.add_subparsers(dest='command')
+    solve_parser = subparsers.add_parser('solve', help='求解落子序列之后轮到的一方是否必胜')
+    solve_parser.add_argument('moves', help='落子序列，如 "7,7 7,8 8,8"')
+    review_parser = subparsers.add_parser('review', help='对局后分析：找出错失的必胜')
+    review_parser.add_argument('logs', nargs='+', help='日志文件')
+    subparsers.add_parser('benchmark', help='谜题和自我对弈对局的求解耗时')
+    args = parser.parse_args()
+
+    if args.command == 'solve':
+        moves = parse_moves(args.moves)
+        color = 'black' if len(moves) % 2 == 0 else 'white'
+        result = Solver(args.rule, args.nodes).solve(cells_from_moves(moves), color, args.mode)
+        print(f"{color}: {result['result']}（{result['nodes']} 个节点，{result['time'] * 1000:.1f} ms）")
+        if result['line']:
+            print(' '.join(f"{row},{col}" for row, col, _ in result['line']))
+    elif args.command == 'review':
+        for path in args.logs:
+            moves = []
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if event.get('event_type') == 'move':
+                        moves.append(tuple(event['position']))
+            missed = missed_wins(moves, args.rule, args.mode, args.nodes)
+            print(f"{path}: {len(moves)} 手，错失必胜 {len(missed)} 次")
+            for item in missed:
+                line = ' '.join(f"{row},{col}" for row, col, _ in item['line'])
+                print(f"  第 {item['ply']} 手 {item['color']} 走了 {item['played']}，必胜序列: {line}")
+    elif args.command == 'benchmark':
+        benchmark(args.nodes)
+    else:
+        parser.print_help()
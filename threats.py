@@ -0,0 +1,194 @@
+import threading
+
+from renju import (PatternBoard, BOARD_SIZE, EMPTY, BLACK, WHITE, COLORS, AFFECTED, FIVE, OVERLINE,
+                   FOUR_SHIFT, FREE_FOUR_SHIFT, THREE_EXACT, THREE_FREE)
+
+# 威胁分析
+#
+# 对每个空点、每种颜色判断“在这里落子能形成什么”：成五、冲四（或活四）、活三。
+# 判断直接查 renju 的线型表，PatternBoard 落子时只更新受影响的至多 4 * 10 个点的线编码，
+# 所以每手棋之后也只需要重新判断这些点，不必扫描整个棋盘。
+# 对方有成五点而己方没有时，这些点就是必须防守的点。
+
+THREE, FOUR, WIN = 1, 2, 3  # 威胁等级
+LEVEL_NAMES = {THREE: 'three', FOUR: 'four', WIN: 'win'}
+COLOR_NAMES = {BLACK: 'black', WHITE: 'white'}
+
+
+class ThreatAnalyzer:
+    """增量维护双方每个空点的威胁等级"""
+
+    def __init__(self, rule='standard'):
+        self.rule = rule
+        self.reset()
+
+    def reset(self, board=None):
+        """从二维棋盘重建并逐点分析，board 为空时清空棋盘"""
+        self.board = PatternBoard.from_board(board) if board else PatternBoard()
+        self.points = [None, {}, {}]  # points[颜色]：点 -> 威胁等级
+        for cell in range(BOARD_SIZE * BOARD_SIZE):
+            self.classify(cell)
+
+    def level(self, cell, color):
+        """color 在 cell 落子后的威胁等级，0 表示没有威胁"""
+        board = self.board
+        table = board.table
+        codes = board.codes[color]
+        flags = [table[codes[d][cell]] for d in range(4)]
+        if self.rule == 'renju' and color == BLACK:
+            # 连珠规则下黑棋只有恰好五连才算赢，禁手点不算威胁
+            if any(f & FIVE for f in flags):
+                return WIN
+            if board.forbidden(*divmod(cell, BOARD_SIZE)):
+                return 0
+            if any((f >> FOUR_SHIFT) & 3 for f in flags):
+                return FOUR
+            if any(f & THREE_EXACT for f in flags):
+                return THREE
+            return 0
+        if any(f & (FIVE | OVERLINE) for f in flags):
+            return WIN
+        if any((f >> FREE_FOUR_SHIFT) & 3 for f in flags):
+            return FOUR
+        if any(f & THREE_FREE for f in flags):
+            return THREE
+        return 0
+
+    def classify(self, cell):
+        """重新判断一个点双方的威胁等级"""
+        empty = self.board.cells[cell] == EMPTY
+        for color in (BLACK, WHITE):
+            level = self.level(cell, color) if empty else 0
+            if level:
+                self.points[color][cell] = level
+            else:
+                self.points[color].pop(cell, None)
+
+    def _affected(self, cell):
+        cells = {cell}
+        for d in range(4):
+            cells.update(n for n, _ in AFFECTED[d][cell])
+        return cells
+
+    def place(self, row, col, color):
+        """落子并增量更新威胁，color 为 BLACK 或 WHITE"""
+        cell = row * BOARD_SIZE + col
+        self.board.place(row, col, color)
+        for n in self._affected(cell):
+            self.classify(n)
+
+    def remove(self, row, col):
+        cell = row * BOARD_SIZE + col
+        self.board.remove(row, col)
+        for n in self._affected(cell):
+            self.classify(n)
+
+    def sync(self, board):
+        """与客户端的二维棋盘同步：只有新增的棋子时增量更新，否则（如新开一局）重建"""
+        cells = self.board.cells
+        added = []
+        for row in range(BOARD_SIZE):
+            board_row = board[row]
+            for col in range(BOARD_SIZE):
+                value = COLORS.get(board_row[col], EMPTY)
+                if value != cells[row * BOARD_SIZE + col]:
+                    if cells[row * BOARD_SIZE + col] != EMPTY:
+                        self.reset(board)
+                        return len(added)
+                    added.append((row, col, value))
+        for row, col, value in added:
+            self.place(row, col, value)
+        return len(added)
+
+    def analysis(self, to_move):
+        """返回给界面使用的分析结果
+
+        {'black': {'win': [...], 'four': [...], 'three': [...]}, 'white': {...}, 'forced': [...]}
+        forced 为轮到的一方必须防守的点（对方的成五点，己方能直接成五时为空）。
+        """
+        result = {}
+        for color in (BLACK, WHITE):
+            levels = {name: [] for name in LEVEL_NAMES.values()}
+            for cell, level in self.points[color].items():
+                levels[LEVEL_NAMES[level]].append(divmod(cell, BOARD_SIZE))
+            result[COLOR_NAMES[color]] = levels
+        result['forced'] = []
+        if to_move in COLORS:
+            own = result[to_move]['win']
+            other = result['white' if to_move == 'black' else 'black']['win']
+            if not own:
+                result['forced'] = list(other)
+        return result
+
+
+class ThreatWorker:
+    """后台分析线程：绘制循环只读取最新的结果，不会被分析阻塞"""
+
+    def __init__(self, rule='standard'):
+        self.analyzer = ThreatAnalyzer(rule)
+        self.condition = threading.Condition()
+        self.pending = None  # 等待分析的 (棋盘, 轮到的一方, 规则)，只保留最新的一个
+        self.result = None  # 最新的分析结果，由绘制循环读取
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, board, to_move, rule='standard'):
+        """提交新局面，复制一份棋盘以免接收线程随后修改"""
+        with self.condition:
+            self.pending = ([row[:] for row in board], to_move, rule)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                board, to_move, rule = self.pending
+                self.pending = None
+            try:
+                if rule != self.analyzer.rule:
+                    self.analyzer = ThreatAnalyzer(rule)
+                self.analyzer.sync(board)
+                self.result = self.analyzer.analysis(to_move)
+            except Exception as e:
+                print(f"威胁分析出错: {e}")
+
+
+def benchmark(games=50, moves_per_game=60, seed=0):
+    """测量每手棋增量更新威胁的耗时，与每手重新分析整个棋盘对比"""
+    import random
+    import time
+
+    rng = random.Random(seed)
+    incremental = full = 0.0
+    moves = 0
+    for _ in range(games):
+        analyzer = ThreatAnalyzer()
+        board = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+        for ply, cell in enumerate(rng.sample(range(BOARD_SIZE * BOARD_SIZE), moves_per_game)):
+            row, col = divmod(cell, BOARD_SIZE)
+            color = BLACK if ply % 2 == 0 else WHITE
+            board[row][col] = COLOR_NAMES[color]
+            to_move = COLOR_NAMES[BLACK + WHITE - color]
+
+            start = time.perf_counter()
+            analyzer.place(row, col, color)
+            analyzer.analysis(to_move)
+            incremental += time.perf_counter() - start
+
+            start = time.perf_counter()
+            rebuilt = ThreatAnalyzer()
+            rebuilt.reset(board)
+            rebuilt.analysis(to_move)
+            full += time.perf_counter() - start
+            moves += 1
+        assert rebuilt.points == analyzer.points
+
+    print(f"{games} 局随机对局，共 {moves} 手")
+    print(f"增量更新 + 生成结果: {incremental * 1000 / moves:.3f} ms/手")
+    print(f"每手重新分析整个棋盘: {full * 1000 / moves:.3f} ms/手（{full / incremental:.0f} 倍）")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,197 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 分层时间轮
+#
+# 每层有 SLOTS 个槽，第 0 层每个槽代表一个 tick，第 n 层每个槽代表 SLOTS^n 个 tick。
+# 定时器按到期时间放入能容纳它的最低一层；第 0 层转完一圈时，把上一层当前槽里的
+# 定时器重新分配到下层（级联）。每个 tick 只处理一个槽，加入和取消定时器都是 O(1)，
+# 因此连接数再多，每个 tick 的开销也只和真正到期的定时器有关。
+# 回调在时间轮线程中执行，必须很快返回；可能阻塞的回调（向客户端发送数据、等待房间的锁）
+# 用 schedule_blocking 安排，到期后交给线程池执行，一个不读数据的客户端不会让整个进程的定时器停下来。
+
+TICK = 0.1  # 每个 tick 的时长（秒）
+SLOTS = 256  # 每层的槽数
+LEVELS = 3  # 层数，可覆盖 256^3 个 tick（约19天）
+BLOCKING_THREADS = 32  # 执行可能阻塞的回调的线程数
+
+
+class Timer:
+    """时间轮中的一个定时器"""
+    __slots__ = ('expires', 'callback', 'args', 'cancelled')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires  # 到期的 tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        # 延迟删除：到期时发现已取消直接丢弃
+        self.cancelled = True
+
+
+class TimerWheel:
+    """分层时间轮，所有连接的超时和心跳共用一个"""
+
+    def __init__(self, tick=TICK, slots=SLOTS, levels=LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = 0  # 已经处理到的 tick
+        self.origin = time.monotonic()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.executor = None  # 执行可能阻塞的回调的线程池，第一次使用时创建
+
+    def _add(self, timer):
+        """把定时器放入合适的层和槽（调用方持有锁）"""
+        delta = max(timer.expires - self.current, 1)
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                # 超出最高层范围的定时器先放在最高层最远的槽里，级联时再重新计算
+                expires = min(timer.expires, self.current + span * self.slots - 1)
+                slot = (expires // span) % self.slots
+                self.wheels[level][slot].append(timer)
+                return
+            span *= self.slots
+
+    def schedule(self, delay, callback, *args):
+        """delay 秒后调用 callback(*args)，返回可取消的定时器"""
+        with self.lock:
+            ticks = max(int(delay / self.tick + 0.5), 1)
+            timer = Timer(self.current + ticks, callback, args)
+            self._add(timer)
+        return timer
+
+    def schedule_blocking(self, delay, callback, *args):
+        """与 schedule 相同，但到期后把回调交给线程池执行，不占用时间轮线程"""
+        return self.schedule(delay, self._hand_off, callback, args)
+
+    def _hand_off(self, callback, args):
+        # 只在执行 advance 的线程中调用，不需要加锁
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(BLOCKING_THREADS, thread_name_prefix='timer')
+        self.executor.submit(self._run_blocking, callback, args)
+
+    @staticmethod
+    def _run_blocking(callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"定时器回调出错: {e}")
+
+    def _cascade(self, level):
+        """把第 level 层当前槽中的定时器重新分配到下层"""
+        span = self.slots ** level
+        slot = (self.current // span) % self.slots
+        timers = self.wheels[level][slot]
+        self.wheels[level][slot] = []
+        for timer in timers:
+            if not timer.cancelled:
+                self._add(timer)
+
+    def advance(self, now=None):
+        """推进时间轮到当前时间，执行所有到期的定时器，返回执行的数量"""
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.origin) / self.tick)
+        expired = []
+        with self.lock:
+            while self.current < target:
+                self.current += 1
+                # 第 0 层转完一圈时从上层级联
+                span = self.slots
+                for level in range(1, self.levels):
+                    if self.current % span:
+                        break
+                    self._cascade(level)
+                    span *= self.slots
+                slot = self.current % self.slots
+                timers = self.wheels[0][slot]
+                self.wheels[0][slot] = []
+                for timer in timers:
+                    if timer.cancelled:
+                        continue
+                    if timer.expires <= self.current:
+                        expired.append(timer)
+                    else:
+                        self._add(timer)
+        # 在锁外执行回调，回调中可以再次 schedule
+        for timer in expired:
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"定时器回调出错: {e}")
+        return len(expired)
+
+    def run(self):
+        while True:
+            time.sleep(self.tick)
+            self.advance()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        return self
+
+
+_default_wheel = None
+_default_lock = threading.Lock()
+
+
+def get_wheel():
+    """进程内共享的时间轮，第一次使用时启动"""
+    global _default_wheel
+    with _default_lock:
+        if _default_wheel is None:
+            _default_wheel = TimerWheel().start()
+    return _default_wheel
+
+
+def benchmark(connections=100000, ticks=600):
+    """测量10万个连接的空闲定时器在时间轮上每个 tick 的开销"""
+    import random
+
+    wheel = TimerWheel()
+    rng = random.Random(0)
+    fired = [0]
+
+    def on_idle(conn):
+        fired[0] += 1
+        # 模拟心跳：到期后重新安排下一次检查
+        wheel.schedule(15, on_idle, conn)
+
+    start = time.perf_counter()
+    timers = [wheel.schedule(rng.uniform(1, 45), on_idle, conn) for conn in range(connections)]
+    schedule_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for timer in timers[::10]:
+        timer.cancel()
+    cancel_time = time.perf_counter() - start
+
+    # 直接推进逻辑时间，不真的等待
+    tick_times = []
+    for i in range(1, ticks + 1):
+        start = time.perf_counter()
+        wheel.advance(wheel.origin + i * wheel.tick + wheel.tick / 2)
+        tick_times.append(time.perf_counter() - start)
+
+    tick_times.sort()
+    total = sum(tick_times)
+    print(f"连接数: {connections}，模拟 {ticks} 个 tick（{ticks * wheel.tick:.0f} 秒）")
+    print(f"安排定时器: {schedule_time * 1e6 / connections:.2f} 微秒/个，取消: {cancel_time * 1e6 / len(timers[::10]):.2f} 微秒/个")
+    print(f"触发 {fired[0]} 次回调，每个 tick 平均 {total * 1000 / ticks:.3f} ms，"
+          f"中位数 {tick_times[ticks // 2] * 1000:.3f} ms，最大 {tick_times[-1] * 1000:.3f} ms")
+    print(f"每次回调平均开销（含重新安排）: {total * 1e6 / max(fired[0], 1):.2f} 微秒")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,305 @@
+import os
+import json
+import math
+import random
+import time
+import multiprocessing
+
+from server import check_win
+from renju import PatternBoard, BOARD_SIZE, COLORS
+from selfplay import make_policy, parse_policy, play_game, DEFAULT_POLICY
+from positions import canonical_hash
+from record import read_records
+
+# 引擎对抗赛
+#
+# 两种策略配置 A、B 在进程池中对局，每个开局下一对棋：A 执黑一局、B 执黑一局，消除先手优势。
+# 开局取自历史对局的前几手（按对称去重），再在已有棋子附近随机加上几手，使每一对棋的开局都不相同；
+# 否则不加扰动的引擎从同一个开局总是下出同一盘棋，重复的结果会被当作独立的样本计入检验。
+# 对局规则与服务器相同（selfplay.play_game）。
+# 每收到一对结果就做一次序贯概率比检验（SPRT）：H0 为 A 比 B 强 elo0，H1 为强 elo1，
+# 对数似然比越过上下界时立即停止，而不是下满固定的局数。
+# 似然比用按对统计的近似（GSPRT）：每对 A 的得分为 0、0.25、0.5、0.75、1 之一，
+# LLR ≈ N (s1 - s0) (2 x̄ - s0 - s1) / (2 σ²)，x̄、σ² 为每对得分的均值和方差。
+
+OPENING_PLIES = 4  # 开局取历史对局的前几手
+PRIOR = 0.1  # 每种对局对结果预先加上的虚拟次数，避免前几对结果完全相同时方差为0
+RANDOM_PLIES = 2  # 每对棋在历史开局之后随机加上的手数
+RANDOM_RANGE = 2  # 随机的一手与已有棋子的最大距离
+OPENING_ATTEMPTS = 20  # 随机出的开局与之前的重复时最多重试几次
+
+
+def load_openings(sources=('game_logs',), plies=OPENING_PLIES, rule='standard'):
+    """从日志目录或 .gkr 棋谱中取出不重复的开局（对称的算同一个），返回 [[(row, col), ...], ...]"""
+    openings = []
+    seen = set()
+
+    def add(cells):
+        if len(cells) <= plies:
+            return  # 开局内就结束的对局
+        cells = cells[:plies]
+        key = canonical_hash(cells)[0]
+        if key in seen:
+            return
+        if rule == 'renju':
+            board = PatternBoard()
+            for ply, cell in enumerate(cells):
+                if ply % 2 == 0 and board.forbidden(*divmod(cell, BOARD_SIZE)):
+                    return
+                board.place(*divmod(cell, BOARD_SIZE), COLORS['black'] if ply % 2 == 0 else COLORS['white'])
+        seen.add(key)
+        openings.append([divmod(cell, BOARD_SIZE) for cell in cells])
+
+    for source in sources:
+        if source.endswith('.gkr') and os.path.exists(source):
+            for record in read_records(source):
+                add(list(record['moves'][:plies + 1]))
+        elif os.path.isdir(source):
+            for name in sorted(entry.name for entry in os.scandir(source) if entry.name.endswith('.json')):
+                cells = []
+                with open(os.path.join(source, name), encoding='utf-8') as f:
+                    for line in f:
+                        if '"move"' not in line:
+                            continue
+                        try:
+                            row, col = json.loads(line)['position']
+                        except (ValueError, KeyError):
+                            continue
+                        cells.append(row * BOARD_SIZE + col)
+                        if len(cells) > plies:
+                            break
+                add(cells)
+    return openings
+
+
+def random_opening(opening, plies, rng, rule='standard'):
+    """在开局之后随机加上 plies 手，落在已有棋子附近（空棋盘时在天元附近），不成五、不下禁手"""
+    board = [[None] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+    referee = PatternBoard() if rule == 'renju' else None
+    moves = list(opening)
+    for ply, (row, col) in enumerate(moves):
+        color = 'black' if ply % 2 == 0 else 'white'
+        board[row][col] = color
+        if referee:
+            referee.place(row, col, COLORS[color])
+    for ply in range(len(moves), len(moves) + plies):
+        color = 'black' if ply % 2 == 0 else 'white'
+        centers = moves or [(BOARD_SIZE // 2, BOARD_SIZE // 2)]
+        cells = sorted({(r, c) for row, col in centers
+                        for r in range(max(row - RANDOM_RANGE, 0), min(row + RANDOM_RANGE + 1, BOARD_SIZE))
+                        for c in range(max(col - RANDOM_RANGE, 0), min(col + RANDOM_RANGE + 1, BOARD_SIZE))
+                        if board[r][c] is None})
+        rng.shuffle(cells)
+        for row, col in cells:
+            if referee and color == 'black' and referee.forbidden(row, col):
+                continue
+            board[row][col] = color
+            if check_win(board, row, col):
+                board[row][col] = None
+                continue
+            break
+        else:
+            break  # 附近没有可下的点，开局就停在这里
+        moves.append((row, col))
+        if referee:
+            referee.place(row, col, COLORS[color])
+    return moves
+
+
+def pair_openings(openings, count, rng, plies=RANDOM_PLIES, rule='standard'):
+    """为 count 对棋各生成一个开局：依次轮换历史开局并随机加上 plies 手，尽量不重复（对称的算重复）
+
+    返回的开局数可能少于 count：plies 为0或随机出的开局都已用过时，只返回互不相同的开局。
+    """
+    result = []
+    seen = set()
+    for index in range(count):
+        base = openings[index % len(openings)]
+        for _ in range(OPENING_ATTEMPTS if plies else 1):
+            moves = random_opening(base, plies, rng, rule)
+            key = canonical_hash([row * BOARD_SIZE + col for row, col in moves])[0]
+            if key not in seen:
+                seen.add(key)
+                result.append(moves)
+                break
+        else:
+            if not plies and len(result) >= len(openings):
+                break
+    return result
+
+
+def deterministic(spec):
+    """该策略在同一个局面下是否总是走同一手（不是随机策略且没有扰动）"""
+    name, params = parse_policy(spec)
+    return name != 'random' and not params.get('noise')
+
+
+_policies = {}  # 工作进程中缓存的策略对象
+
+
+def _policy(spec, rule):
+    policy = _policies.get((spec, rule))
+    if policy is None:
+        policy = _policies[(spec, rule)] = make_policy(spec, rule)
+    return policy
+
+
+def play_pair(task):
+    """工作进程：用同一个开局下一对棋，返回 A 的得分（0、0.5、1、1.5、2）和双方胜负"""
+    spec_a, spec_b, rule, seed, opening = task
+    a = _policy(spec_a, rule)
+    b = _policy(spec_b, rule)
+    if spec_a == spec_b:
+        b = make_policy(spec_b, rule)  # 同一配置自己对自己时需要两个对象
+    score = 0.0
+    results = []
+    for black, white, a_color in ((a, b, 'black'), (b, a, 'white')):
+        _, winner = play_game(black, white, rule, seed, opening)
+        score += 1 if winner == a_color else 0.5 if winner is None else 0
+        results.append(winner)
+    return score, results
+
+
+def elo(score):
+    """期望得分 -> Elo 差"""
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected(elo_difference):
+    return 1 / (1 + 10 ** (-elo_difference / 400))
+
+
+class SPRT:
+    """按对统计的序贯概率比检验"""
+
+    def __init__(self, elo0=0, elo1=20, alpha=0.05, beta=0.05):
+        self.s0 = expected(elo0)
+        self.s1 = expected(elo1)
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.counts = [0] * 5  # A 在一对中得 0、0.5、1、1.5、2 分的次数
+
+    def add(self, pair_score):
+        self.counts[int(pair_score * 2)] += 1
+
+    @property
+    def pairs(self):
+        return sum(self.counts)
+
+    def stats(self):
+        """(每对得分的均值, 方差, 有效对数)，含先验的虚拟次数"""
+        counts = [count + PRIOR for count in self.counts]
+        total = sum(counts)
+        mean = sum(count * index / 4 for index, count in enumerate(counts)) / total
+        variance = sum(count * (index / 4 - mean) ** 2 for index, count in enumerate(counts)) / total
+        return mean, variance, total
+
+    def llr(self):
+        mean, variance, total = self.stats()
+        return total * (self.s1 - self.s0) * (2 * mean - self.s0 - self.s1) / (2 * variance)
+
+    def decision(self):
+        """'H1'（A 更强）、'H0'（没有达到 elo1）或 None（还需要更多对局）"""
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+    def elo_interval(self):
+        """Elo 差的估计值和 95% 置信区间"""
+        mean, variance, total = self.stats()
+        margin = 1.96 * math.sqrt(variance / total)
+        return elo(mean), elo(mean - margin), elo(mean + margin)
+
+
+def run(spec_a, spec_b=DEFAULT_POLICY, max_games=2000, rule='standard', workers=None, seed=0,
+        sources=('game_logs',), plies=OPENING_PLIES, elo0=0, elo1=20, alpha=0.05, beta=0.05, progress=0,
+        random_plies=RANDOM_PLIES):
+    """进行对抗赛直到 SPRT 得出结论或下满 max_games 局，返回结果字典"""
+    workers = workers or os.cpu_count() or 1
+    openings = load_openings(sources, plies, rule) or [[]]
+    rng = random.Random(seed)
+    rng.shuffle(openings)
+    pairs = max(max_games // 2, 1)
+    openings = pair_openings(openings, pairs, rng, random_plies, rule)
+    distinct = len(openings)
+    if distinct < pairs:
+        if deterministic(spec_a) and deterministic(spec_b):
+            # 双方都不加扰动时重复的开局只会重复同样的结果
+            print(f"警告: 只有 {len(openings)} 个不同的开局，双方都没有随机性，最多只下 {len(openings) * 2} 局")
+        else:
+            openings = [openings[index % len(openings)] for index in range(pairs)]
+    tasks = [(spec_a, spec_b, rule, seed * 1000003 + index, opening) for index, opening in enumerate(openings)]
+    sprt = SPRT(elo0, elo1, alpha, beta)
+    wins = {'a': 0, 'b': 0, 'draw': 0}
+    decision = None
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        for score, results in pool.imap_unordered(play_pair, tasks):
+            sprt.add(score)
+            for winner, a_color in zip(results, ('black', 'white')):
+                wins['draw' if winner is None else 'a' if winner == a_color else 'b'] += 1
+            if progress and sprt.pairs % progress == 0:
+                estimate, low, high = sprt.elo_interval()
+                print(f"{sprt.pairs * 2} 局: A {wins['a']} 胜 {wins['b']} 负 {wins['draw']} 和，"
+                      f"Elo {estimate:+.0f} [{low:+.0f}, {high:+.0f}]，LLR {sprt.llr():.2f}")
+            decision = sprt.decision()
+            if decision:
+                break  # 退出 with 时终止还在进行的对局
+    elapsed = time.perf_counter() - start
+    estimate, low, high = sprt.elo_interval()
+    return {
+        'games': sprt.pairs * 2,
+        'elapsed': elapsed,
+        'wins': wins,
+        'elo': estimate,
+        'interval': (low, high),
+        'llr': sprt.llr(),
+        'bounds': (sprt.lower, sprt.upper),
+        'decision': decision,
+        'openings': distinct
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='两种引擎配置的对抗赛（SPRT 提前停止）')
+    parser.add_argument('a', help="配置 A，如 engine:defense=1.2")
+    parser.add_argument('b', nargs='?', default=DEFAULT_POLICY, help=f"配置 B，默认 {DEFAULT_POLICY}")
+    parser.add_argument('--games', type=int, default=2000, help='最多对局数')
+    parser.add_argument('--rule', choices=['standard', 'renju'], default='standard')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认为CPU核数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--openings', nargs='*', default=['game_logs'], help='开局来源：日志目录或 .gkr 棋谱')
+    parser.add_argument('--opening-plies', type=int, default=OPENING_PLIES)
+    parser.add_argument('--random-plies', type=int, default=RANDOM_PLIES, help='历史开局之后随机加上的手数')
+    parser.add_argument('--elo0', type=float, default=0)
+    parser.add_argument('--elo1', type=float, default=20)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--progress', type=int, default=50, help='每多少对打印一次进度，0 为不打印')
+    args = parser.parse_args()
+    for spec in (args.a, args.b):
+        try:
+            parse_policy(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    result = run(args.a, args.b, args.games, args.rule, args.workers, args.seed, args.openings,
+                 args.opening_plies, args.elo0, args.elo1, args.alpha, args.beta, args.progress, args.random_plies)
+    wins = result['wins']
+    low, high = result['interval']
+    print(f"{result['games']} 局（{result['openings']} 个开局），用时 {result['elapsed']:.1f} 秒，"
+          f"{result['games'] / result['elapsed']:.1f} 局/秒")
+    print(f"A {wins['a']} 胜 {wins['b']} 负 {wins['draw']} 和，Elo {result['elo']:+.1f} "
+          f"（95% 区间 [{low:+.1f}, {high:+.1f}]，±{(high - low) / 2:.1f}）")
+    print(f"LLR {result['llr']:.2f}（下界 {result['bounds'][0]:.2f}，上界 {result['bounds'][1]:.2f}）")
+    if result['decision'] == 'H1':
+        print(f"结论: A 比 B 强（至少 {args.elo1:g} Elo 的假设成立）")
+    elif result['decision'] == 'H0':
+        print(f"结论: A 没有比 B 强 {args.elo1:g} Elo")
+    else:
+        print("结论: 达到最多对局数仍不显著")